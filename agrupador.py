@@ -0,0 +1,397 @@
+import io
+import os
+import tempfile
+from datetime import date, datetime
+
+import pandas as pd
+import xlsxwriter
+from pandas.io.parsers import TextParser
+
+import paginacion
+from instrumentacion import instrumentar
+
+# Lógica del Agrupador Pro (ERP), sin dependencias de Streamlit para poder
+# usarla también desde benchmarks y procesos por lotes. La interfaz vive en app.py.
+
+# --- ESTILOS VISUALES ---
+CABIFY_PURPLE = '#7145D6'
+CABIFY_LIGHT  = '#F3F0FA'
+CABIFY_ACCENT = '#B89EF7'
+WHITE         = '#FFFFFF'
+
+HOJA_REPORTE = "Reporte Detallado"
+
+# ==============================================================================
+# LÓGICA DE LIMPIEZA (NUEVO)
+# ==============================================================================
+
+@instrumentar()
+def limpiar_datos_erp(df, col_agrupacion, relleno_inicial=None):
+    """
+    1. Rellena los huecos vacíos hacia abajo (para ERPs que dejan celdas en blanco).
+    2. Elimina las filas que ya son totales en el archivo original.
+    `relleno_inicial` es el último valor del bloque anterior cuando se limpia por bloques.
+    """
+    df_clean = df.copy()
+    
+    # 1. Rellenar hacia abajo (Forward Fill)
+    # Esto sirve cuando el ERP pone el nombre de la cuenta solo en la primera fila del grupo
+    df_clean[col_agrupacion] = df_clean[col_agrupacion].ffill()
+    if relleno_inicial is not None:
+        df_clean[col_agrupacion] = df_clean[col_agrupacion].fillna(relleno_inicial)
+    
+    # 2. Eliminar filas basura (Totales nativos del ERP)
+    # Buscamos filas donde la columna de agrupación empiece por "Total" o "Saldo"
+    mascara_totales = df_clean[col_agrupacion].astype(str).str.contains(r'^(?:TOTAL|Total|Sum|Saldo)', na=False, regex=True)
+    
+    # Invertimos la máscara para quedarnos con lo que NO es total
+    df_clean = df_clean[~mascara_totales]
+    
+    return df_clean
+
+# ==============================================================================
+# LECTURA POR BLOQUES
+# ==============================================================================
+# Con calamine (por defecto, el más rápido) la hoja se carga completa en memoria
+# y los bloques solo acotan el parseo a DataFrame. Con memoria_acotada (o
+# ORDEN_LECTURA_ACOTADA=1) se recorre la hoja con openpyxl read_only y la memoria
+# queda en el orden de un bloque, a cambio de una lectura varias veces más lenta.
+
+TAMANO_BLOQUE = 50_000
+MEMORIA_ACOTADA = os.environ.get('ORDEN_LECTURA_ACOTADA', '0') != '0'
+
+def _celda_calamine(valor):
+    """Misma conversión que pandas aplica a las celdas de calamine."""
+    if isinstance(valor, float):
+        entero = int(valor) if valor == valor and abs(valor) != float('inf') else None
+        return entero if entero == valor else valor
+    if isinstance(valor, date) and not isinstance(valor, datetime):
+        return datetime(valor.year, valor.month, valor.day)
+    return valor
+
+def _celda_openpyxl(valor):
+    if valor is None: return ''
+    if isinstance(valor, float) and valor.is_integer(): return int(valor)
+    return valor
+
+def _filas_excel(file_obj, memoria_acotada=None):
+    """Itera (filas, total_filas o None) de la primera hoja sin cargar el libro en pandas."""
+    if memoria_acotada is None: memoria_acotada = MEMORIA_ACOTADA
+    if hasattr(file_obj, 'seek'): file_obj.seek(0)
+    if not memoria_acotada:
+        try:
+            from python_calamine import CalamineWorkbook
+            hoja = CalamineWorkbook.from_filelike(file_obj).get_sheet_by_index(0)
+            return (list(map(_celda_calamine, fila)) for fila in hoja.iter_rows()), hoja.height
+        except Exception:
+            if hasattr(file_obj, 'seek'): file_obj.seek(0)
+    # openpyxl en modo read_only: recorre el XML sin construir el libro completo
+    import openpyxl
+    hoja = openpyxl.load_workbook(file_obj, read_only=True, data_only=True).worksheets[0]
+    return (list(map(_celda_openpyxl, fila)) for fila in hoja.iter_rows(values_only=True)), hoja.max_row
+
+def leer_excel_por_bloques(file_obj, tamano_bloque=TAMANO_BLOQUE, max_bloques=None, memoria_acotada=None):
+    """
+    Generador de (df_bloque, filas_leidas, total_filas). La primera fila es la cabecera.
+    Los tipos se infieren de las primeras TAMANO_BLOQUE filas (como leer_muestra) y los
+    bloques siguientes se igualan a ellos, así el resultado no depende de tamano_bloque.
+    total_filas puede ser None si el formato no lo informa.
+    """
+    filas, total = _filas_excel(file_obj, memoria_acotada)
+    df, columnas = _parsear_bloque([fila for _, fila in zip(range(TAMANO_BLOQUE + 1), filas)], None)
+    if columnas is None or len(df) == 0:
+        yield df, 0, total
+        return
+    tipos, leidas, bloques = df.dtypes, 0, 0
+    # La muestra se entrega en bloques completos; lo que sobra se junta con las filas siguientes
+    completos = len(df) - len(df) % tamano_bloque
+    for inicio in range(0, completos, tamano_bloque):
+        bloque = df.iloc[inicio:inicio + tamano_bloque].copy() if len(df) > tamano_bloque else df
+        leidas += len(bloque); bloques += 1
+        yield bloque, leidas, total
+        if max_bloques and bloques >= max_bloques: return
+    resto = df.iloc[completos:]
+    pendiente = []
+    for fila in filas:
+        pendiente.append(fila)
+        if len(pendiente) + len(resto) >= tamano_bloque:
+            bloque = _bloque_tipado(pendiente, columnas, tipos, resto)
+            leidas += len(bloque); pendiente = []; resto = resto.iloc[:0]; bloques += 1
+            yield bloque, leidas, total
+            if max_bloques and bloques >= max_bloques: return
+    if pendiente or len(resto):
+        bloque = _bloque_tipado(pendiente, columnas, tipos, resto)
+        yield bloque, leidas + len(bloque), total
+
+def _parsear_bloque(filas, columnas):
+    if columnas is None:
+        if not filas: return pd.DataFrame(), None
+        df = TextParser(filas, header=0).read()
+        return df, list(df.columns)
+    ancho = len(columnas)
+    filas = [f[:ancho] + [''] * (ancho - len(f)) for f in filas]
+    return TextParser(filas, header=None, names=columnas).read(), columnas
+
+def _bloque_tipado(filas, columnas, tipos, resto):
+    """Parsea las filas con los tipos de la muestra, antecedidas por el resto de la muestra."""
+    if not filas: return resto.reset_index(drop=True)
+    df, _ = _parsear_bloque(filas, columnas)
+    for col, tipo in tipos.items():
+        if df[col].dtype != tipo and _conversion_segura(df[col], tipo):
+            try:
+                df[col] = df[col].astype(tipo)
+            except (TypeError, ValueError):
+                pass
+    return pd.concat([resto, df], ignore_index=True) if len(resto) else df
+
+def _conversion_segura(serie, tipo):
+    """True si llevar la serie al tipo de la muestra no cambia sus valores."""
+    api = pd.api.types
+    if serie.isna().all(): return True
+    actual = serie.dtype
+    if api.is_float_dtype(tipo): return api.is_integer_dtype(actual) or api.is_bool_dtype(actual)
+    if api.is_object_dtype(tipo): return api.is_string_dtype(actual)
+    if api.is_string_dtype(tipo): return api.is_object_dtype(actual) and serie.dropna().map(type).eq(str).all()
+    return False
+
+def leer_muestra(file_obj, filas=TAMANO_BLOQUE, memoria_acotada=None):
+    """Primer bloque del archivo: alcanza para las columnas y sus tipos en la configuración."""
+    df, _, total = next(leer_excel_por_bloques(file_obj, filas, max_bloques=1, memoria_acotada=memoria_acotada))
+    if total: df.attrs['total_filas'] = total - 1  # sin la cabecera
+    return df
+
+def leer_y_limpiar_por_bloques(file_obj, col_agrupacion=None, progreso=None, tamano_bloque=TAMANO_BLOQUE,
+                               memoria_acotada=None):
+    """
+    Lee el archivo por bloques aplicando limpiar_datos_erp a cada uno (si col_agrupacion)
+    y arrastrando el último valor de la columna entre bloques. progreso(leidas, total)
+    se llama tras cada bloque. Devuelve (df_limpio, filas_de_datos_antes_de_limpiar).
+    """
+    partes, arrastre, filas_datos = [], None, 0
+    for bloque, leidas, total in leer_excel_por_bloques(file_obj, tamano_bloque, memoria_acotada=memoria_acotada):
+        filas_datos += len(bloque)
+        if col_agrupacion is not None and col_agrupacion in bloque.columns:
+            presentes = bloque[col_agrupacion].dropna()
+            limpio = limpiar_datos_erp(bloque, col_agrupacion, arrastre)
+            if len(presentes): arrastre = presentes.iloc[-1]
+            bloque = limpio
+        partes.append(bloque)
+        if progreso: progreso(leidas, total)
+    df = pd.concat(partes, ignore_index=True) if len(partes) > 1 else partes[0].reset_index(drop=True)
+    return df, filas_datos
+
+# ==============================================================================
+# VISTA PREVIA AGRUPADA (SIN GENERAR EL EXCEL)
+# ==============================================================================
+
+@instrumentar()
+def totales_por_grupo(df_ordenado, col_g1, col_g2, cols_sum):
+    """
+    Totales N2 en una sola agregación sobre el frame de ordenar_para_reporte, con
+    FILAS, INICIO y FIN (rango de sus detalles, los grupos son contiguos).
+    Devuelve (totales_n2, totales_n1); los N1 salen de sumar los N2 y sus
+    N2_INICIO / N2_FIN son el rango de sus filas en totales_n2.
+    """
+    agrupado = df_ordenado.groupby([col_g1, col_g2], sort=False, observed=True)
+    tot_n2 = agrupado[cols_sum].sum()
+    tot_n2.insert(0, 'FILAS', agrupado.size())
+    tot_n2['FIN'] = tot_n2['FILAS'].cumsum()
+    tot_n2['INICIO'] = tot_n2['FIN'] - tot_n2['FILAS']
+    tot_n2 = tot_n2.reset_index()
+    tot_n1 = tot_n2.groupby(col_g1, sort=False)[['FILAS'] + cols_sum].sum()
+    tot_n1.insert(1, 'GRUPOS', tot_n2.groupby(col_g1, sort=False).size())
+    tot_n1['N2_FIN'] = tot_n1['GRUPOS'].cumsum()
+    tot_n1['N2_INICIO'] = tot_n1['N2_FIN'] - tot_n1['GRUPOS']
+    return tot_n2, tot_n1.reset_index()
+
+def pagina_detalle(df_ordenado, fila_n2, pagina=0, tamano_pagina=100):
+    """Filas de detalle de un grupo N2 (una fila de totales_n2), paginadas."""
+    inicio = int(fila_n2['INICIO']) + pagina * tamano_pagina
+    fin = min(inicio + tamano_pagina, int(fila_n2['FIN']))
+    return df_ordenado.iloc[inicio:fin]
+
+# ==============================================================================
+# LÓGICA DE AGRUPACIÓN Y EXCEL
+# ==============================================================================
+
+@instrumentar()
+def ordenar_para_reporte(df, col_g1, col_g2):
+    """Grupos sin nulos y ordenados (bloques contiguos). No modifica df."""
+    # Aseguramos que no haya NaNs en las columnas de agrupación para evitar errores
+    df = df.assign(**{col_g1: df[col_g1].fillna("SIN CLASIFICAR"), col_g2: df[col_g2].fillna("SIN CLASIFICAR")})
+    return df.sort_values(by=[col_g1, col_g2]).reset_index(drop=True)
+
+@instrumentar()
+def generar_excel_jerarquico(df, col_g1, col_g2, cols_sum, expandir_todo, streaming=True, ordenado=False, progreso=None,
+                             ruta_salida=None, max_filas_hoja=None):
+    """
+    Genera el Excel agrupado. En modo streaming escribe fila a fila (constant_memory)
+    sobre un archivo temporal en disco, así el libro nunca vive completo en RAM.
+    Con `ruta_salida` el libro queda en esa ruta y se devuelve la ruta (sin leerlo a
+    memoria); si no, se devuelven sus bytes.
+    Con `ordenado=True` df ya viene de ordenar_para_reporte (no se vuelve a ordenar).
+    Si el reporte no cabe en una hoja (`max_filas_hoja`, por defecto el límite de Excel)
+    se reparte en varias hojas cortando en los cierres de grupo N1 y el gran total va
+    en una hoja índice con los totales de cada parte.
+    `progreso(filas_escritas, total)` se llama tras cada grupo de nivel 2.
+    """
+    if not ordenado:
+        df = ordenar_para_reporte(df, col_g1, col_g2)
+    
+    cols_extra = [c for c in df.columns if c not in cols_sum and c not in [col_g1, col_g2]]
+    cols_export = [col_g1, col_g2] + cols_extra + cols_sum
+
+    # Paginación planeada antes de escribir (filas de cada grupo N2 y su N1)
+    tam_n2 = df.groupby([col_g1, col_g2], sort=False, observed=True).size()
+    cortes_n1, cortes_n2, n_flujo = paginacion.cortes_por_grupos(
+        tam_n2.to_numpy(), pd.factorize(tam_n2.index.get_level_values(0))[0])
+    # Si no cabe en una hoja, el gran total pasa a la hoja índice
+    partes, con_indice = paginacion.planear_reporte(n_flujo, cortes_n1, cortes_n2,
+                                                    max_filas_hoja or paginacion.MAX_FILAS_HOJA)
+    nombres = paginacion.nombres_hojas(HOJA_REPORTE, len(partes))
+
+    if ruta_salida:
+        streaming, destino = True, ruta_salida
+        workbook = xlsxwriter.Workbook(destino, {'constant_memory': True})
+    elif streaming:
+        tmp = tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False)
+        tmp.close()
+        destino = tmp.name
+        workbook = xlsxwriter.Workbook(destino, {'constant_memory': True})
+    else:
+        output = io.BytesIO()
+        workbook = xlsxwriter.Workbook(output, {'in_memory': True})
+
+    try:
+        # La hoja índice se crea primero (queda delante) y se escribe al final
+        hoja_indice = workbook.add_worksheet(paginacion.nombre_indice(HOJA_REPORTE)) if con_indice else None
+        
+        # Estilos
+        fmt_header = workbook.add_format({'bold': True, 'fg_color': CABIFY_PURPLE, 'font_color': WHITE, 'border': 1, 'align': 'center', 'valign': 'vcenter'})
+        fmt_total_g1 = workbook.add_format({'bold': True, 'bg_color': CABIFY_ACCENT, 'font_color': WHITE, 'num_format': '#,##0.00', 'border': 1})
+        fmt_total_g2 = workbook.add_format({'bold': True, 'bg_color': CABIFY_LIGHT, 'font_color': '#333333', 'num_format': '#,##0.00', 'border': 1})
+        fmt_detalle_txt = workbook.add_format({'border': 1})
+        fmt_detalle_num = workbook.add_format({'border': 1, 'num_format': '#,##0.00'})
+
+        indices_num = [cols_export.index(c) for c in cols_sum]
+        tramos_detalle = _tramos_por_estilo(
+            [fmt_detalle_num if i in indices_num else fmt_detalle_txt for i in range(len(cols_export))]
+        )
+        # Columnas del detalle como arrays (una sola conversión, celdas vacías -> None)
+        columnas = [_columna_para_excel(df[c]) for c in cols_export]
+
+        # Posición en el flujo de filas (sin encabezados) donde empieza cada hoja siguiente
+        cortes = [inicio for inicio, _ in partes[1:]]
+        hojas = [_abrir_hoja(workbook, nombres[0], cols_export, fmt_header)]
+        detalle_por_hoja = [[None, None]]  # rango de filas de df en cada hoja, para sus totales
+        flujo, current_row = 0, 1
+
+        def fila_siguiente(pos=None):
+            """(hoja, fila) para la próxima fila del flujo; al llegar a un corte abre la hoja siguiente."""
+            nonlocal flujo, current_row
+            if len(hojas) <= len(cortes) and flujo == cortes[len(hojas) - 1]:
+                hojas.append(_abrir_hoja(workbook, nombres[len(hojas)], cols_export, fmt_header))
+                detalle_por_hoja.append([None, None])
+                current_row = 1
+            if pos is not None:
+                rango = detalle_por_hoja[-1]
+                if rango[0] is None: rango[0] = pos
+                rango[1] = pos + 1
+            flujo += 1
+            current_row += 1
+            return hojas[-1], current_row - 1
+
+        # LOGICA DE ESCRITURA
+        for nombre_g1, df_g1 in df.groupby(col_g1, sort=False):
+            for nombre_g2, df_g2 in df_g1.groupby(col_g2, sort=False):
+                
+                # A. DETALLES (bloque contiguo tras el ordenamiento)
+                for pos in range(df_g2.index[0], df_g2.index[-1] + 1):
+                    worksheet, fila = fila_siguiente(pos)
+                    worksheet.set_row(fila, None, None, {'level': 2, 'hidden': not expandir_todo})
+                    for ini, fin, estilo in tramos_detalle:
+                        worksheet.write_row(fila, ini, [columnas[k][pos] for k in range(ini, fin)], estilo)
+                if progreso: progreso(int(df_g2.index[-1]) + 1, len(df))
+                
+                # B. SUBTOTAL G2
+                worksheet, fila = fila_siguiente()
+                worksheet.set_row(fila, None, None, {'level': 1, 'hidden': False, 'collapsed': not expandir_todo})
+                _escribir_fila_total(worksheet, fila, cols_export, cols_sum, df_g2,
+                                     [nombre_g1, f"TOTAL {str(nombre_g2)}"], fmt_total_g2)
+
+            # C. SUBTOTAL G1
+            worksheet, fila = fila_siguiente()
+            worksheet.set_row(fila, None, None, {'level': 0, 'collapsed': False})
+            _escribir_fila_total(worksheet, fila, cols_export, cols_sum, df_g1,
+                                 [f"TOTAL {str(nombre_g1)}"], fmt_total_g1)
+
+        # GRAN TOTAL (al final de la única hoja, o en el índice)
+        if hoja_indice is None:
+            _escribir_fila_total(hojas[-1], current_row, cols_export, cols_sum, df, ["GRAN TOTAL"], fmt_header)
+        else:
+            _escribir_indice(hoja_indice, df, col_g1, cols_sum, nombres, partes, detalle_por_hoja,
+                             fmt_header, fmt_detalle_txt, fmt_detalle_num)
+    except BaseException:
+        workbook.close()
+        if streaming and os.path.exists(destino): os.remove(destino)  # cancelado o con error: no dejar el archivo a medias
+        raise
+    workbook.close()
+
+    if ruta_salida:
+        return ruta_salida
+    if not streaming:
+        return output.getvalue()
+    try:
+        with open(destino, 'rb') as f:
+            return f.read()
+    finally:
+        os.remove(destino)
+
+def _abrir_hoja(workbook, nombre, cols_export, fmt_header):
+    """Hoja del reporte con encabezados y anchos de columna."""
+    worksheet = workbook.add_worksheet(nombre)
+    for i, col in enumerate(cols_export):
+        worksheet.write(0, i, col, fmt_header)
+    worksheet.set_column(0, 1, 30)
+    worksheet.set_column(2, len(cols_export)-1, 15)
+    worksheet.set_tab_color(CABIFY_PURPLE)
+    return worksheet
+
+def _escribir_indice(worksheet, df, col_g1, cols_sum, nombres, partes, detalle_por_hoja, fmt_header, fmt_txt, fmt_num):
+    """Hoja índice de un reporte repartido: grupos N1 y totales de cada hoja, y el gran total al final."""
+    cols = ['PARTE', 'HOJA', f'DESDE ({col_g1})', f'HASTA ({col_g1})', 'FILAS'] + cols_sum
+    for i, col in enumerate(cols):
+        worksheet.write(0, i, col, fmt_header)
+    worksheet.set_column(0, len(cols)-1, 18)
+    worksheet.set_column(1, 3, 30)
+    for i, (nombre, (inicio, fin), (a, b)) in enumerate(zip(nombres, partes, detalle_por_hoja), start=1):
+        tramo = df.iloc[a:b] if a is not None else df.iloc[0:0]
+        desde, hasta = (tramo[col_g1].iloc[0], tramo[col_g1].iloc[-1]) if len(tramo) else ("", "")
+        worksheet.write_number(i, 0, i, fmt_txt)
+        worksheet.write_url(i, 1, f"internal:'{nombre}'!A1", fmt_txt, string=nombre)
+        worksheet.write_row(i, 2, [desde, hasta, fin - inicio], fmt_txt)
+        worksheet.write_row(i, 5, [tramo[c].sum() for c in cols_sum], fmt_num)
+    total = ["", "", "GRAN TOTAL", "", ""] + [df[c].sum() for c in cols_sum]
+    worksheet.write_row(len(nombres) + 1, 0, total, fmt_header)
+    worksheet.set_tab_color(CABIFY_PURPLE)
+
+def _escribir_fila_total(worksheet, fila, cols_export, cols_sum, df_grupo, etiquetas, estilo):
+    """Fila de subtotal/total: etiquetas a la izquierda, sumas en sus columnas, resto vacío."""
+    valores = list(etiquetas) + [""] * (len(cols_export) - len(etiquetas))
+    for col_sum in cols_sum:
+        valores[cols_export.index(col_sum)] = df_grupo[col_sum].sum()
+    worksheet.write_row(fila, 0, valores, estilo)
+
+def _tramos_por_estilo(estilos):
+    """Agrupa columnas consecutivas con el mismo formato en tramos (inicio, fin, formato)."""
+    tramos, ini = [], 0
+    for i in range(1, len(estilos) + 1):
+        if i == len(estilos) or estilos[i] is not estilos[ini]:
+            tramos.append((ini, i, estilos[ini]))
+            ini = i
+    return tramos
+
+def _columna_para_excel(serie):
+    """Convierte una columna a lista Python; NaN/NaT/NA se escriben como celda vacía."""
+    valores = serie.astype(object)
+    return valores.where(serie.notna(), None).tolist()
@@ -1,17 +1,17 @@
 import streamlit as st
-import pandas as pd
-import io
-import xlsxwriter
+
+import cache_disco
+import descargas
+import instrumentacion
+from agrupador import (CABIFY_PURPLE, generar_excel_jerarquico, leer_muestra, leer_y_limpiar_por_bloques, ordenar_para_reporte,
+                       pagina_detalle, totales_por_grupo)
+from cache_resultados import CacheResultados
+import trabajos
 
 # --- CONFIGURACIÓN DE PÁGINA ---
 st.set_page_config(page_title="Agrupador Pro (ERP)", page_icon="🧹", layout="wide")
 
 # --- ESTILOS VISUALES ---
-CABIFY_PURPLE = '#7145D6'
-CABIFY_LIGHT  = '#F3F0FA'
-CABIFY_ACCENT = '#B89EF7'
-WHITE         = '#FFFFFF'
-
 st.markdown(f"""
     <style>
     .stApp {{ background-color: #F4F6F9; }}
@@ -25,112 +25,110 @@ st.markdown(f"""
 """, unsafe_allow_html=True)
 
 # ==============================================================================
-# LÓGICA DE LIMPIEZA (NUEVO)
+# INTERFAZ DE USUARIO
 # ==============================================================================
 
-def limpiar_datos_erp(df, col_agrupacion):
+# Panel de rendimiento opcional (también se activa con ORDEN_INSTRUMENTACION=1)
+with st.sidebar:
+    if st.toggle("⏱️ Medir etapas", value=instrumentacion.ACTIVO):
+        instrumentacion.activar(memoria=st.checkbox(
+            "Incluir pico de memoria", value=instrumentacion.MEDIR_MEMORIA,
+            help="Usa tracemalloc (más lento) solo mientras dura la medición. El pico es de todo el servidor: "
+                 "si otra sesión mide a la vez, la etapa se marca como memoria compartida."))
+    else:
+        instrumentacion.desactivar()
+instrumentacion.limpiar()
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _muestra_archivo(huella, _archivo):
+    """Primer bloque del archivo, una vez por archivo (no en cada cambio de un widget)."""
+    return leer_muestra(_archivo)
+
+# Resultados intermedios por sesión: (huella, limpieza) -> limpio, + grupos -> ordenado, + resto -> ruta del libro
+if 'cache_resultados' not in st.session_state:
+    st.session_state['cache_resultados'] = CacheResultados()
+cache_res = st.session_state['cache_resultados']
+
+def _ruta_libro(llave_libro):
+    """Ruta del libro ya generado para esta configuración, o None (también si su archivo venció)."""
+    if llave_libro not in cache_res: return None
+    ruta = cache_res.obtener(llave_libro, lambda: None)
+    if descargas.disponible(ruta): return ruta
+    cache_res.quitar(llave_libro)
+    return None
+
+@st.fragment(run_every=1.0)
+def _panel_trabajo():
+    """Sondea el trabajo en curso: progreso, cancelación y descarga al terminar."""
+    llave_libro, id_trabajo, ruta = st.session_state['trabajo']
+    trabajo = trabajos.obtener(id_trabajo)
+    if trabajo is None or not trabajo.activo:
+        if trabajo is not None and trabajo.estado == trabajos.LISTO:
+            cache_res.guardar(llave_libro, trabajo.resultado)
+        else:
+            descargas.eliminar(ruta)
+            if trabajo is not None and trabajo.estado == trabajos.ERROR:
+                st.session_state['error_trabajo'] = trabajo.error
+        trabajos.olvidar(id_trabajo)
+        del st.session_state['trabajo']
+        st.rerun()  # fuera del fragmento: muestra la descarga y detiene el sondeo
+    texto = "En cola..." if trabajo.estado == trabajos.EN_COLA else f"Generando Excel... {trabajo.hechas:,} / {trabajo.total or 0:,} filas"
+    st.progress(trabajo.fraccion, text=texto)
+    if st.button("✖️ Cancelar"):
+        trabajo.cancelar()
+
+def mostrar_estado_reporte():
+    """Progreso del trabajo en curso o descarga del último libro generado."""
+    if 'trabajo' in st.session_state:
+        _panel_trabajo()
+        return
+    if 'error_trabajo' in st.session_state:
+        st.error(f"❌ Error: {st.session_state.pop('error_trabajo')}")
+    ruta = _ruta_libro(st.session_state.get('libro_actual'))
+    if ruta:
+        st.success("¡Archivo transformado correctamente!")
+        # El libro se lee del disco solo al hacer clic (no queda en la memoria de la sesión)
+        st.download_button(
+            label="📥 DESCARGAR REPORTE LIMPIO Y AGRUPADO",
+            data=descargas.lector(ruta),
+            file_name="Reporte_Agrupado_Clean.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
+
+GRUPOS_POR_PAGINA = 20
+FILAS_POR_PAGINA = 100
+
+def _paginador(total, por_pagina, key, etiqueta="Página"):
+    """Selector de página (base 0); no muestra nada si todo cabe en una."""
+    paginas = max((total - 1) // por_pagina + 1, 1)
+    if paginas == 1: return 0
+    return st.number_input(f"{etiqueta} (de {paginas})", min_value=1, max_value=paginas, value=1, key=key) - 1
+
+def mostrar_vista_previa(df_ordenado, g1, g2, c_sum, llave_vista):
     """
-    1. Rellena los huecos vacíos hacia abajo (para ERPs que dejan celdas en blanco).
-    2. Elimina las filas que ya son totales en el archivo original.
+    Vista jerárquica en pantalla: totales N1/N2 de una sola agregación (en caché)
+    y detalle de un grupo N2 solo cuando se pide, paginado.
     """
-    df_clean = df.copy()
-    
-    # 1. Rellenar hacia abajo (Forward Fill)
-    # Esto sirve cuando el ERP pone el nombre de la cuenta solo en la primera fila del grupo
-    df_clean[col_agrupacion] = df_clean[col_agrupacion].ffill()
-    
-    # 2. Eliminar filas basura (Totales nativos del ERP)
-    # Buscamos filas donde la columna de agrupación empiece por "Total" o "Saldo"
-    mascara_totales = df_clean[col_agrupacion].astype(str).str.contains(r'^(TOTAL|Total|Sum|Saldo)', na=False, regex=True)
-    
-    # Invertimos la máscara para quedarnos con lo que NO es total
-    df_clean = df_clean[~mascara_totales]
-    
-    return df_clean
-
-# ==============================================================================
-# LÓGICA DE AGRUPACIÓN Y EXCEL
-# ==============================================================================
-
-def generar_excel_jerarquico(df, col_g1, col_g2, cols_sum, expandir_todo):
-    output = io.BytesIO()
-    
-    # Aseguramos que no haya NaNs en las columnas de agrupación para evitar errores
-    df[col_g1] = df[col_g1].fillna("SIN CLASIFICAR")
-    df[col_g2] = df[col_g2].fillna("SIN CLASIFICAR")
-
-    df = df.sort_values(by=[col_g1, col_g2])
-    
-    cols_extra = [c for c in df.columns if c not in cols_sum and c not in [col_g1, col_g2]]
-    cols_export = [col_g1, col_g2] + cols_extra + cols_sum
-    
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        workbook = writer.book
-        worksheet = workbook.add_worksheet("Reporte Detallado")
-        
-        # Estilos
-        fmt_header = workbook.add_format({'bold': True, 'fg_color': CABIFY_PURPLE, 'font_color': WHITE, 'border': 1, 'align': 'center', 'valign': 'vcenter'})
-        fmt_total_g1 = workbook.add_format({'bold': True, 'bg_color': CABIFY_ACCENT, 'font_color': WHITE, 'num_format': '#,##0.00', 'border': 1})
-        fmt_total_g2 = workbook.add_format({'bold': True, 'bg_color': CABIFY_LIGHT, 'font_color': '#333333', 'num_format': '#,##0.00', 'border': 1})
-        fmt_detalle_txt = workbook.add_format({'border': 1})
-        fmt_detalle_num = workbook.add_format({'border': 1, 'num_format': '#,##0.00'})
-
-        # Headers
-        for i, col in enumerate(cols_export):
-            worksheet.write(0, i, col, fmt_header)
-        
-        worksheet.set_column(0, 1, 30)
-        worksheet.set_column(2, len(cols_export)-1, 15)
-
-        indices_num = [cols_export.index(c) for c in cols_sum]
-        current_row = 1
-
-        # LOGICA DE ESCRITURA
-        for nombre_g1, df_g1 in df.groupby(col_g1, sort=False):
-            for nombre_g2, df_g2 in df_g1.groupby(col_g2, sort=False):
-                
-                # A. DETALLES
-                for _, row_data in df_g2.iterrows():
-                    worksheet.set_row(current_row, None, None, {'level': 2, 'hidden': not expandir_todo})
-                    for col_idx, col_name in enumerate(cols_export):
-                        valor = row_data[col_name]
-                        estilo = fmt_detalle_num if col_idx in indices_num else fmt_detalle_txt
-                        worksheet.write(current_row, col_idx, valor, estilo)
-                    current_row += 1 
-                
-                # B. SUBTOTAL G2
-                worksheet.set_row(current_row, None, None, {'level': 1, 'hidden': False, 'collapsed': not expandir_todo})
-                worksheet.write(current_row, 0, nombre_g1, fmt_total_g2)
-                worksheet.write(current_row, 1, f"TOTAL {str(nombre_g2)}", fmt_total_g2)
-                for k in range(2, len(cols_export)): worksheet.write(current_row, k, "", fmt_total_g2)
-                for col_sum in cols_sum:
-                    idx = cols_export.index(col_sum)
-                    worksheet.write(current_row, idx, df_g2[col_sum].sum(), fmt_total_g2)
-                current_row += 1
-
-            # C. SUBTOTAL G1
-            worksheet.set_row(current_row, None, None, {'level': 0, 'collapsed': False})
-            worksheet.write(current_row, 0, f"TOTAL {str(nombre_g1)}", fmt_total_g1)
-            for k in range(1, len(cols_export)): worksheet.write(current_row, k, "", fmt_total_g1)
-            for col_sum in cols_sum:
-                idx = cols_export.index(col_sum)
-                worksheet.write(current_row, idx, df_g1[col_sum].sum(), fmt_total_g1)
-            current_row += 1
-
-        # GRAN TOTAL
-        worksheet.write(current_row, 0, "GRAN TOTAL", fmt_header)
-        for k in range(1, len(cols_export)): worksheet.write(current_row, k, "", fmt_header)
-        for col_sum in cols_sum:
-            idx = cols_export.index(col_sum)
-            worksheet.write(current_row, idx, df[col_sum].sum(), fmt_header)
-
-        worksheet.set_tab_color(CABIFY_PURPLE)
-
-    return output.getvalue()
-
-# ==============================================================================
-# INTERFAZ DE USUARIO
-# ==============================================================================
+    tot_n2, tot_n1 = cache_res.obtener(('totales',) + llave_vista, lambda: totales_por_grupo(df_ordenado, g1, g2, c_sum))
+
+    st.subheader("👀 Vista previa")
+    st.caption(f"{len(tot_n1):,} grupos de {g1} · {len(tot_n2):,} grupos de {g2} · {len(df_ordenado):,} filas")
+    pagina = _paginador(len(tot_n1), GRUPOS_POR_PAGINA, 'pagina_n1', f"Página de grupos de {g1}")
+    bloque = tot_n1.iloc[pagina * GRUPOS_POR_PAGINA:(pagina + 1) * GRUPOS_POR_PAGINA]
+
+    for _, fila_n1 in bloque.iterrows():
+        n2_inicio, n2_fin = int(fila_n1['N2_INICIO']), int(fila_n1['N2_FIN'])
+        totales = " · ".join(f"{c}: {fila_n1[c]:,.2f}" for c in c_sum)
+        with st.expander(f"**{fila_n1[g1]}** — {int(fila_n1['FILAS']):,} filas · {totales}"):
+            grupos = tot_n2.iloc[n2_inicio:n2_fin]
+            st.dataframe(grupos[[g2, 'FILAS'] + c_sum], hide_index=True, use_container_width=True)
+            # El detalle se carga solo al elegir un grupo
+            elegido = st.selectbox(f"Ver detalle de {g2}", [None] + list(range(len(grupos))), key=f'detalle_{n2_inicio}',
+                                   format_func=lambda i: "—" if i is None else str(grupos[g2].iloc[i]))
+            if elegido is not None:
+                fila_n2 = grupos.iloc[elegido]
+                pagina_det = _paginador(int(fila_n2['FILAS']), FILAS_POR_PAGINA, f'pagina_det_{n2_inicio}')
+                st.dataframe(pagina_detalle(df_ordenado, fila_n2, pagina_det, FILAS_POR_PAGINA), hide_index=True, use_container_width=True)
 
 st.markdown("<div class='header'><h1>🧹 Agrupador Inteligente (Modo ERP)</h1><p>Limpia totales basura, rellena espacios y agrupa correctamente.</p></div>", unsafe_allow_html=True)
 
@@ -138,10 +136,13 @@ uploaded_file = st.file_uploader("Sube tu archivo Excel (.xlsx)", type=["xlsx",
 
 if uploaded_file:
     try:
-        # Cargar ignorando las primeras filas si es necesario (header=0 usualmente está bien)
-        df_raw = pd.read_excel(uploaded_file)
+        # Solo el primer bloque para configurar; el archivo completo se lee al procesar
+        huella = cache_disco.huella_archivo(uploaded_file)
+        with instrumentacion.etapa('leer_muestra') as info:
+            df_raw = _muestra_archivo(huella, uploaded_file)
+            info['filas_salida'] = len(df_raw)
         
-        st.info(f"📂 Archivo cargado con {len(df_raw)} filas.")
+        st.info(f"📂 Archivo cargado con {df_raw.attrs.get('total_filas', len(df_raw))} filas.")
 
         col1, col2 = st.columns(2)
         
@@ -162,34 +163,60 @@ if uploaded_file:
             usar_limpieza = st.checkbox("Activar Limpieza ERP (Recomendado)", value=True, help="Elimina filas que dicen 'Total' y rellena celdas vacías hacia abajo.")
             expandir = st.checkbox("Descargar Expandido", value=False, help="Ver todos los detalles abiertos por defecto.")
 
+        llave_limpio = (huella, g1 if usar_limpieza else None)
+        llave_orden = ('ordenado',) + llave_limpio + (g1, g2)
+        llave_vista = llave_orden[1:] + (tuple(c_sum),)
+
+        def preparar_ordenado():
+            """Frame limpio y ordenado (cada etapa se reutiliza si su configuración no cambió)."""
+            # --- LECTURA POR BLOQUES (CON LIMPIEZA SI ESTÁ MARCADO) ---
+            def leer_limpio():
+                barra = st.progress(0.0, text="Leyendo archivo...")
+                def progreso(leidas, total):
+                    barra.progress(min(leidas / total, 1.0) if total else 0.0, text=f"Leyendo archivo... {leidas:,} filas")
+                # 1. Rellenar huecos en la columna principal (ej. Cuenta), arrastrando el valor entre bloques
+                resultado = leer_y_limpiar_por_bloques(uploaded_file, g1 if usar_limpieza else None, progreso)
+                barra.empty()
+                return resultado
+            df_procesado, filas_antes = cache_res.obtener(('limpio',) + llave_limpio, leer_limpio)
+            if usar_limpieza:
+                st.caption(f"✅ Se eliminaron {filas_antes - len(df_procesado)} filas de totales 'basura' del archivo original.")
+            return cache_res.obtener(llave_orden, lambda: ordenar_para_reporte(df_procesado, g1, g2))
+
         if st.button("🚀 PROCESAR ARCHIVO"):
             if g1 == g2:
                 st.error("⚠️ Elige columnas diferentes para Grupo 1 y 2.")
             elif not c_sum:
                 st.error("⚠️ Elige qué columnas sumar.")
             else:
-                with st.spinner("Limpiando y reestructurando datos..."):
-                    
-                    df_procesado = df_raw.copy()
-                    
-                    # --- APLICAR LIMPIEZA SI ESTÁ MARCADO ---
-                    if usar_limpieza:
-                        filas_antes = len(df_procesado)
-                        # 1. Rellenar huecos en la columna principal (ej. Cuenta)
-                        df_procesado = limpiar_datos_erp(df_procesado, g1)
-                        filas_despues = len(df_procesado)
-                        st.caption(f"✅ Se eliminaron {filas_antes - filas_despues} filas de totales 'basura' del archivo original.")
-                    
-                    # Generar Excel
-                    excel_data = generar_excel_jerarquico(df_procesado, g1, g2, c_sum, expandir)
-                    
-                    st.success("¡Archivo transformado correctamente!")
-                    st.download_button(
-                        label="📥 DESCARGAR REPORTE LIMPIO Y AGRUPADO",
-                        data=excel_data,
-                        file_name="Reporte_Agrupado_Clean.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                    )
+                st.session_state['vista_actual'] = llave_vista
+
+        # La vista previa y la exportación siguen a la configuración procesada
+        if st.session_state.get('vista_actual') == llave_vista:
+            with st.spinner("Limpiando y reestructurando datos..."):
+                df_ordenado = preparar_ordenado()
+            mostrar_vista_previa(df_ordenado, g1, g2, [c for c in c_sum if c not in (g1, g2)], llave_vista)
+
+            if st.button("📊 EXPORTAR A EXCEL"):
+                llave_libro = ('libro',) + llave_vista[:-1] + (tuple(c_sum), expandir)
+                if _ruta_libro(llave_libro) is None:
+                    # El libro se construye en el pool de trabajos, directo a un archivo en disco
+                    anterior = trabajos.obtener(st.session_state['trabajo'][1]) if 'trabajo' in st.session_state else None
+                    if anterior: anterior.cancelar()  # una configuración nueva reemplaza la anterior
+                    ruta = descargas.nueva_ruta()
+                    try:
+                        trabajo = trabajos.enviar(generar_excel_jerarquico, df_ordenado, g1, g2, c_sum, expandir,
+                                                  ordenado=True, ruta_salida=ruta, descripcion=uploaded_file.name)
+                        st.session_state['trabajo'] = (llave_libro, trabajo.id, ruta)
+                    except trabajos.ServidorOcupado as e:
+                        descargas.eliminar(ruta)
+                        st.warning(f"⏳ {e}")
+                st.session_state['libro_actual'] = llave_libro
+
+        mostrar_estado_reporte()
 
     except Exception as e:
         st.error(f"❌ Error: {e}")
+
+if instrumentacion.activo():
+    instrumentacion.mostrar_panel_streamlit()
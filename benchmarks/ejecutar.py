@@ -0,0 +1,167 @@
+"""
+Benchmark de todas las etapas del motor con datos sintéticos.
+
+Uso:
+    python -m benchmarks.ejecutar                               # 10k, 100k y 1M filas
+    python -m benchmarks.ejecutar --tamanos 10000 100000 --salida resultados.json
+    python -m benchmarks.ejecutar --base benchmarks/linea_base.json --tolerancia 0.25
+
+Por cada tamaño y etapa registra tiempo de pared (corrida sin trazado) y pico de
+memoria asignada vía Python/numpy (segunda corrida bajo tracemalloc). Con --base
+compara contra una línea base guardada y termina con código 1 si alguna etapa
+empeora más de la tolerancia.
+Con --guardar-base escribe los resultados como nueva línea base.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+import cache_disco
+import engine
+import normalizacion
+from agrupador import generar_excel_jerarquico
+from benchmarks.generadores import escribir_dian_xlsx, escribir_xlsx, generar_contabilidad, generar_dian
+
+TAMANOS_DEFECTO = [10_000, 100_000, 1_000_000]
+RUTA_BASE_DEFECTO = os.path.join(os.path.dirname(__file__), 'linea_base.json')
+
+CONFIG_REPORTE = {
+    'col_grupo_1': 'TIPO',
+    'col_grupo_2': 'EMPRESA_GRUPO',
+    'cols_texto': ['NIT', 'LLAVE', 'CUENTA'],
+    'cols_suma': ['VALOR_DIAN', 'VALOR_CONT', 'DIFERENCIA'],
+}
+
+
+def _medir(funcion, memoria=True):
+    """Ejecuta funcion() y devuelve (resultado, segundos, pico_mb)."""
+    inicio = time.perf_counter()
+    resultado = funcion()
+    segundos = time.perf_counter() - inicio
+    pico_mb = None
+    if memoria:
+        del resultado
+        tracemalloc.start()
+        try:
+            resultado = funcion()
+            pico_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+    return resultado, segundos, pico_mb
+
+
+def correr_tamano(n, carpeta, memoria=True, semilla=0):
+    """Corre todas las etapas para n filas. Devuelve lista de dicts {etapa, filas, segundos, pico_mb}."""
+    df_dian_gen = generar_dian(n, semilla)
+    ruta_dian = escribir_dian_xlsx(df_dian_gen, os.path.join(carpeta, f'dian_{n}.xlsx'))
+    ruta_cont = escribir_xlsx(generar_contabilidad(n, df_dian_gen, semilla + 1), os.path.join(carpeta, f'cont_{n}.xlsx'))
+    del df_dian_gen
+
+    mapa_dian = {'total': 'total', 'iva': 'iva', 'emisor': 'nombre_emisor'}
+    resultados = []
+
+    def etapa(nombre, funcion):
+        resultado, segundos, pico = _medir(funcion, memoria)
+        resultados.append({'etapa': nombre, 'filas': n, 'segundos': round(segundos, 4),
+                           'pico_mb': None if pico is None else round(pico, 2)})
+        print(f"  {nombre:<34} {segundos:8.2f}s" + ('' if pico is None else f" {pico:9.1f} MB"))
+        return resultado
+
+    df_dian = etapa('leer_dian', lambda: engine.leer_dian(ruta_dian))
+    df_cont = etapa('leer_contabilidad_completa', lambda: engine.leer_contabilidad_completa(ruta_cont))
+
+    df_dian = engine.filtrar_dian_gastos(engine.crear_llave_conciliacion(df_dian))
+    df_cont = engine.filtrar_solo_gastos(df_cont)
+
+    coinc, sob_dian, sob_cont = etapa('ejecutar_conciliacion_universal',
+                                      lambda: engine.ejecutar_conciliacion_universal(df_dian, df_cont.copy()))
+    df_final = etapa('preparar_datos_unificados',
+                     lambda: engine.preparar_datos_unificados(coinc, sob_dian, sob_cont, mapa_dian))
+    # Pasada aproximada (NIT + valor + fecha) sobre los sobrantes del cruce exacto
+    mapa_aprox = dict(mapa_dian, nit='nit_emisor', fecha='fecha_emisión')
+    etapa('conciliar_aproximado', lambda: engine.conciliar_aproximado(sob_dian, sob_cont, mapa_aprox))
+
+    def reporte_agrupado():
+        with tempfile.TemporaryDirectory() as tmp:
+            with pd.ExcelWriter(os.path.join(tmp, 'reporte.xlsx'), engine='xlsxwriter',
+                                engine_kwargs={'options': {'constant_memory': True}}) as writer:
+                engine.generar_reporte_agrupado(writer, df_final, 'GASTOS', CONFIG_REPORTE)
+    etapa('generar_reporte_agrupado', reporte_agrupado)
+
+    cols_agrupador = ['u_acctname', 'u_cardname', 'Fecha', 'u_ref', 'u_infoco01', 'u_saldo_f']
+    etapa('generar_excel_jerarquico',
+          lambda: generar_excel_jerarquico(df_cont[cols_agrupador].copy(), 'u_acctname', 'u_cardname', ['u_saldo_f'], False))
+    return resultados
+
+
+def comparar(resultados, base, tolerancia):
+    """Lista de textos con las etapas que empeoraron más que la tolerancia frente a la base."""
+    previos = {(r['etapa'], r['filas']): r for r in base.get('resultados', [])}
+    regresiones = []
+    for r in resultados:
+        b = previos.get((r['etapa'], r['filas']))
+        if not b: continue
+        for campo, unidad in (('segundos', 's'), ('pico_mb', 'MB')):
+            actual, anterior = r.get(campo), b.get(campo)
+            if actual is None or not anterior: continue
+            if actual > anterior * (1 + tolerancia):
+                regresiones.append(f"{r['etapa']} @ {r['filas']:,} filas: {campo} {anterior:.2f}{unidad} -> {actual:.2f}{unidad} "
+                                   f"(+{(actual / anterior - 1) * 100:.0f}%)")
+    return regresiones
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark sintético de las etapas de conciliación y reportes.")
+    parser.add_argument('--tamanos', type=int, nargs='+', default=TAMANOS_DEFECTO, help="Filas por corrida (DIAN y contabilidad)")
+    parser.add_argument('--salida', default='resultados_benchmark.json', help="Archivo JSON de resultados")
+    parser.add_argument('--base', default=None, help=f"Línea base para comparar (p.ej. {os.path.relpath(RUTA_BASE_DEFECTO)})")
+    parser.add_argument('--tolerancia', type=float, default=0.25, help="Empeoramiento permitido (0.25 = 25%%)")
+    parser.add_argument('--guardar-base', action='store_true', help="Guardar los resultados como nueva línea base")
+    parser.add_argument('--sin-memoria', action='store_true', help="No medir memoria (evita la segunda corrida)")
+    parser.add_argument('--semilla', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    cache_disco.ACTIVO = False  # medir el parseo real, no el caché en disco
+    normalizacion.PERSISTIR = False  # ni el memo de normalización de corridas anteriores
+    resultados = []
+    with tempfile.TemporaryDirectory() as carpeta:
+        for n in args.tamanos:
+            print(f"== {n:,} filas ==")
+            resultados.extend(correr_tamano(n, carpeta, memoria=not args.sin_memoria, semilla=args.semilla))
+
+    salida = {
+        'meta': {
+            'python': platform.python_version(), 'pandas': pd.__version__,
+            'plataforma': platform.platform(), 'semilla': args.semilla,
+            'fecha': time.strftime('%Y-%m-%d %H:%M:%S'),
+        },
+        'resultados': resultados,
+    }
+    with open(args.salida, 'w', encoding='utf-8') as f:
+        json.dump(salida, f, indent=2, ensure_ascii=False)
+    print(f"Resultados en {args.salida}")
+    if args.guardar_base:
+        with open(RUTA_BASE_DEFECTO, 'w', encoding='utf-8') as f:
+            json.dump(salida, f, indent=2, ensure_ascii=False)
+        print(f"Línea base actualizada: {RUTA_BASE_DEFECTO}")
+
+    if args.base:
+        with open(args.base, encoding='utf-8') as f:
+            regresiones = comparar(resultados, json.load(f), args.tolerancia)
+        if regresiones:
+            print("REGRESIONES:")
+            for linea in regresiones: print(f"  - {linea}")
+            return 1
+        print("Sin regresiones frente a la línea base.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
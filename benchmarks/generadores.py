@@ -0,0 +1,136 @@
+"""
+Generadores sintéticos (con semilla) de exportaciones DIAN y mayores de NetSuite.
+
+Reproducen lo que los lectores de engine.py esperan encontrar:
+  * DIAN: prefijo/folio/grupo/total/iva como texto, emisores y receptores con NIT.
+  * NetSuite: filas de título antes de la cabecera, una fila por cuenta seguida de
+    sus movimientos, filas "Total ..." al cierre de cada cuenta y Déb/Créd en
+    formato colombiano ("1.234.567,89") con celdas vacías.
+"""
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+CUENTAS_GASTO = ['51350501 Servicios públicos', '51101001 Honorarios', '52050101 Arrendamientos', '51559501 Gastos de viaje',
+                 '53052001 Diferencia en cambio', '51604001 Depreciación equipo']
+CUENTAS_INGRESO = ['41459501 Ingresos por servicios', '41750101 Devoluciones', '42101001 Diferencia en cambio ingreso']
+SUFIJOS = ['S.A.S.', 'SAS', 'S.A.', 'LTDA', 'B.I.C.', '']
+
+
+def _proveedores(rng, n_proveedores):
+    nits = rng.integers(800_000_000, 999_999_999, n_proveedores)
+    nombres = np.array([f"Proveedor {i} {SUFIJOS[i % len(SUFIJOS)]}".strip() for i in range(n_proveedores)], dtype=object)
+    return nits, nombres
+
+
+def _formato_colombiano(valores):
+    return [f"{v:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.') for v in valores]
+
+
+def generar_dian(n, semilla=0):
+    """DataFrame DIAN ya normalizado (como lo devuelve engine.leer_dian): todo texto."""
+    rng = np.random.default_rng(semilla)
+    nits, nombres = _proveedores(rng, max(n // 50, 10))
+    prov = rng.integers(0, len(nits), n)
+    subtotal = rng.lognormal(13, 1.2, n).round(2)
+    iva = (subtotal * rng.choice([0, 0.05, 0.19], n, p=[0.2, 0.1, 0.7])).round(2)
+    emitido = rng.random(n) < 0.3
+    fechas = pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 366, n), unit='D')
+    return pd.DataFrame({
+        'tipo_de_documento': 'Factura electrónica',
+        'folio': np.arange(1, n + 1).astype(str),
+        'prefijo': rng.choice(['FE', 'FV', 'SETP', 'FC'], n),
+        'fecha_emisión': fechas.strftime('%d-%m-%Y'),
+        'nit_emisor': np.where(emitido, '900123456', nits[prov].astype(str)),
+        'nombre_emisor': np.where(emitido, 'MI EMPRESA SAS', nombres[prov]),
+        'nit_receptor': np.where(emitido, nits[prov].astype(str), '900123456'),
+        'nombre_receptor': np.where(emitido, nombres[prov], 'MI EMPRESA SAS'),
+        'iva': iva.astype(str),
+        'total': (subtotal + iva).round(2).astype(str),
+        'estado': 'Aprobado',
+        'grupo': np.where(emitido, 'Emitido', 'Recibido'),
+    })
+
+
+def generar_contabilidad(n, df_dian=None, semilla=1, proporcion_cruce=0.7, proporcion_digitacion=0.1):
+    """
+    Filas (listas) de un mayor NetSuite con n movimientos, incluida la cabecera desplazada.
+    Si se pasa df_dian, una parte de los documentos referencia facturas DIAN reales:
+    con el NIT y nombre de la contraparte de la factura, su subtotal (a veces con un
+    pequeño descuadre) y una fecha cercana. Una fracción `proporcion_digitacion` de
+    esas referencias lleva un error de digitación: solo las recupera la pasada aproximada.
+    """
+    rng = np.random.default_rng(semilla)
+    cuentas = np.array(CUENTAS_GASTO + CUENTAS_INGRESO, dtype=object)
+    cuenta = np.sort(rng.integers(0, len(cuentas), n))
+    nits, nombres = _proveedores(rng, max(n // 50, 10))
+    prov = rng.integers(0, len(nits), n)
+    nit_fila, nombre_fila = nits[prov].astype(str).astype(object), nombres[prov]
+
+    refs = np.array([f"DOC-{i}" for i in rng.integers(0, n, n)], dtype=object)
+    cruza = np.zeros(n, dtype=bool)
+    if df_dian is not None and len(df_dian):
+        cruza = rng.random(n) < proporcion_cruce
+        elegidas = rng.integers(0, len(df_dian), cruza.sum())
+        # Misma factura con separadores distintos, como la digitan en contabilidad
+        refs[cruza] = (df_dian['prefijo'].to_numpy()[elegidas] + '-' + df_dian['folio'].to_numpy()[elegidas])
+
+    valores = rng.lognormal(12, 1.3, n).round(2)
+    es_debito = rng.random(n) < 0.8
+    fechas = pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 366, n), unit='D')
+
+    if cruza.any():
+        # La contraparte es el emisor en las facturas recibidas y el receptor en las emitidas
+        factura = df_dian.iloc[elegidas]
+        recibida = (factura['grupo'] == 'Recibido').to_numpy()
+        nit_fila[cruza] = np.where(recibida, factura['nit_emisor'], factura['nit_receptor'])
+        nombre_fila[cruza] = np.where(recibida, factura['nombre_emisor'], factura['nombre_receptor'])
+        subtotal = factura['total'].astype(float).to_numpy() - factura['iva'].astype(float).to_numpy()
+        descuadre = np.where(rng.random(len(factura)) < 0.3, rng.uniform(-0.005, 0.005, len(factura)), 0.0)
+        valores[cruza] = (subtotal * (1 + descuadre)).round(2)
+        es_debito[cruza] = recibida
+        emision = pd.to_datetime(factura['fecha_emisión'], format='%d-%m-%Y').to_numpy()
+        fechas = fechas.to_numpy().copy()
+        fechas[cruza] = emision + pd.to_timedelta(rng.integers(-5, 6, len(factura)), unit='D').to_numpy()
+        fechas = pd.DatetimeIndex(fechas)
+        digitada = cruza & (rng.random(n) < proporcion_digitacion)
+        refs[digitada] = refs[digitada] + '0'
+
+    debito = np.array(_formato_colombiano(valores), dtype=object)
+    credito = debito.copy()
+    debito[~es_debito] = None
+    credito[es_debito] = None
+    fechas = fechas.to_pydatetime()
+
+    filas = [['Mi Empresa S.A.S.'], ['Libro mayor por cuenta'], ['Periodo: enero - diciembre 2024'], []]
+    filas.append(['Cuenta', 'Fecha', 'Número de documento', 'Número Identificación', 'Nombre', 'Memo', 'Débito', 'Crédito'])
+    actual = None
+    for i in range(n):
+        if cuenta[i] != actual:
+            if actual is not None: filas.append([f"Total {cuentas[actual]}"])
+            actual = cuenta[i]
+            filas.append([cuentas[actual]])
+        filas.append([None, fechas[i], refs[i], nit_fila[i], nombre_fila[i], 'Movimiento', debito[i], credito[i]])
+    filas.append([f"Total {cuentas[actual]}"])
+    return filas
+
+
+def escribir_xlsx(filas, ruta):
+    """Escribe filas (listas) en un .xlsx con xlsxwriter en modo constant_memory."""
+    wb = xlsxwriter.Workbook(ruta, {'constant_memory': True})
+    ws = wb.add_worksheet('Mayor')
+    fmt_fecha = wb.add_format({'num_format': 'dd/mm/yyyy'})
+    for r, fila in enumerate(filas):
+        for c, valor in enumerate(fila):
+            if valor is None: continue
+            if hasattr(valor, 'year'): ws.write_datetime(r, c, valor, fmt_fecha)
+            else: ws.write(r, c, valor)
+    wb.close()
+    return ruta
+
+
+def escribir_dian_xlsx(df_dian, ruta):
+    """Exporta el DataFrame DIAN con encabezados como los de la plataforma."""
+    encabezados = {c: c.replace('_', ' ').title() for c in df_dian.columns}
+    filas = [list(encabezados.values())] + df_dian.to_numpy(dtype=object).tolist()
+    return escribir_xlsx(filas, ruta)
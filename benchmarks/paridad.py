@@ -0,0 +1,115 @@
+"""
+Paridad de backends: el pipeline pandas y el de Polars deben dar las mismas
+coincidencias y sobrantes sobre los fixtures sintéticos del benchmark.
+
+Uso:
+    python -m benchmarks.paridad                      # 10k y 100k filas, gastos e ingresos
+    python -m benchmarks.paridad --tamanos 10000 --flujos gastos
+
+Termina con código 1 si alguna salida difiere (o 2 si Polars no está instalado).
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+import cache_disco
+import engine
+import motor_polars
+import normalizacion
+from benchmarks.generadores import escribir_dian_xlsx, escribir_xlsx, generar_contabilidad, generar_dian
+
+TAMANOS_DEFECTO = [10_000, 100_000]
+SALIDAS = ('coincidencias', 'sobrante_dian', 'sobrante_cont')
+LLAVES_FINAL = ['TIPO', 'LLAVE', 'NIT', 'CUENTA', 'VALOR_DIAN', 'VALOR_CONT']
+TOLERANCIA_PESOS = 0.01  # un centavo, sin importar el número de filas
+
+
+def _normalizar(df):
+    """Nulos como NaN y texto como object, para comparar sin depender del dtype de cada backend."""
+    df = df.copy()
+    for col in df.columns:
+        if not pd.api.types.is_numeric_dtype(df[col]) and not pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = df[col].astype(object).where(df[col].notna(), None)
+    return df
+
+
+def diferencias(res_pandas, res_polars):
+    """Lista de textos con las salidas que no coinciden (vacía si hay paridad)."""
+    errores = []
+    for nombre, a, b in zip(SALIDAS, res_pandas, res_polars):
+        try:
+            pd.testing.assert_frame_equal(_normalizar(a), _normalizar(b), check_dtype=False, check_index_type=False)
+        except AssertionError as e:
+            errores.append(f"{nombre}: {str(e).splitlines()[0]} ({len(a):,} vs {len(b):,} filas)")
+    try:
+        pd.testing.assert_frame_equal(_final_comparable(res_pandas[3]), _final_comparable(res_polars[3]),
+                                      check_dtype=False, check_exact=False, rtol=0, atol=TOLERANCIA_PESOS)
+    except AssertionError as e:
+        errores.append(f"df_final: {' '.join(str(e).splitlines()[:2])}")
+    return errores
+
+
+def _final_comparable(df):
+    """df_final en pesos, ordenado por sus columnas de llave (el orden de filas puede variar entre backends)."""
+    df = _normalizar(df)
+    for col in df.attrs.get('columnas_centavos', ()):
+        df[col] = df[col] / 100
+    df.attrs = {}
+    orden = [c for c in LLAVES_FINAL if c in df.columns]
+    return df.sort_values(orden, kind='stable', na_position='last').reset_index(drop=True)
+
+
+def comparar_tamano(n, carpeta, flujos, semilla=0):
+    df_dian_gen = generar_dian(n, semilla)
+    ruta_dian = escribir_dian_xlsx(df_dian_gen, os.path.join(carpeta, f'dian_{n}.xlsx'))
+    ruta_cont = escribir_xlsx(generar_contabilidad(n, df_dian_gen, semilla + 1), os.path.join(carpeta, f'cont_{n}.xlsx'))
+    df_dian = engine.crear_llave_conciliacion(engine.leer_dian(ruta_dian))
+    df_cont = engine.leer_contabilidad_completa(ruta_cont)
+
+    errores = []
+    for flujo in flujos:
+        for compacto in (False, True):
+            resultados, tiempos = {}, {}
+            for backend in engine.BACKENDS:
+                inicio = time.perf_counter()
+                resultados[backend] = engine.conciliar_flujo(df_dian, df_cont, flujo, compacto=compacto, backend=backend)
+                tiempos[backend] = time.perf_counter() - inicio
+            fallas = diferencias(resultados['pandas'], resultados['polars'])
+            etiqueta = f"{n:,} filas {flujo}{' compacto' if compacto else ''}"
+            print(f"  {etiqueta:<32} pandas {tiempos['pandas']:6.2f}s  polars {tiempos['polars']:6.2f}s  "
+                  + ("OK" if not fallas else "DIFIEREN"))
+            errores.extend(f"{etiqueta}: {f}" for f in fallas)
+    return errores
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Paridad entre los backends pandas y Polars del pipeline de conciliación.")
+    parser.add_argument('--tamanos', type=int, nargs='+', default=TAMANOS_DEFECTO)
+    parser.add_argument('--flujos', nargs='+', choices=list(engine.FILTROS_FLUJO), default=list(engine.FILTROS_FLUJO))
+    parser.add_argument('--semilla', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if not motor_polars.DISPONIBLE:
+        print("Polars no está instalado (pip install polars pyarrow).", file=sys.stderr)
+        return 2
+    cache_disco.ACTIVO = False
+    normalizacion.PERSISTIR = False
+    errores = []
+    with tempfile.TemporaryDirectory() as carpeta:
+        for n in args.tamanos:
+            print(f"== {n:,} filas ==")
+            errores.extend(comparar_tamano(n, carpeta, args.flujos, args.semilla))
+    if errores:
+        print("DIFERENCIAS:")
+        for linea in errores: print(f"  - {linea}")
+        return 1
+    print("Paridad OK: ambos backends producen las mismas coincidencias y sobrantes.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
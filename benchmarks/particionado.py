@@ -0,0 +1,141 @@
+"""
+Escalamiento del cruce particionado (conciliacion_particionada) frente al cruce
+en un solo proceso (engine.conciliar_por_codigos), con llaves sintéticas en memoria.
+
+Uso:
+    python -m benchmarks.particionado                         # 1,5M filas DIAN, 2 y 4 procesos
+    python -m benchmarks.particionado --filas 3000000 --workers 2 4 8 --salida particionado.json
+
+Ambos caminos parten de u_ref sin normalizar: la línea base crea LLAVE_CONT y
+cruza en un proceso; el particionado normaliza y cruza en el pool. Por cada
+número de procesos reporta el tiempo total, la aceleración sobre el proceso
+único y el desglose de etapas: las del proceso principal (escribir_fuentes,
+leer_llaves, unir_particiones, armar_resultado) son seriales y ponen el techo
+del modo (tiempo en un proceso / parte serial). Con más procesos que núcleos
+la medición solo muestra el costo extra, no escalamiento. Termina con código 1
+si algún resultado difiere.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import conciliacion_particionada
+import engine
+import instrumentacion
+
+WORKERS_DEFECTO = [2, 4]
+ETAPAS_POOL = ('preparar_llaves', 'cruzar_particiones')
+ETAPAS = ('escribir_fuentes', 'particionar', 'leer_llaves', 'unir_particiones', 'armar_resultado') + ETAPAS_POOL
+
+
+def generar_llaves(n, semilla=0, proporcion_cruce=0.8):
+    """DIAN con LLAVE_DIAN y contabilidad con u_ref (sin normalizar) + AGG_CONTABILIDAD, ~1,2 líneas por documento."""
+    rng = np.random.default_rng(semilla)
+    folios = rng.permutation(n)
+    df_dian = pd.DataFrame({'LLAVE_DIAN': pd.Series([f"FE{f}" for f in folios], dtype=object),
+                            'total': rng.integers(10_000, 5_000_000, n).astype(str)})
+    cruzan = int(n * proporcion_cruce)
+    docs = np.r_[folios[:cruzan], rng.integers(n, 2 * n, n - cruzan)]
+    lineas = rng.choice(docs, int(n * 1.2))
+    df_cont = pd.DataFrame({
+        'u_ref': pd.Series([f"fe-{d}" for d in lineas], dtype=object),
+        'u_saldo_f': rng.normal(1_000_000, 250_000, len(lineas)).round(2),
+        'u_infoco01': pd.Series([f"9{d % 100_000:08d}" for d in lineas], dtype=object),
+        'u_cardname': 'Proveedor',
+        'u_acctname': '51350501 Servicios públicos',
+    })
+    return df_dian, df_cont
+
+
+def _iguales(a, b):
+    """Compara las posiciones y el agregado de dos ResultadoConciliacion."""
+    if not all(np.array_equal(x, y) for x, y in zip(a[4:], b[4:])):
+        return False
+    return a.df_cont_agg.equals(b.df_cont_agg)
+
+
+def _etapas():
+    """Segundos por etapa del último conciliar_particionado registrado."""
+    tiempos = {}
+    for r in instrumentacion.registros():
+        if r['etapa'] in ETAPAS:
+            tiempos[r['etapa']] = r['segundos']
+    return tiempos
+
+
+def medir(n, lista_workers, particiones=None, semilla=0):
+    df_dian, df_cont = generar_llaves(n, semilla)
+    inicio = time.perf_counter()
+    cont_base = df_cont.assign(LLAVE_CONT=engine.crear_llave_contable(df_cont['u_ref']))
+    base = engine.conciliar_por_codigos(df_dian, cont_base)
+    t_base = time.perf_counter() - inicio
+    print(f"  {'1 proceso (conciliar_por_codigos)':<36} {t_base:7.2f}s")
+
+    filas, errores = [], []
+    for workers in lista_workers:
+        instrumentacion.limpiar()
+        inicio = time.perf_counter()
+        cont = df_cont.copy()
+        res = conciliacion_particionada.conciliar_particionado(df_dian, cont, workers, particiones)
+        total = time.perf_counter() - inicio
+        etapas = _etapas()
+        serial = sum(s for e, s in etapas.items() if e not in ETAPAS_POOL)
+        pool = sum(s for e, s in etapas.items() if e in ETAPAS_POOL)
+        techo = t_base / serial if serial else float('inf')
+        ok = _iguales(base, res) and cont['LLAVE_CONT'].equals(cont_base['LLAVE_CONT'])
+        if not ok: errores.append(f"{n:,} filas, {workers} procesos: el resultado difiere")
+        detalle = (f"(principal serial {serial:.2f}s, techo x{techo:4.2f}, pool {pool:.2f}s)" if etapas
+                   else "(un proceso: sin particionar)")
+        print(f"  {f'{workers} procesos particionado':<36} {total:7.2f}s  x{t_base / total:4.2f}  {detalle}  "
+              + ("OK" if ok else "DIFIERE"))
+        filas.append({'filas': n, 'workers': workers, 'particiones': particiones or workers,
+                      'segundos': round(total, 4), 'segundos_un_proceso': round(t_base, 4),
+                      'aceleracion': round(t_base / total, 3), 'techo': round(techo, 3),
+                      'etapas': etapas, 'identico': ok})
+    return filas, errores
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Escalamiento del cruce particionado por llave en varios procesos.")
+    parser.add_argument('--filas', type=int, nargs='+', default=[1_500_000])
+    parser.add_argument('--workers', type=int, nargs='+', default=WORKERS_DEFECTO)
+    parser.add_argument('--particiones', type=int, default=None, help="Por defecto una por proceso")
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--salida', default=None, help="JSON con los resultados")
+    args = parser.parse_args(argv)
+
+    nucleos = os.cpu_count() or 1
+    print(f"Núcleos disponibles: {nucleos}")
+    if max(args.workers) > nucleos:
+        print(f"AVISO: con más de {nucleos} procesos no se mide escalamiento, solo el costo de repartir.")
+
+    instrumentacion.activar()
+    resultados, errores = [], []
+    try:
+        for n in args.filas:
+            print(f"== {n:,} filas DIAN ==")
+            filas, fallas = medir(n, args.workers, args.particiones, args.semilla)
+            resultados.extend(filas)
+            errores.extend(fallas)
+    finally:
+        instrumentacion.desactivar()
+
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump({'nucleos': nucleos, 'plataforma': platform.platform(), 'pandas': pd.__version__,
+                       'resultados': resultados}, f, indent=2, ensure_ascii=False)
+    if errores:
+        print("DIFERENCIAS:")
+        for linea in errores: print(f"  - {linea}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:  # sin pyarrow el caché en disco queda desactivado
+    pa = None
+
+# =================================================================
+# CACHÉ EN DISCO (ARROW IPC) PARA ARCHIVOS YA NORMALIZADOS
+# =================================================================
+# Las entradas se identifican por el hash del contenido del archivo subido.
+# VERSION_NORMALIZACION se debe subir cada vez que cambie la lógica de
+# leer_dian / leer_contabilidad_completa: las entradas viejas se descartan solas.
+
+VERSION_NORMALIZACION = 1
+
+DIRECTORIO = os.environ.get('ORDEN_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'orden'))
+LIMITE_BYTES = int(float(os.environ.get('ORDEN_CACHE_MB', '2048')) * 1024 * 1024)
+ACTIVO = pa is not None and os.environ.get('ORDEN_CACHE_DISCO', '1') != '0'
+
+# Con pandas < 3 el texto vive en columnas object y Arrow lo devuelve igual
+_TEXTO_ES_OBJETO = pd.Series(['a']).dtype == object
+
+_META_ATTRS = b'orden_attrs'
+_META_PICKLE = b'orden_columnas_pickle'
+_META_ORDEN = b'orden_columnas'
+
+
+def huella_archivo(file_obj):
+    """Hash (blake2b) del contenido de un archivo subido, una ruta o bytes."""
+    h = hashlib.blake2b(digest_size=20)
+    if isinstance(file_obj, (bytes, bytearray, memoryview)):
+        h.update(file_obj)
+    elif isinstance(file_obj, (str, os.PathLike)):
+        with open(file_obj, 'rb') as f:
+            for bloque in iter(lambda: f.read(1 << 20), b''):
+                h.update(bloque)
+    elif hasattr(file_obj, 'getbuffer'):
+        h.update(file_obj.getbuffer())
+    else:
+        file_obj.seek(0)
+        for bloque in iter(lambda: file_obj.read(1 << 20), b''):
+            h.update(bloque)
+        file_obj.seek(0)
+    return h.hexdigest()
+
+
+def _ruta(tipo, huella):
+    return os.path.join(DIRECTORIO, f"{tipo}-v{VERSION_NORMALIZACION}-{huella}.arrow")
+
+
+def leer(tipo, huella):
+    """Devuelve el DataFrame guardado (lectura con memory-map) o None si no hay entrada."""
+    if not ACTIVO: return None
+    ruta = _ruta(tipo, huella)
+    try:
+        with pa.memory_map(ruta, 'r') as fuente:
+            tabla = pa.ipc.open_file(fuente).read_all()
+            meta = tabla.schema.metadata or {}
+            df = tabla.to_pandas()
+        os.utime(ruta)  # marca de uso para el LRU
+    except (FileNotFoundError, pa.ArrowInvalid, OSError):
+        return None
+
+    # Arrow devuelve None en los nulos de texto; los lectores producen NaN
+    for col in df.columns[(df.dtypes == object).to_numpy()]:
+        df[col] = df[col].where(df[col].notna(), np.nan)
+    if _META_PICKLE in meta:
+        for col, valores in pickle.loads(meta[_META_PICKLE]).items():
+            df[col] = valores
+        df = df[json.loads(meta[_META_ORDEN])]
+    if _META_ATTRS in meta:
+        df.attrs.update(json.loads(meta[_META_ATTRS]))
+    df.attrs['desde_cache_disco'] = True
+    return df
+
+
+def guardar(tipo, huella, df):
+    """Guarda el DataFrame normalizado. Devuelve False si no se pudo (el flujo sigue igual)."""
+    if not ACTIVO or df is None: return False
+    # Columnas objeto con tipos mezclados (número + texto) no tienen tipo Arrow:
+    # se guardan aparte, serializadas, y se reinsertan al leer.
+    mezcladas = {}
+    for col in df.columns[(df.dtypes == object).to_numpy()]:
+        if not (_TEXTO_ES_OBJETO and pd.api.types.infer_dtype(df[col], skipna=True) == 'string'):
+            mezcladas[col] = df[col].to_numpy()
+    try:
+        tabla = pa.Table.from_pandas(df.drop(columns=list(mezcladas)), preserve_index=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, ValueError):
+        return False
+
+    meta = dict(tabla.schema.metadata or {})
+    meta[_META_ATTRS] = json.dumps(df.attrs, default=str).encode()
+    if mezcladas:
+        meta[_META_PICKLE] = pickle.dumps(mezcladas, protocol=pickle.HIGHEST_PROTOCOL)
+        meta[_META_ORDEN] = json.dumps(list(df.columns)).encode()
+    tabla = tabla.replace_schema_metadata(meta)
+
+    tmp = None
+    try:
+        os.makedirs(DIRECTORIO, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=DIRECTORIO, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f, pa.ipc.new_file(f, tabla.schema) as escritor:
+            escritor.write_table(tabla)
+        os.replace(tmp, _ruta(tipo, huella))
+    except OSError:
+        if tmp: _borrar(tmp)
+        return False
+    podar()
+    return True
+
+
+def podar(limite_bytes=None):
+    """Borra entradas de otra versión y, por antigüedad de uso, las que excedan el límite."""
+    limite = LIMITE_BYTES if limite_bytes is None else limite_bytes
+    try: nombres = os.listdir(DIRECTORIO)
+    except FileNotFoundError: return
+    sufijo_version = f"-v{VERSION_NORMALIZACION}-"
+    entradas = []
+    for nombre in nombres:
+        ruta = os.path.join(DIRECTORIO, nombre)
+        if not nombre.endswith('.arrow'): continue
+        try: st_archivo = os.stat(ruta)
+        except FileNotFoundError: continue
+        if sufijo_version not in nombre:
+            _borrar(ruta)
+        else:
+            entradas.append((st_archivo.st_mtime, st_archivo.st_size, ruta))
+
+    total = sum(tam for _, tam, _ in entradas)
+    for _, tam, ruta in sorted(entradas):
+        if total <= limite: break
+        _borrar(ruta)
+        total -= tam
+
+
+def _borrar(ruta):
+    try: os.remove(ruta)
+    except FileNotFoundError: pass
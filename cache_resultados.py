@@ -0,0 +1,75 @@
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+# =================================================================
+# CACHÉ LRU DE RESULTADOS INTERMEDIOS (POR SESIÓN)
+# =================================================================
+# Guarda artefactos por etapa (frame limpio, frame ordenado, ruta del libro final)
+# con llaves que incluyen solo la configuración de la que depende cada
+# etapa: cambiar "expandir" reutiliza el frame ordenado, cambiar el grupo 2
+# reutiliza el frame limpio. Tope de memoria total con expulsión LRU.
+
+LIMITE_BYTES = int(float(os.environ.get('ORDEN_CACHE_SESION_MB', '512')) * 1024 * 1024)
+
+
+def tamano_bytes(valor):
+    """Estimación del tamaño en memoria de un artefacto."""
+    if isinstance(valor, (bytes, bytearray)): return len(valor)
+    if isinstance(valor, (pd.DataFrame, pd.Series)): return int(valor.memory_usage(deep=True).sum())
+    if isinstance(valor, tuple): return sum(tamano_bytes(v) for v in valor)
+    return 64
+
+
+class CacheResultados:
+    """LRU acotado por bytes. Los valores se tratan como inmutables: no modificarlos tras guardarlos."""
+
+    def __init__(self, limite_bytes=None):
+        self.limite = LIMITE_BYTES if limite_bytes is None else limite_bytes
+        self._datos = OrderedDict()   # llave -> (valor, bytes)
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def obtener(self, llave, calcular):
+        """Devuelve el valor de `llave`; si no está, lo calcula con calcular() y lo guarda."""
+        with self._lock:
+            if llave in self._datos:
+                self._datos.move_to_end(llave)
+                return self._datos[llave][0]
+        valor = calcular()
+        self.guardar(llave, valor)
+        return valor
+
+    def guardar(self, llave, valor):
+        tam = tamano_bytes(valor)
+        with self._lock:
+            if llave in self._datos:
+                self._total -= self._datos.pop(llave)[1]
+            if tam > self.limite: return  # no cabe: se usa sin guardarlo
+            self._datos[llave] = (valor, tam)
+            self._total += tam
+            while self._total > self.limite:
+                _, (_, tam_viejo) = self._datos.popitem(last=False)
+                self._total -= tam_viejo
+
+    def quitar(self, llave):
+        with self._lock:
+            if llave in self._datos:
+                self._total -= self._datos.pop(llave)[1]
+
+    def __contains__(self, llave):
+        return llave in self._datos
+
+    def __len__(self):
+        return len(self._datos)
+
+    @property
+    def bytes_usados(self):
+        return self._total
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+            self._total = 0
@@ -0,0 +1,200 @@
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:  # sin pyarrow las particiones viajan como DataFrames serializados
+    pa = None
+
+import engine
+from instrumentacion import etapa, instrumentar
+
+# =================================================================
+# CONCILIACIÓN PARTICIONADA POR LLAVE (VARIOS PROCESOS)
+# =================================================================
+# Las filas DIAN y contables se reparten por el hash de la llave normalizada
+# (pd.util.hash_array módulo el número de particiones): una llave cae siempre
+# en la misma partición, así que el cruce exacto nunca cruza particiones y
+# cada una se resuelve por separado con engine.cruzar_llaves.
+#
+# El proceso principal solo escribe una vez las columnas de entrada como
+# Arrow IPC en /dev/shm, sin reordenarlas. El trabajo por fila corre en el
+# pool en dos rondas sobre ese archivo (memory_map, sin copias):
+#   1. por tramos de filas: normalización de LLAVE_CONT (si no viene) y hash
+#      de las llaves de ambos lados; cada tramo se escribe como Arrow;
+#   2. por partición: las filas de la partición, su factorización y el cruce.
+# De vuelta solo viajan el agregado de la partición y arreglos de
+# posiciones, que se llevan a posiciones globales y se arman con
+# engine.armar_resultado: el resultado es idéntico al de conciliar_por_codigos.
+# En serie quedan la escritura de entrada, la lectura de LLAVE_CONT, la unión
+# y el armado del resultado. Es opcional (workers > 1 y UMBRAL_PARTICIONADO);
+# medir antes de activarlo con
+#   python -m benchmarks.particionado --workers 1 2 4
+
+DIRECTORIO_COMPARTIDO = '/dev/shm' if os.path.isdir('/dev/shm') else None
+TAMANO_BLOQUE_HASH = 1_000_000
+
+
+def particion_hash(llaves, n):
+    """
+    Partición (0..n-1) de cada llave por su hash (por bloques, para acotar la
+    memoria temporal). Solo depende del texto de la llave: la misma llave cae
+    en la misma partición venga de DIAN o de contabilidad, en cualquier proceso.
+    """
+    valores = np.asarray(llaves, dtype=object)
+    particion = np.empty(len(valores), dtype=np.int32)
+    for inicio in range(0, len(valores), TAMANO_BLOQUE_HASH):
+        bloque = valores[inicio:inicio + TAMANO_BLOQUE_HASH]
+        particion[inicio:inicio + len(bloque)] = pd.util.hash_array(bloque, categorize=False) % np.uint64(n)
+    return particion
+
+
+def _rangos(total, n):
+    limites = np.linspace(0, total, n + 1).astype(np.int64)
+    return list(zip(limites[:-1].tolist(), limites[1:].tolist()))
+
+
+def _escribir(df, ruta):
+    tabla = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.OSFile(ruta, 'wb') as f, pa.ipc.new_file(f, tabla.schema) as escritor:
+        escritor.write_table(tabla)
+
+
+def _abrir(ruta):
+    """Tabla Arrow sobre el archivo mapeado en memoria (sin copiarlo)."""
+    return pa.ipc.open_file(pa.memory_map(ruta)).read_all()
+
+
+def _preparar_tramo(carpeta, i, tramo_dian, tramo_cont, n, normalizar):
+    """Ronda 1 (pool): LLAVE_CONT normalizada del tramo y partición de sus llaves."""
+    dian = _abrir(os.path.join(carpeta, 'dian.arrow')).slice(tramo_dian[0], tramo_dian[1] - tramo_dian[0])
+    cont = _abrir(os.path.join(carpeta, 'cont.arrow')).slice(tramo_cont[0], tramo_cont[1] - tramo_cont[0])
+    llaves_dian = dian.column('LLAVE_DIAN').to_pandas()
+    if normalizar:
+        llaves_cont = engine.crear_llave_contable(cont.column('u_ref').to_pandas())
+    else:
+        llaves_cont = cont.column('LLAVE_CONT').to_pandas()
+    _escribir(pd.DataFrame({'PARTICION': particion_hash(llaves_dian, n)}), os.path.join(carpeta, f'dian-{i}.arrow'))
+    _escribir(pd.DataFrame({'LLAVE_CONT': llaves_cont.to_numpy(dtype=object),
+                            'PARTICION': particion_hash(llaves_cont, n)}), os.path.join(carpeta, f'cont-{i}.arrow'))
+
+
+def _tramos_preparados(carpeta, nombre, tramos):
+    return pa.concat_tables([_abrir(os.path.join(carpeta, f'{nombre}-{i}.arrow')) for i in range(tramos)])
+
+
+def _cruzar_particion(carpeta, p, tramos):
+    """Ronda 2 (pool): cruce de la partición p, con posiciones ya globales (salvo las del agregado)."""
+    import pyarrow.compute as pc
+
+    part_dian = _tramos_preparados(carpeta, 'dian', tramos)
+    pos_dian = np.flatnonzero(pc.equal(part_dian.column('PARTICION'), p).to_numpy(zero_copy_only=False))
+    preparados_cont = _tramos_preparados(carpeta, 'cont', tramos)
+    pos_cont = np.flatnonzero(pc.equal(preparados_cont.column('PARTICION'), p).to_numpy(zero_copy_only=False))
+
+    llaves_dian = _abrir(os.path.join(carpeta, 'dian.arrow')).column('LLAVE_DIAN').take(pos_dian).to_pandas()
+    cont = _abrir(os.path.join(carpeta, 'cont.arrow')).select(list(engine.AGG_CONTABILIDAD)).take(pos_cont).to_pandas()
+    cont.insert(0, 'LLAVE_CONT', preparados_cont.column('LLAVE_CONT').take(pos_cont).to_pandas().to_numpy(dtype=object))
+    agg, pos_dc, pos_ac, pos_ds, pos_cs = engine.cruzar_llaves(llaves_dian, cont)
+    return agg, pos_dian[pos_dc], pos_ac, pos_dian[pos_ds], pos_cont[pos_cs]
+
+
+def _cruzar_en_memoria(dian, cont):
+    """Cruce de una partición ya armada en el proceso principal (sin pyarrow)."""
+    agg, pos_dc, pos_ac, pos_ds, pos_cs = engine.cruzar_llaves(dian['LLAVE_DIAN'], cont.drop(columns='_POS'))
+    global_dian, global_cont = dian['_POS'].to_numpy(), cont['_POS'].to_numpy()
+    return agg, global_dian[pos_dc], pos_ac, global_dian[pos_ds], global_cont[pos_cs]
+
+
+def _unir(parciales, df_cont):
+    """Une las particiones en el orden de conciliar_por_codigos (agregado ordenado por llave)."""
+    aggs = [p[0] for p in parciales]
+    desplazamiento = np.cumsum([0] + [len(a) for a in aggs])
+    df_cont_agg = pd.concat(aggs, ignore_index=True)
+    # Las llaves no se repiten entre particiones: basta ordenarlas como factorize(sort=True)
+    orden = np.argsort(df_cont_agg['LLAVE_CONT'].to_numpy(dtype=object), kind='stable')
+    fila_global = np.empty(len(orden), dtype=np.int64)
+    fila_global[orden] = np.arange(len(orden))
+    df_cont_agg = df_cont_agg.take(orden).reset_index(drop=True)
+    for col in df_cont_agg.columns:  # Arrow puede devolver otro dtype de texto
+        if df_cont_agg[col].dtype != df_cont[col].dtype and df_cont[col].dtype == object:
+            df_cont_agg[col] = df_cont_agg[col].astype(object)
+
+    pos_dian_coinc = np.concatenate([p[1] for p in parciales])
+    pos_agg_coinc = np.concatenate([fila_global[d + p[2]] for d, p in zip(desplazamiento, parciales)])
+    por_dian = np.argsort(pos_dian_coinc, kind='stable')
+    pos_dian_sobrante = np.sort(np.concatenate([p[3] for p in parciales]))
+    pos_cont_sobrante = np.sort(np.concatenate([p[4] for p in parciales]))
+    return df_cont_agg, pos_dian_coinc[por_dian], pos_agg_coinc[por_dian], pos_dian_sobrante, pos_cont_sobrante
+
+
+def _parciales_arrow(df_dian, df_cont, workers, particiones, normalizar, carpeta):
+    """Las dos rondas en el pool sobre archivos Arrow; deja LLAVE_CONT en df_cont si hubo que crearla."""
+    columna_llave = 'u_ref' if normalizar else 'LLAVE_CONT'
+    with etapa('escribir_fuentes', len(df_dian) + len(df_cont)):
+        _escribir(df_dian[['LLAVE_DIAN']], os.path.join(carpeta, 'dian.arrow'))
+        _escribir(df_cont[[columna_llave] + list(engine.AGG_CONTABILIDAD)], os.path.join(carpeta, 'cont.arrow'))
+
+    tramos_dian, tramos_cont = _rangos(len(df_dian), particiones), _rangos(len(df_cont), particiones)
+    # Pool por llamada: uno que sobreviva impide terminar al proceso que lo creó (p.ej. en conciliar_lote)
+    with ProcessPoolExecutor(max_workers=min(workers, particiones)) as pool:
+        with etapa('preparar_llaves'):
+            list(pool.map(_preparar_tramo, [carpeta] * particiones, range(particiones), tramos_dian, tramos_cont,
+                          [particiones] * particiones, [normalizar] * particiones))
+        with etapa('cruzar_particiones'):
+            parciales = list(pool.map(_cruzar_particion, [carpeta] * particiones, range(particiones),
+                                      [particiones] * particiones))
+    if normalizar:
+        with etapa('leer_llaves'):
+            llaves = _tramos_preparados(carpeta, 'cont', particiones).column('LLAVE_CONT').to_pandas()
+            df_cont['LLAVE_CONT'] = pd.Series(llaves.to_numpy(dtype=object), index=df_cont.index, dtype=str)
+    return parciales
+
+
+def _parciales_en_memoria(df_dian, df_cont, particiones):
+    """Sin pyarrow (o con columnas que Arrow no acepta): particiones armadas y cruzadas aquí."""
+    with etapa('particionar', len(df_dian) + len(df_cont)):
+        part_dian = particion_hash(df_dian['LLAVE_DIAN'], particiones)
+        part_cont = particion_hash(df_cont['LLAVE_CONT'], particiones)
+        dian = df_dian[['LLAVE_DIAN']].assign(_POS=np.arange(len(df_dian)))
+        cont = df_cont[['LLAVE_CONT'] + list(engine.AGG_CONTABILIDAD)].assign(_POS=np.arange(len(df_cont)))
+    with etapa('cruzar_particiones'):
+        return [_cruzar_en_memoria(dian[part_dian == p], cont[part_cont == p]) for p in range(particiones)]
+
+
+@instrumentar()
+def conciliar_particionado(df_dian, df_cont, workers=None, particiones=None):
+    """
+    Mismo resultado (ResultadoConciliacion) que engine.conciliar_por_codigos,
+    repartiendo el cruce en `particiones` (por defecto una por proceso).
+    Si df_cont no trae LLAVE_CONT, los procesos la crean desde u_ref y queda en df_cont.
+    Con un solo proceso no particiona: corre conciliar_por_codigos.
+    """
+    workers = workers or os.cpu_count() or 1
+    particiones = particiones or workers
+    normalizar = 'LLAVE_CONT' not in df_cont.columns
+    if workers <= 1 or pa is None:
+        if normalizar: df_cont['LLAVE_CONT'] = engine.crear_llave_contable(df_cont['u_ref'])
+        if workers <= 1: return engine.conciliar_por_codigos(df_dian, df_cont)
+        parciales = _parciales_en_memoria(df_dian, df_cont, particiones)
+    else:
+        carpeta = tempfile.mkdtemp(prefix='orden-particiones-', dir=DIRECTORIO_COMPARTIDO)
+        try:
+            parciales = _parciales_arrow(df_dian, df_cont, workers, particiones, normalizar, carpeta)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):  # columnas object con tipos mezclados
+            if normalizar: df_cont['LLAVE_CONT'] = engine.crear_llave_contable(df_cont['u_ref'])
+            parciales = _parciales_en_memoria(df_dian, df_cont, particiones)
+        finally:
+            shutil.rmtree(carpeta, ignore_errors=True)
+
+    columnas_cont = ['LLAVE_CONT'] + list(engine.AGG_CONTABILIDAD)
+    with etapa('unir_particiones'):
+        posiciones = _unir(parciales, df_cont[columnas_cont])
+    with etapa('armar_resultado'):
+        return engine.armar_resultado(df_dian, df_cont, *posiciones)
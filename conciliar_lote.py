@@ -0,0 +1,255 @@
+"""
+Conciliación nocturna por lotes (sin Streamlit).
+
+Uso:
+    python conciliar_lote.py ENTRADA --salida reportes/ --workers 4 --memoria-mb 3000
+    python conciliar_lote.py enero/ --estado estado/ && python conciliar_lote.py febrero/ --estado estado/
+
+ENTRADA puede ser:
+  * una carpeta con pares <ENTIDAD>_dian.xlsx / <ENTIDAD>_contabilidad.xlsx
+    (también se aceptan los sufijos _cont y _netsuite), o
+  * un manifiesto .csv / .json con columnas entidad, dian, contabilidad y,
+    opcionalmente, flujo (gastos | ingresos | ambos).
+
+Cada entidad se procesa en su propio proceso: lectura -> crear_llave_conciliacion ->
+filtros de gastos/ingresos -> ejecutar_conciliacion_universal -> generar_reporte_agrupado
+(con --backend polars, filtros y cruce corren como una consulta lazy de Polars).
+Se escribe un libro por entidad y un resumen.csv con los totales de todas.
+
+Con --estado CARPETA la conciliación es incremental por periodos: cada entidad y
+flujo guarda su estado (incremental.ConciliacionIncremental) en CARPETA y cada
+corrida solo agrega los archivos nuevos, así una factura de enero contabilizada
+en febrero se resuelve al correr febrero. Un archivo ya incorporado no se suma dos veces.
+En este modo el cruce corre en pandas (--backend y --workers-cruce no aplican).
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import cache_disco
+import engine
+from incremental import ConciliacionIncremental
+
+FLUJOS = ('gastos', 'ingresos')
+
+CONFIG_REPORTE = {
+    'col_grupo_1': 'TIPO',
+    'col_grupo_2': 'EMPRESA_GRUPO',
+    'cols_texto': ['NIT', 'LLAVE', 'CUENTA'],
+    'cols_suma': ['VALOR_DIAN', 'VALOR_CONT', 'DIFERENCIA'],
+}
+
+_PATRON_ARCHIVO = re.compile(r'^(?P<entidad>.+?)[_\-\s](?P<tipo>dian|contabilidad|cont|netsuite)\.xlsx?$', re.IGNORECASE)
+
+
+# =================================================================
+# 1. DESCUBRIMIENTO DE PARES DIAN / CONTABILIDAD
+# =================================================================
+
+def descubrir_tareas(entrada, flujo_defecto='ambos'):
+    """Lista de dicts {entidad, dian, contabilidad, flujo} desde una carpeta o un manifiesto."""
+    if os.path.isdir(entrada):
+        pares = {}
+        for nombre in sorted(os.listdir(entrada)):
+            m = _PATRON_ARCHIVO.match(nombre)
+            if not m: continue
+            clave = 'dian' if m['tipo'].lower() == 'dian' else 'contabilidad'
+            pares.setdefault(m['entidad'], {})[clave] = os.path.join(entrada, nombre)
+        tareas = [
+            {'entidad': entidad, 'flujo': flujo_defecto, **archivos}
+            for entidad, archivos in pares.items()
+        ]
+    else:
+        base = os.path.dirname(os.path.abspath(entrada))
+        if entrada.lower().endswith('.json'):
+            with open(entrada, encoding='utf-8') as f: filas = json.load(f)
+        else:
+            with open(entrada, newline='', encoding='utf-8-sig') as f: filas = list(csv.DictReader(f))
+        tareas = []
+        for fila in filas:
+            tarea = {'entidad': fila['entidad'], 'flujo': fila.get('flujo') or flujo_defecto}
+            for clave in ('dian', 'contabilidad'):
+                if fila.get(clave): tarea[clave] = os.path.join(base, fila[clave])
+            tareas.append(tarea)
+
+    incompletas = [t['entidad'] for t in tareas if 'dian' not in t or 'contabilidad' not in t]
+    if incompletas:
+        print(f"Aviso: entidades sin par DIAN/contabilidad, se omiten: {', '.join(incompletas)}", file=sys.stderr)
+    return [t for t in tareas if 'dian' in t and 'contabilidad' in t]
+
+
+# =================================================================
+# 2. PROCESO DE UNA ENTIDAD (corre dentro del pool)
+# =================================================================
+
+def _limitar_memoria(memoria_mb):
+    """Tope de memoria por proceso (Linux/macOS). Al superarlo la entidad falla con MemoryError."""
+    if not memoria_mb: return
+    try:
+        import resource
+        limite = int(memoria_mb) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limite, limite))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+def conciliar_incremental(df_dian, df_cont, flujo, ruta_estado, huellas, aproximado=None):
+    """
+    Como engine.conciliar_flujo, pero acumulando periodos en el estado guardado en
+    `ruta_estado`: solo se agregan los archivos cuyas huellas (dian, contabilidad)
+    no estén ya incorporadas. Devuelve (coincidencias, sobrante_dian, sobrante_cont, df_final).
+    """
+    estado = ConciliacionIncremental.cargar(ruta_estado)
+    filtro_dian, filtro_cont = engine.FILTROS_FLUJO[flujo]
+    huella_dian, huella_cont = huellas
+    estado.agregar(filtro_dian(df_dian) if huella_dian not in estado.archivos else None,
+                   filtro_cont(df_cont) if huella_cont not in estado.archivos else None)
+    estado.archivos.update(huellas)
+    estado.guardar(ruta_estado)
+
+    coinc, sob_dian, sob_cont = estado.resultados()
+    cols_dian_map = engine.resolver_columnas_dian(estado.dian, flujo)
+    aprox = None
+    if aproximado:
+        opciones = aproximado if isinstance(aproximado, dict) else {}
+        aprox, sob_dian, sob_cont = engine.conciliar_aproximado(sob_dian, sob_cont, cols_dian_map, **opciones)
+    df_final = engine.preparar_datos_unificados(coinc, sob_dian, sob_cont, cols_dian_map, aprox=aprox, compacto=True)
+    return coinc, sob_dian, sob_cont, df_final
+
+
+def conciliar_entidad(tarea, carpeta_salida, backend=None, workers_cruce=None, columnas_extra=(), aproximado=None,
+                      carpeta_estado=None):
+    """Procesa una entidad completa y devuelve una fila de resumen por flujo.
+    `columnas_extra` (DIAN o contabilidad) se agregan al reporte después de NIT, LLAVE y CUENTA;
+    `aproximado` (opciones de engine.conciliar_aproximado) activa la segunda pasada sobre los sobrantes;
+    con `carpeta_estado` el cruce acumula los periodos ya procesados (conciliar_incremental)."""
+    inicio = time.perf_counter()
+    entidad = tarea['entidad']
+    flujos = FLUJOS if tarea.get('flujo', 'ambos') == 'ambos' else (tarea['flujo'],)
+    try:
+        df_dian = engine.leer_dian(tarea['dian'])
+        df_cont = engine.leer_contabilidad_completa(tarea['contabilidad'])
+        if df_dian is None or df_cont is None:
+            raise ValueError("No se pudo leer alguno de los archivos")
+        df_dian = engine.crear_llave_conciliacion(df_dian)
+        if carpeta_estado:
+            huellas = (cache_disco.huella_archivo(tarea['dian']), cache_disco.huella_archivo(tarea['contabilidad']))
+
+        config = dict(CONFIG_REPORTE, cols_texto=CONFIG_REPORTE['cols_texto'] + list(columnas_extra))
+        resumen = []
+        ruta_salida = os.path.join(carpeta_salida, f"{entidad}.xlsx")
+        with pd.ExcelWriter(ruta_salida, engine='xlsxwriter', engine_kwargs={'options': {'constant_memory': True}}) as writer:
+            for flujo in flujos:
+                if carpeta_estado:
+                    ruta_estado = os.path.join(carpeta_estado, f"{entidad}-{flujo}.pkl")
+                    coinc, sob_dian, sob_cont, df_final = conciliar_incremental(df_dian, df_cont, flujo, ruta_estado, huellas, aproximado)
+                else:
+                    coinc, sob_dian, sob_cont, df_final = engine.conciliar_flujo(df_dian, df_cont, flujo, compacto=True, backend=backend,
+                                                                               workers=workers_cruce, columnas_extra=columnas_extra,
+                                                                               aproximado=aproximado)
+                engine.generar_reporte_agrupado(writer, df_final, flujo.upper(), config)
+
+                resumen.append({
+                    'entidad': entidad, 'flujo': flujo, 'estado': 'OK',
+                    'coincidencias': len(coinc), 'sobrante_dian': len(sob_dian), 'sobrante_cont': len(sob_cont),
+                    'aproximadas': int((df_final['TIPO'] == 'COINCIDENCIA APROXIMADA').sum()) if not df_final.empty else 0,
+                    'valor_dian': round(engine.sumar_pesos(df_final, 'VALOR_DIAN'), 2) if not df_final.empty else 0.0,
+                    'valor_cont': round(engine.sumar_pesos(df_final, 'VALOR_CONT'), 2) if not df_final.empty else 0.0,
+                    'diferencia': round(engine.sumar_pesos(df_final, 'DIFERENCIA'), 2) if not df_final.empty else 0.0,
+                })
+        segundos = round(time.perf_counter() - inicio, 2)
+        for fila in resumen:
+            fila.update(segundos=segundos, archivo=ruta_salida, error='')
+        return resumen
+    except MemoryError:
+        error = "Límite de memoria del proceso superado"
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return [{'entidad': entidad, 'flujo': '/'.join(flujos), 'estado': 'ERROR', 'error': error,
+             'segundos': round(time.perf_counter() - inicio, 2)}]
+
+
+# =================================================================
+# 3. ORQUESTACIÓN
+# =================================================================
+
+COLUMNAS_RESUMEN = ['entidad', 'flujo', 'estado', 'coincidencias', 'sobrante_dian', 'sobrante_cont', 'aproximadas',
+                    'valor_dian', 'valor_cont', 'diferencia', 'segundos', 'archivo', 'error']
+
+
+def ejecutar_lote(tareas, carpeta_salida, workers=None, memoria_mb=None, backend=None, workers_cruce=None, columnas_extra=(),
+                 aproximado=None, carpeta_estado=None):
+    """Corre todas las entidades en un pool de procesos y escribe resumen.csv. Devuelve las filas."""
+    os.makedirs(carpeta_salida, exist_ok=True)
+    if carpeta_estado: os.makedirs(carpeta_estado, exist_ok=True)
+    filas = []
+    # max_tasks_per_child=1: cada entidad arranca en un proceso limpio (la memoria vuelve al SO)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_limitar_memoria,
+                             initargs=(memoria_mb,), max_tasks_per_child=1) as pool:
+        futuros = {pool.submit(conciliar_entidad, tarea, carpeta_salida, backend, workers_cruce, columnas_extra, aproximado,
+                               carpeta_estado): tarea for tarea in tareas}
+        for futuro in as_completed(futuros):
+            tarea = futuros[futuro]
+            try:
+                resultado = futuro.result()
+            except Exception as e:  # el proceso murió (p.ej. OOM del sistema)
+                resultado = [{'entidad': tarea['entidad'], 'flujo': tarea.get('flujo', ''), 'estado': 'ERROR',
+                              'error': f"{type(e).__name__}: {e}"}]
+            for fila in resultado:
+                print(f"[{fila['estado']}] {fila['entidad']} {fila['flujo']} {fila.get('segundos', '')}s {fila.get('error', '')}".rstrip())
+            filas.extend(resultado)
+
+    filas.sort(key=lambda f: (f['entidad'], f['flujo']))
+    with open(os.path.join(carpeta_salida, 'resumen.csv'), 'w', newline='', encoding='utf-8') as f:
+        escritor = csv.DictWriter(f, fieldnames=COLUMNAS_RESUMEN, extrasaction='ignore')
+        escritor.writeheader()
+        escritor.writerows(filas)
+    return filas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Conciliación DIAN vs contabilidad por lotes (varias entidades en paralelo).")
+    parser.add_argument('entrada', help="Carpeta con pares <ENTIDAD>_dian.xlsx/<ENTIDAD>_contabilidad.xlsx o manifiesto .csv/.json")
+    parser.add_argument('--salida', default='reportes_conciliacion', help="Carpeta de salida (un libro por entidad + resumen.csv)")
+    parser.add_argument('--workers', type=int, default=None, help="Procesos en paralelo (por defecto: núcleos disponibles)")
+    parser.add_argument('--memoria-mb', type=int, default=None, help="Tope de memoria por proceso, en MB")
+    parser.add_argument('--flujo', choices=['gastos', 'ingresos', 'ambos'], default='ambos', help="Flujo por defecto si el manifiesto no lo indica")
+    parser.add_argument('--backend', choices=list(engine.BACKENDS), default=None,
+                        help="Motor del cruce: pandas o polars (por defecto ORDEN_BACKEND o pandas)")
+    parser.add_argument('--workers-cruce', type=int, default=None,
+                        help="Procesos para el cruce particionado por llave de libros muy grandes (por defecto ORDEN_CONCILIACION_WORKERS)")
+    parser.add_argument('--columnas-extra', nargs='+', default=[], metavar='COLUMNA',
+                        help="Columnas de DIAN o contabilidad a incluir en el reporte (p.ej. fecha_emisión Fecha)")
+    parser.add_argument('--aproximado', action='store_true',
+                        help="Segunda pasada sobre los sobrantes: mismo NIT, valor y fecha cercanos (COINCIDENCIA APROXIMADA)")
+    parser.add_argument('--tolerancia', type=float, default=1000.0, help="Diferencia máxima en pesos para --aproximado")
+    parser.add_argument('--ventana-dias', type=int, default=30, help="Diferencia máxima de fechas en días para --aproximado")
+    parser.add_argument('--estado', default=None, metavar='CARPETA',
+                        help="Conciliación incremental: acumula en CARPETA los periodos ya procesados de cada entidad")
+    args = parser.parse_args(argv)
+    # Avisos del motor y, con ORDEN_INSTRUMENTACION=1, una línea JSON por etapa
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+
+    aproximado = {'tolerancia': args.tolerancia, 'ventana_dias': args.ventana_dias} if args.aproximado else None
+    tareas = descubrir_tareas(args.entrada, args.flujo)
+    if not tareas:
+        print("No se encontraron entidades para conciliar.", file=sys.stderr)
+        return 1
+    print(f"Conciliando {len(tareas)} entidades con {args.workers or os.cpu_count()} procesos...")
+    filas = ejecutar_lote(tareas, args.salida, args.workers, args.memoria_mb, args.backend, args.workers_cruce, args.columnas_extra,
+                         aproximado, args.estado)
+    errores = sum(f['estado'] != 'OK' for f in filas)
+    print(f"Listo: {len(filas) - errores} OK, {errores} con error. Resumen en {os.path.join(args.salida, 'resumen.csv')}")
+    return 1 if errores else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
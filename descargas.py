@@ -0,0 +1,69 @@
+import os
+import tempfile
+import time
+
+# =================================================================
+# REPORTES EN DISCO PARA DESCARGA (CON VENCIMIENTO)
+# =================================================================
+# Los libros generados se escriben directo a un archivo de esta carpeta y
+# la descarga lee sus bytes solo al hacer clic: ni el libro ni una copia en
+# bytes quedan guardados en la sesión. Cada archivo
+# vence TTL_SEGUNDOS después de su último uso y se borra en la siguiente
+# purga (al crear un reporte nuevo).
+
+DIRECTORIO = os.environ.get('ORDEN_DESCARGAS_DIR') or os.path.join(tempfile.gettempdir(), 'orden-descargas')
+TTL_SEGUNDOS = int(os.environ.get('ORDEN_DESCARGAS_TTL', '3600'))
+
+
+def purgar(ttl=None):
+    """Borra los reportes sin usar hace más de `ttl` segundos. Devuelve cuántos borró."""
+    limite = time.time() - (TTL_SEGUNDOS if ttl is None else ttl)
+    borrados = 0
+    try:
+        nombres = os.listdir(DIRECTORIO)
+    except OSError:
+        return 0
+    for nombre in nombres:
+        ruta = os.path.join(DIRECTORIO, nombre)
+        try:
+            if os.path.getmtime(ruta) < limite:
+                os.remove(ruta)
+                borrados += 1
+        except OSError:  # otro proceso ya lo borró
+            pass
+    return borrados
+
+
+def nueva_ruta(sufijo='.xlsx'):
+    """Ruta nueva (archivo vacío ya creado) para escribir un reporte; purga los vencidos."""
+    purgar()
+    os.makedirs(DIRECTORIO, exist_ok=True)
+    fd, ruta = tempfile.mkstemp(suffix=sufijo, prefix='reporte-', dir=DIRECTORIO)
+    os.close(fd)
+    return ruta
+
+
+def disponible(ruta):
+    return bool(ruta) and os.path.exists(ruta)
+
+
+def leer(ruta):
+    """Bytes del reporte (el archivo se cierra al terminar); el uso renueva su vencimiento."""
+    try:
+        os.utime(ruta)
+    except OSError:
+        pass
+    with open(ruta, 'rb') as f:
+        return f.read()
+
+
+def lector(ruta):
+    """Callable para st.download_button: el archivo se lee solo al hacer clic."""
+    return lambda: leer(ruta)
+
+
+def eliminar(ruta):
+    try:
+        os.remove(ruta)
+    except OSError:
+        pass
@@ -1,7 +1,25 @@
 import pandas as pd
 import numpy as np
 import re
-import streamlit as st
+import datetime
+import functools
+import logging
+import os
+import weakref
+from collections import namedtuple
+from pandas.io.parsers import TextParser
+
+try:
+    import streamlit as st
+except ImportError:  # uso sin interfaz (CLI, procesos por lotes)
+    st = None
+
+import cache_disco
+import paginacion
+from instrumentacion import instrumentar
+from normalizacion import memorizada
+
+logger = logging.getLogger('orden.engine')
 
 # --- CONSTANTES VISUALES ---
 CABIFY_PURPLE = '#7145D6'
@@ -17,11 +35,14 @@ def normalize_col_name(col_name):
     """Normaliza nombres de columnas (quita espacios, caracteres raros, minusculas)."""
     return re.sub(r'[^\w]+', '_', str(col_name)).lower().strip('_')
 
+@memorizada('nit')
 def clean_nit_numeric(nit_series):
     if nit_series is None or nit_series.empty:
         return pd.Series([''] * len(nit_series), dtype=str)
     return nit_series.astype(str).str.replace(r'[^0-9]+', '', regex=True)
 
+@instrumentar()
+@memorizada('empresa')
 def standardize_company_name(name_series):
     if name_series is None or name_series.empty:
         return pd.Series(['SIN NOMBRE'] * len(name_series), dtype=str)
@@ -35,6 +56,11 @@ def standardize_company_name(name_series):
         .str.strip()
     )
 
+@memorizada('llave')
+def normalizar_llave(serie):
+    """Llave de documento: solo caracteres de palabra, en mayúsculas."""
+    return serie.astype(str).str.replace(r'[^\w]+', '', regex=True).str.upper()
+
 def limpiar_moneda_colombia(valor):
     if pd.isna(valor) or str(valor).strip() == '': return 0.0
     s = str(valor).replace('$', '').replace(' ', '')
@@ -49,13 +75,100 @@ def limpiar_moneda_colombia(valor):
         return float(s)
     except: return 0.0
 
+@instrumentar()
+def limpiar_moneda_colombia_vectorizado(serie):
+    """
+    Versión por columna de limpiar_moneda_colombia (mismo resultado celda a celda).
+    Devuelve (valores float64, índice de las filas que no se pudieron convertir).
+    """
+    if serie is None or len(serie) == 0:
+        return pd.Series(dtype=float, index=getattr(serie, 'index', None)), pd.Index([])
+
+    # Columnas ya numéricas (openpyxl/calamine): sin trabajo de texto
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        return serie.astype(float).fillna(0.0), serie.index[:0]
+
+    valores = pd.Series(0.0, index=serie.index)
+    nulos = serie.isna().to_numpy()
+
+    # Celdas numéricas dentro de columnas mixtas: se toman tal cual
+    tipo = pd.api.types.infer_dtype(serie, skipna=True)
+    if tipo in ('floating', 'integer', 'mixed-integer-float'):
+        es_num = ~nulos
+    elif tipo == 'string':
+        es_num = np.zeros(len(serie), dtype=bool)
+    else:
+        es_num = serie.map(lambda v: isinstance(v, (int, float)) and not isinstance(v, bool)).to_numpy() & ~nulos
+    if es_num.any():
+        valores[es_num] = serie[es_num].astype(float).to_numpy()
+
+    es_txt = ~nulos & ~es_num
+    if not es_txt.any():
+        return valores, serie.index[:0]
+
+    txt = serie[es_txt].astype(str)
+    vacio = (txt.str.strip() == '').to_numpy()
+    s = txt.str.replace('$', '', regex=False).str.replace(' ', '', regex=False)
+
+    pos_coma, pos_punto = s.str.rfind(','), s.str.rfind('.')
+    hay_coma, hay_punto = pos_coma >= 0, pos_punto >= 0
+    ambos = hay_coma & hay_punto
+    coma_decimal = ambos & (pos_coma > pos_punto)
+    solo_coma = hay_coma & ~hay_punto
+    dos_decimales = (s.str.len() - pos_coma - 1) == 2
+
+    punto_a_coma = s.str.replace(',', '.', regex=False)
+    sin_comas = s.str.replace(',', '', regex=False)
+    miles_punto = s.str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+    limpio = pd.Series(np.select(
+        [coma_decimal, (ambos & ~coma_decimal) | (solo_coma & ~dos_decimales), solo_coma & dos_decimales],
+        [miles_punto, sin_comas, punto_a_coma],
+        default=s,
+    ), dtype=object)
+
+    convertido = np.array(pd.to_numeric(limpio, errors='coerce'), dtype=float)
+    validos = ~np.isnan(convertido) & ~vacio
+    # float() es la referencia exacta: to_numeric solo decide qué celdas son válidas
+    if validos.any():
+        convertido[validos] = limpio[validos].to_numpy(dtype=str).astype(float)
+
+    # Lo que to_numeric no entiende (p.ej. '1_000', 'nan') se reintenta con float()
+    fallidos = []
+    for pos in np.flatnonzero(~validos & ~vacio):
+        try: convertido[pos] = float(limpio.iat[pos])
+        except ValueError:
+            convertido[pos] = 0.0
+            fallidos.append(pos)
+    convertido[vacio] = 0.0
+
+    valores[es_txt] = convertido
+    return valores, txt.index[fallidos]
+
 # =================================================================
-# 2. LECTURA DE ARCHIVOS (CACHÉ + CALAMINE)
+# 2. LECTURA DE ARCHIVOS (CACHÉ EN DISCO + CALAMINE)
 # =================================================================
 
-@st.cache_data(ttl=3600, show_spinner=False)
+def _cache_sesion(**kwargs_cache):
+    """st.cache_data cuando hay una sesión de Streamlit activa; llamada directa en otro caso."""
+    def decorador(funcion):
+        if st is None: return funcion
+        con_cache = None
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            nonlocal con_cache
+            if not st.runtime.exists(): return funcion(*args, **kwargs)
+            if con_cache is None: con_cache = st.cache_data(**kwargs_cache)(funcion)
+            return con_cache(*args, **kwargs)
+        return envoltura
+    return decorador
+
+@instrumentar()
+@_cache_sesion(ttl=3600, show_spinner=False)
 def leer_dian(file_obj):
     if file_obj is None: return None
+    huella = cache_disco.huella_archivo(file_obj)
+    df = cache_disco.leer('dian', huella)
+    if df is not None: return df
     try:
         # Intenta usar calamine (muy rápido)
         df = pd.read_excel(file_obj, engine="calamine", dtype=str)
@@ -66,24 +179,33 @@ def leer_dian(file_obj):
     
     col_map = {col: normalize_col_name(col) for col in df.columns}
     df.rename(columns=col_map, inplace=True)
+    cache_disco.guardar('dian', huella, df)
     return df
 
-@st.cache_data(ttl=3600, show_spinner=False)
+@instrumentar()
+@_cache_sesion(ttl=3600, show_spinner=False)
 def leer_contabilidad_completa(file_obj):
     if file_obj is None: return None
+    huella = cache_disco.huella_archivo(file_obj)
+    df_cache = cache_disco.leer('contabilidad', huella)
+    if df_cache is not None: return df_cache
     try:
-        file_obj.seek(0)
-        try: df_preview = pd.read_excel(file_obj, nrows=20, header=None, engine='openpyxl')
-        except: df_preview = pd.read_excel(file_obj, nrows=20, header=None)
+        # Una sola lectura del libro: celdas crudas, la cabecera se busca en memoria
+        df_crudo, motor = _leer_hoja_cruda(file_obj)
         
         header_row = 0
-        for i, row in df_preview.iterrows():
+        for i, row in df_crudo.head(20).iterrows():
             row_str = row.astype(str).values
             if 'Cuenta' in row_str and 'Fecha' in row_str:
                 header_row = i; break
         
-        file_obj.seek(0)
-        df = pd.read_excel(file_obj, header=header_row, engine='openpyxl')
+        # Mismo parser que usa read_excel internamente (inferencia de tipos idéntica)
+        filas = df_crudo.iloc[header_row:].to_numpy().tolist()
+        del df_crudo
+        # Celdas de cabecera vacías: mismo nombre que les da read_excel (si no, quedan como NaN)
+        filas[0] = [f"Unnamed: {i}" if pd.isna(c) else c for i, c in enumerate(filas[0])]
+        df = TextParser(filas, header=0, skip_blank_lines=False).read()
+        del filas
         
         # Limpieza básica Netsuite
         df['Cuenta'] = df['Cuenta'].astype(str).replace(['nan', 'None', ''], np.nan)
@@ -95,16 +217,25 @@ def leer_contabilidad_completa(file_obj):
         
         df['CODIGO_CUENTA'] = df['Cuenta'].str.strip().str.extract(r'^(\d+)')
         
-        col_deb = next((c for c in df.columns if 'Déb' in c), None)
-        col_cred = next((c for c in df.columns if 'Créd' in c), None)
-        val_deb = df[col_deb].apply(limpiar_moneda_colombia) if col_deb else 0.0
-        val_cred = df[col_cred].apply(limpiar_moneda_colombia) if col_cred else 0.0
+        columnas_texto = [c for c in df.columns if isinstance(c, str)]
+        col_deb = next((c for c in columnas_texto if 'Déb' in c), None)
+        col_cred = next((c for c in columnas_texto if 'Créd' in c), None)
+        filas_invalidas = pd.Index([])
+        val_deb, val_cred = 0.0, 0.0
+        if col_deb:
+            val_deb, err_deb = limpiar_moneda_colombia_vectorizado(df[col_deb])
+            filas_invalidas = filas_invalidas.union(err_deb)
+        if col_cred:
+            val_cred, err_cred = limpiar_moneda_colombia_vectorizado(df[col_cred])
+            filas_invalidas = filas_invalidas.union(err_cred)
         df['SALDO_NETO_CALCULADO'] = val_deb - val_cred
+        if len(filas_invalidas):
+            logger.warning("Aviso contabilidad: %d filas con Déb/Créd no numérico (tomadas como 0): %s", len(filas_invalidas), list(filas_invalidas[:20]))
         
         # Renombrar a estándar interno
-        col_ref_orig = next((c for c in df.columns if 'mero de doc' in c or 'Nro' in c), 'Número de documento')
-        col_nit_orig = next((c for c in df.columns if 'Identifi' in c or 'Nit' in c), 'Número Identificación')
-        col_nom_orig = next((c for c in df.columns if 'Nombre' in c), 'Nombre')
+        col_ref_orig = next((c for c in columnas_texto if 'mero de doc' in c or 'Nro' in c), 'Número de documento')
+        col_nit_orig = next((c for c in columnas_texto if 'Identifi' in c or 'Nit' in c), 'Número Identificación')
+        col_nom_orig = next((c for c in columnas_texto if 'Nombre' in c), 'Nombre')
         
         df_renamed = df.rename(columns={
             col_ref_orig: 'u_ref', 
@@ -115,27 +246,59 @@ def leer_contabilidad_completa(file_obj):
         df_renamed['u_saldo_f'] = df['SALDO_NETO_CALCULADO']
         if 'u_infoco01' in df_renamed.columns:
             df_renamed['u_infoco01'] = df_renamed['u_infoco01'].astype(str).str.replace(r'\.0$', '', regex=True)
+        df_renamed.attrs['filas_moneda_invalidas'] = list(filas_invalidas)
+        df_renamed.attrs['motor_lectura'] = motor
+        cache_disco.guardar('contabilidad', huella, df_renamed)
             
         return df_renamed
     except Exception as e:
-        print(f"Error leyendo contabilidad: {e}")
+        logger.exception("Error leyendo contabilidad: %s", e)
         return None
 
+@instrumentar()
+def _leer_hoja_cruda(file_obj):
+    """
+    Lee la primera hoja una sola vez, sin cabecera ni inferencia de tipos.
+    Prefiere calamine y cae a openpyxl (que pandas abre en modo read_only).
+    Devuelve (df_crudo, motor_usado).
+    """
+    ultimo_error = None
+    for motor in ('calamine', 'openpyxl'):
+        try:
+            if hasattr(file_obj, 'seek'): file_obj.seek(0)
+            return pd.read_excel(file_obj, header=None, dtype=object, engine=motor), motor
+        except Exception as e:
+            ultimo_error = e
+    raise ultimo_error
+
 # =================================================================
 # 3. LÓGICA DE FILTRADO Y CRUCE
 # =================================================================
 
+@instrumentar()
 def crear_llave_conciliacion(df):
     cols = df.columns
     prefijo = next((c for c in cols if 'prefijo' in c), None)
     folio = next((c for c in cols if 'folio' in c), None)
     if not prefijo or not folio: return df
-    df['LLAVE_DIAN'] = (
-        df[prefijo].astype(str).str.strip() + 
-        df[folio].astype(str).str.strip()
-    ).str.replace(r'[^\w]+', '', regex=True).str.upper()
+    # La limpieza de la llave ya elimina los espacios que quitaba strip()
+    df['LLAVE_DIAN'] = normalizar_llave(df[prefijo].astype(str) + df[folio].astype(str))
     return df
 
+def resolver_columnas_dian(df, flujo='gastos'):
+    """
+    Mapa de columnas DIAN (total, iva, emisor, nit) para preparar_datos_unificados.
+    En ingresos la contraparte es el receptor de la factura; en gastos, el emisor.
+    """
+    cols = df.columns
+    contraparte = 'receptor' if flujo == 'ingresos' else 'emisor'
+    return {
+        'total': next((c for c in cols if c.startswith('total')), 'total_bruto'),
+        'iva': next((c for c in cols if c.startswith('iva')), 'iva'),
+        'emisor': next((c for c in cols if 'nombre' in c and contraparte in c), 'nombre_emisor'),
+        'nit': next((c for c in cols if 'nit' in c and contraparte in c), None),
+    }
+
 def filtrar_solo_gastos(df):
     df = df[df['CODIGO_CUENTA'].str.startswith('5', na=False)]
     return df[~df['u_acctname'].str.contains('DIFERENCIA EN CAMBIO|DEPRECIACI', case=False, na=False)]
@@ -156,42 +319,363 @@ def filtrar_dian_ingresos(df):
     if not col_grupo: return df
     return df[df[col_grupo].astype(str).str.lower().str.contains('emitido')].copy()
 
-def ejecutar_conciliacion_universal(df_dian, df_cont):
-    """Realiza el cruce y devuelve 3 DataFrames: Coincidencias, Sobra DIAN, Sobra Contabilidad"""
+AGG_CONTABILIDAD = {'u_saldo_f': 'sum', 'u_infoco01': 'first', 'u_cardname': 'first', 'u_acctname': 'first'}
+
+def crear_llave_contable(ref_series):
+    """Llave de cruce del lado contable a partir del número de documento."""
+    return normalizar_llave(ref_series)
+
+def agrupar_contabilidad(df_cont):
+    """Una fila por documento contable (LLAVE_CONT): saldo sumado, datos del tercero de la primera línea."""
+    return df_cont.groupby('LLAVE_CONT').agg(AGG_CONTABILIDAD).reset_index()
+
+ResultadoConciliacion = namedtuple('ResultadoConciliacion', [
+    'coincidencias', 'sobrante_dian', 'sobrante_cont', 'df_cont_agg',
+    'pos_dian_coinc',     # posición en df_dian de cada fila de coincidencias
+    'pos_agg_coinc',      # fila de df_cont_agg de cada fila de coincidencias
+    'pos_dian_sobrante',  # posiciones en df_dian del sobrante DIAN
+    'pos_cont_sobrante',  # posiciones en df_cont del sobrante contable
+])
+
+def cruzar_llaves(llaves_dian, df_cont):
+    """
+    Núcleo del cruce sin armar frames de salida: recibe las llaves DIAN y las
+    columnas LLAVE_CONT + AGG_CONTABILIDAD del lado contable y devuelve
+    (df_cont_agg, pos_dian_coinc, pos_agg_coinc, pos_dian_sobrante, pos_cont_sobrante).
+    Es la unidad de trabajo de cada partición en el modo particionado.
+    """
+    # Códigos -1 = llave nula: groupby la descarta y merge no la cruza
+    cod_cont, llaves = pd.factorize(df_cont['LLAVE_CONT'], sort=True)
+    cod_dian = llaves.get_indexer(llaves_dian)
+    valida_cont = cod_cont >= 0
+
+    # Agregado por documento: el código ya ordena igual que groupby('LLAVE_CONT')
+    df_cont_agg = df_cont.loc[valida_cont, list(AGG_CONTABILIDAD)].groupby(cod_cont[valida_cont]).agg(AGG_CONTABILIDAD)
+    df_cont_agg.insert(0, 'LLAVE_CONT', llaves.take(df_cont_agg.index))
+    df_cont_agg = df_cont_agg.reset_index(drop=True)
+
+    llave_en_dian = np.zeros(len(llaves) + 1, dtype=bool)  # la última casilla recibe los -1
+    llave_en_dian[cod_dian] = True
+    en_cont = cod_dian >= 0
+    pos_dian_coinc = np.flatnonzero(en_cont)
+    pos_agg_coinc = cod_dian[pos_dian_coinc]
+    pos_dian_sobrante = np.flatnonzero(~en_cont)
+    pos_cont_sobrante = np.flatnonzero(valida_cont & ~llave_en_dian[cod_cont])
+    return df_cont_agg, pos_dian_coinc, pos_agg_coinc, pos_dian_sobrante, pos_cont_sobrante
+
+def armar_resultado(df_dian, df_cont, df_cont_agg, pos_dian_coinc, pos_agg_coinc, pos_dian_sobrante, pos_cont_sobrante):
+    """Frames del cruce a partir de las posiciones de cruzar_llaves (o de sus particiones ya unidas)."""
+    # Coincidencias con el mismo orden, columnas y sufijos que merge(how='inner')
+    izq = df_dian.iloc[pos_dian_coinc].reset_index(drop=True)
+    der = df_cont_agg.iloc[pos_agg_coinc].reset_index(drop=True)
+    repetidas = izq.columns.intersection(der.columns)
+    if len(repetidas):
+        izq = izq.rename(columns={c: f"{c}_DIAN" for c in repetidas})
+        der = der.rename(columns={c: f"{c}_CONT" for c in repetidas})
+    df_coinc = pd.concat([izq, der], axis=1)
+
+    # El sobrante DIAN salía de un merge left: índice = posición en df_dian
+    df_sob_dian = df_dian.iloc[pos_dian_sobrante].set_axis(pd.Index(pos_dian_sobrante), axis=0)
+    df_sob_cont = df_cont.iloc[pos_cont_sobrante]
+    return ResultadoConciliacion(df_coinc, df_sob_dian, df_sob_cont, df_cont_agg,
+                                 pos_dian_coinc, pos_agg_coinc, pos_dian_sobrante, pos_cont_sobrante)
+
+def conciliar_por_codigos(df_dian, df_cont):
+    """
+    Cruce en una sola pasada: factoriza las llaves una sola vez en códigos enteros
+    (ordenados, así el código es también la fila de df_cont_agg) y reparte
+    las filas por código, sin merges. df_cont debe traer LLAVE_CONT.
+    """
+    posiciones = cruzar_llaves(df_dian['LLAVE_DIAN'], df_cont[['LLAVE_CONT'] + list(AGG_CONTABILIDAD)])
+    return armar_resultado(df_dian, df_cont, *posiciones)
+
+# Modo particionado por llave en varios procesos (conciliacion_particionada), solo para volúmenes grandes
+WORKERS_CONCILIACION = int(os.environ.get('ORDEN_CONCILIACION_WORKERS', '1'))
+UMBRAL_PARTICIONADO = int(os.environ.get('ORDEN_UMBRAL_PARTICIONADO', '1000000'))
+
+@instrumentar()
+def ejecutar_conciliacion_universal(df_dian, df_cont, workers=None):
+    """
+    Realiza el cruce y devuelve 3 DataFrames: Coincidencias, Sobra DIAN, Sobra Contabilidad.
+    Con workers > 1 (o ORDEN_CONCILIACION_WORKERS) y más de UMBRAL_PARTICIONADO filas
+    el cruce (incluida la llave contable) se reparte por hash de llave entre procesos,
+    con idéntico resultado. Es opcional: medir con benchmarks/particionado.py.
+    """
     if df_cont.empty or df_dian.empty: return pd.DataFrame(), df_dian, df_cont
 
+    workers = WORKERS_CONCILIACION if workers is None else workers
+    particionado = (workers > 1 and 'LLAVE_DIAN' in df_dian.columns
+                    and len(df_dian) + len(df_cont) >= UMBRAL_PARTICIONADO)
+    if particionado:
+        # Los procesos del modo particionado crean LLAVE_CONT desde u_ref
+        if 'LLAVE_CONT' in df_cont.columns: del df_cont['LLAVE_CONT']
+        import conciliacion_particionada
+        res = conciliacion_particionada.conciliar_particionado(df_dian, df_cont, workers)
+        return res.coincidencias, res.sobrante_dian, res.sobrante_cont
+
     # Crear llaves
-    df_cont['LLAVE_CONT'] = df_cont['u_ref'].astype(str).str.strip().str.replace(r'[^\w]+', '', regex=True).str.upper()
-    
-    # Agrupar contabilidad por documento (puede haber multiples lineas por factura)
-    agg_dict = {'u_saldo_f': 'sum', 'u_infoco01': 'first', 'u_cardname': 'first', 'u_acctname': 'first'}
-    df_cont_agg = df_cont.groupby('LLAVE_CONT').agg(agg_dict).reset_index()
+    df_cont['LLAVE_CONT'] = crear_llave_contable(df_cont['u_ref'])
 
     if 'LLAVE_DIAN' not in df_dian.columns: return pd.DataFrame(), df_dian, df_cont
 
-    # MERGE (CRUCE)
-    # 1. Coincidencias
-    df_coinc = pd.merge(df_dian, df_cont_agg, left_on='LLAVE_DIAN', right_on='LLAVE_CONT', how='inner', suffixes=('_DIAN', '_CONT'))
-    
-    # 2. Sobrante DIAN
-    df_left = pd.merge(df_dian, df_cont_agg[['LLAVE_CONT']], left_on='LLAVE_DIAN', right_on='LLAVE_CONT', how='left', indicator=True)
-    df_sob_dian = df_left[df_left['_merge'] == 'left_only'].drop(columns=['LLAVE_CONT', '_merge'])
-    
-    # 3. Sobrante Contabilidad (Expandido a sus lineas originales)
-    df_right = pd.merge(df_cont_agg, df_dian[['LLAVE_DIAN']], left_on='LLAVE_CONT', right_on='LLAVE_DIAN', how='left', indicator=True)
-    lista_llaves_sobrantes = df_right[df_right['_merge'] == 'left_only']['LLAVE_CONT']
-    df_sob_cont = df_cont[df_cont['LLAVE_CONT'].isin(lista_llaves_sobrantes)]
-    
-    return df_coinc, df_sob_dian, df_sob_cont
+    # Cruce en una sola pasada sobre códigos enteros (ver conciliar_por_codigos)
+    res = conciliar_por_codigos(df_dian, df_cont)
+    return res.coincidencias, res.sobrante_dian, res.sobrante_cont
+
+def _valor_neto_dian(t, col_total, col_iva):
+    """Total DIAN menos IVA (si existe la columna) para comparar contra el saldo contable."""
+    val_d = pd.to_numeric(t[col_total], errors='coerce').fillna(0)
+    # Restar IVA si existe columna en DIAN para obtener subtotal
+    if col_iva and col_iva in t.columns:
+        val_d -= pd.to_numeric(t[col_iva], errors='coerce').fillna(0)
+    return val_d
+
+def _candidatos_aproximados(dian, cont, tolerancia, ventana_dias):
+    """
+    Por fila DIAN, el documento contable del mismo NIT más cercano en valor entre los
+    que están a lo sumo a `tolerancia` pesos y dentro de la ventana de fechas (sin
+    fecha en algún lado no se filtra); en empate de valor gana el más cercano en fecha.
+    La contabilidad se ordena por (NIT, VALOR, FECHA) y se agrupa en tramos de igual
+    valor; cada fila DIAN recorre tramos hacia ambos lados desde su punto de inserción
+    y se detiene en el primero con una fecha válida (búsqueda binaria dentro del tramo).
+    La memoria es O(filas), sin importar cuántos documentos comparta un NIT.
+    """
+    vacio = pd.DataFrame({'_FILA_DIAN': pd.Series(dtype=np.int64), '_FILA_CONT': pd.Series(dtype=np.int64),
+                          'DIF_VALOR': pd.Series(dtype=float), 'DIF_DIAS': pd.Series(dtype=float)})
+    codigos, _ = pd.factorize(pd.concat([cont['NIT'], dian['NIT']], ignore_index=True))
+    cod_cont, cod_dian = codigos[:len(cont)], codigos[len(cont):]
+    # Fechas en días enteros; sin fecha = el mayor entero (queda al final de su tramo)
+    sin_fecha = np.iinfo(np.int64).max
+    dias_cont = _dias(cont['FECHA'], sin_fecha)
+    dias_dian = _dias(dian['FECHA'], sin_fecha)
+
+    orden = np.lexsort((dias_cont, cont['VALOR'].to_numpy(dtype=float), cod_cont))
+    cod_c, valor_c, dias_c = cod_cont[orden], cont['VALOR'].to_numpy(dtype=float)[orden], dias_cont[orden]
+    fila_cont = cont['_FILA_CONT'].to_numpy()[orden]
+
+    # Tramos de igual (NIT, VALOR): inicio, fin y fin de la parte con fecha
+    nuevo = np.r_[True, (cod_c[1:] != cod_c[:-1]) | (valor_c[1:] != valor_c[:-1])]
+    inicio = np.flatnonzero(nuevo)
+    fin = np.r_[inicio[1:], len(cod_c)]
+    tramo_cod, tramo_valor = cod_c[inicio], valor_c[inicio]
+    tramo = np.cumsum(nuevo) - 1
+    if not len(inicio): return vacio
+    fin_fechas = inicio + np.bincount(tramo, weights=dias_c != sin_fecha, minlength=len(inicio)).astype(np.int64)
+
+    # Clave (tramo, día) ordenada para buscar la fecha más cercana dentro de cada tramo
+    con_fecha = dias_c != sin_fecha
+    dia_min = dias_c[con_fecha].min() if con_fecha.any() else 0
+    dia_max = dias_c[con_fecha].max() if con_fecha.any() else 0
+    alcance = dia_max - dia_min + 2
+    clave = tramo * alcance + np.where(con_fecha, dias_c - dia_min, alcance - 1)
+
+    # Primer tramo con (NIT, VALOR) >= el de cada fila DIAN
+    valor_d = dian['VALOR'].to_numpy(dtype=float)
+    eventos_cod = np.concatenate([tramo_cod, cod_dian])
+    eventos_val = np.concatenate([tramo_valor, valor_d])
+    eventos_tipo = np.concatenate([np.ones(len(inicio), np.int8), np.zeros(len(dian), np.int8)])
+    ev = np.lexsort((eventos_tipo, eventos_val, eventos_cod))
+    previos = np.cumsum(eventos_tipo[ev] == 1) - (eventos_tipo[ev] == 1)
+    insercion = np.empty(len(ev), dtype=np.int64)
+    insercion[ev] = previos
+    insercion = insercion[len(inicio):]
+
+    def mejor_en_tramos(filas, tramos):
+        """Mejor posición (o -1) y su distancia en días dentro de cada tramo para cada fila DIAN."""
+        d = dias_dian[filas]
+        s, e_fecha, e = inicio[tramos], fin_fechas[tramos], fin[tramos]
+        pos = np.full(len(filas), -1, dtype=np.int64)
+        dif = np.full(len(filas), np.nan)
+        # DIAN sin fecha o tramo sin fechas: cualquiera sirve, el primero del tramo
+        libre = (d == sin_fecha) | (e_fecha == s)
+        pos[libre] = s[libre]
+        datado = ~libre
+        if datado.any():
+            q = tramos[datado] * alcance + np.clip(d[datado] - dia_min, 0, alcance - 2)
+            p = np.searchsorted(clave, q)
+            s_d, e_d = s[datado], e_fecha[datado]
+            izq = np.maximum(p - 1, s_d)
+            der = np.minimum(p, e_d - 1)
+            dif_izq = np.abs(d[datado] - dias_c[izq])
+            dif_der = np.abs(d[datado] - dias_c[der])
+            elegido = np.where(dif_der < dif_izq, der, izq)
+            dif_dias = np.minimum(dif_izq, dif_der).astype(float)
+            dentro = dif_dias <= ventana_dias
+            # Fuera de ventana: sirve una fila sin fecha del mismo tramo, si la hay
+            sin_f = ~dentro & (e_fecha[datado] < e[datado])
+            pos_d = np.where(dentro, elegido, np.where(sin_f, e_fecha[datado], -1))
+            pos[datado] = pos_d
+            dif[datado] = np.where(dentro, dif_dias, np.nan)
+        return pos, dif
+
+    # Filas DIAN con fecha fuera del rango de fechas de su NIT (y sin documentos sin fecha)
+    # no pueden cruzar: se descartan antes de recorrer
+    n_cod = codigos.max() + 1 if len(codigos) else 0
+    dia_min_nit = np.full(n_cod, np.iinfo(np.int64).max // 2)
+    dia_max_nit = np.full(n_cod, np.iinfo(np.int64).min // 2)
+    np.minimum.at(dia_min_nit, cod_c[con_fecha], dias_c[con_fecha])
+    np.maximum.at(dia_max_nit, cod_c[con_fecha], dias_c[con_fecha])
+    nit_sin_fecha = np.bincount(cod_c[~con_fecha], minlength=n_cod) > 0
+    posibles = np.flatnonzero((dias_dian == sin_fecha) | nit_sin_fecha[cod_dian]
+                              | ((dias_dian >= dia_min_nit[cod_dian] - ventana_dias) & (dias_dian <= dia_max_nit[cod_dian] + ventana_dias)))
+
+    def recorrer(paso):
+        """Primer tramo válido hacia un lado (paso = +1 valores mayores, -1 menores)."""
+        pos = np.full(len(dian), -1, dtype=np.int64)
+        dif = np.full(len(dian), np.nan)
+        filas = posibles
+        tramos = insercion[filas] if paso > 0 else insercion[filas] - 1
+        while len(filas):
+            validos = (tramos >= 0) & (tramos < len(inicio))
+            t = np.clip(tramos, 0, len(inicio) - 1)
+            validos &= (tramo_cod[t] == cod_dian[filas]) & (np.abs(tramo_valor[t] - valor_d[filas]) <= tolerancia)
+            filas, tramos = filas[validos], tramos[validos]
+            if not len(filas): break
+            p, d = mejor_en_tramos(filas, tramos)
+            hallado = p >= 0
+            pos[filas[hallado]], dif[filas[hallado]] = p[hallado], d[hallado]
+            filas, tramos = filas[~hallado], tramos[~hallado] + paso
+        return pos, dif
+
+    pos_der, dias_der = recorrer(+1)
+    pos_izq, dias_izq = recorrer(-1)
+    dif_der = np.where(pos_der >= 0, np.abs(valor_c[pos_der] - valor_d), np.inf)
+    dif_izq = np.where(pos_izq >= 0, np.abs(valor_c[pos_izq] - valor_d), np.inf)
+    # El más cercano en valor; en empate, el más cercano en fecha (sin fecha al final), luego el menor valor
+    clave_der = np.where(np.isnan(dias_der), np.inf, dias_der)
+    clave_izq = np.where(np.isnan(dias_izq), np.inf, dias_izq)
+    usar_der = (dif_der < dif_izq) | ((dif_der == dif_izq) & (clave_der < clave_izq))
+    pos = np.where(usar_der, pos_der, pos_izq)
+    hay = pos >= 0
+    if not hay.any(): return vacio
+    return pd.DataFrame({
+        '_FILA_DIAN': dian['_FILA_DIAN'].to_numpy()[hay],
+        '_FILA_CONT': fila_cont[pos[hay]],
+        'DIF_VALOR': np.where(usar_der, dif_der, dif_izq)[hay],
+        'DIF_DIAS': np.where(usar_der, dias_der, dias_izq)[hay],
+    })
+
+def _dias(fechas, sin_fecha):
+    """Fechas como días enteros desde 1970; los nulos toman el valor `sin_fecha`."""
+    fechas = pd.to_datetime(pd.Series(fechas), errors='coerce')
+    dias = fechas.to_numpy(dtype='datetime64[ns]').astype('datetime64[D]').astype(np.int64)
+    return np.where(fechas.isna().to_numpy(), sin_fecha, dias)
+
+@instrumentar()
+def conciliar_aproximado(sob_dian, sob_cont, cols_dian_map, tolerancia=1000.0, ventana_dias=30, max_rondas=5):
+    """
+    Segunda pasada opcional sobre los sobrantes del cruce exacto.
+    Empareja documentos del mismo NIT (clean_nit_numeric) cuyo valor difiere a lo sumo en
+    `tolerancia` pesos y cuya fecha difiere a lo sumo `ventana_dias` días (si hay fechas).
+    Usa búsqueda binaria sobre arrays ordenados (_candidatos_aproximados), nunca un cruce de todos contra todos.
+    Devuelve (aproximadas, sobrante_dian_restante, sobrante_cont_restante); cada fila de
+    `aproximadas` es una fila DIAN + el documento contable agregado + SCORE (0 a 1).
+    """
+    if sob_dian.empty or sob_cont.empty or 'LLAVE_CONT' not in sob_cont.columns:
+        return pd.DataFrame(), sob_dian, sob_cont
+
+    col_total = cols_dian_map.get('total', 'total_bruto')
+    col_iva = cols_dian_map.get('iva', 'iva')
+    col_nit = cols_dian_map.get('nit') or next((c for c in sob_dian.columns if 'nit' in c or 'identificaci' in c), None)
+    col_fecha = cols_dian_map.get('fecha') or next((c for c in sob_dian.columns if 'fecha' in c), None)
+    if not col_nit or col_total not in sob_dian.columns: return pd.DataFrame(), sob_dian, sob_cont
+
+    # Lado DIAN: una fila por documento
+    dian = pd.DataFrame({
+        '_FILA_DIAN': np.arange(len(sob_dian)),
+        'NIT': clean_nit_numeric(sob_dian[col_nit]).to_numpy(),
+        'VALOR': _valor_neto_dian(sob_dian, col_total, col_iva).to_numpy(dtype=float),
+        'FECHA': pd.to_datetime(sob_dian[col_fecha], dayfirst=True, errors='coerce').to_numpy() if col_fecha else pd.NaT,
+    })
+
+    # Lado contable: las líneas sobrantes agregadas por documento
+    agg_dict = dict(AGG_CONTABILIDAD)
+    if 'Fecha' in sob_cont.columns: agg_dict['Fecha'] = 'min'
+    cont_agg = sob_cont.groupby('LLAVE_CONT', sort=False).agg(agg_dict).reset_index()
+    cont = pd.DataFrame({
+        '_FILA_CONT': np.arange(len(cont_agg)),
+        'NIT': clean_nit_numeric(cont_agg['u_infoco01']).to_numpy(),
+        'VALOR': cont_agg['u_saldo_f'].to_numpy(dtype=float),
+        'FECHA': pd.to_datetime(cont_agg['Fecha'], errors='coerce').to_numpy() if 'Fecha' in cont_agg.columns else pd.NaT,
+    })
+    dian = dian[(dian['NIT'] != '') & dian['VALOR'].notna()]
+    cont = cont[(cont['NIT'] != '') & cont['VALOR'].notna()]
+
+    # Cada ronda toma el candidato más cercano en valor dentro del mismo NIT (y de la
+    # ventana de fechas) y resuelve los choques (dos facturas DIAN hacia el mismo
+    # documento) por mayor puntaje.
+    parejas = []
+    for _ in range(max_rondas):
+        if dian.empty or cont.empty: break
+        cand = _candidatos_aproximados(dian, cont, tolerancia, ventana_dias)
+        if cand.empty: break
+
+        pena_valor = cand['DIF_VALOR'] / tolerancia if tolerancia else 0.0
+        pena_dias = (cand['DIF_DIAS'].fillna(0) / ventana_dias) if ventana_dias else 0.0
+        cand['SCORE'] = (1 - 0.5 * pena_valor - 0.5 * pena_dias).clip(0, 1).round(4)
+
+        cand = cand.sort_values(['SCORE', '_FILA_DIAN'], ascending=[False, True], kind='mergesort')
+        cand = cand.drop_duplicates('_FILA_CONT')
+        parejas.append(cand[['_FILA_DIAN', '_FILA_CONT', 'SCORE']])
+        dian = dian[~dian['_FILA_DIAN'].isin(cand['_FILA_DIAN'])]
+        cont = cont[~cont['_FILA_CONT'].isin(cand['_FILA_CONT'])]
+
+    if not parejas: return pd.DataFrame(), sob_dian, sob_cont
+    parejas = pd.concat(parejas, ignore_index=True).sort_values('_FILA_DIAN')
+
+    pos_dian = parejas['_FILA_DIAN'].to_numpy()
+    pos_cont = parejas['_FILA_CONT'].to_numpy()
+    df_aprox = pd.concat([
+        sob_dian.iloc[pos_dian].reset_index(drop=True),
+        cont_agg.iloc[pos_cont].drop(columns=['Fecha'], errors='ignore').reset_index(drop=True),
+    ], axis=1)
+    df_aprox['SCORE'] = parejas['SCORE'].to_numpy()
+
+    resto_dian = np.ones(len(sob_dian), dtype=bool)
+    resto_dian[pos_dian] = False
+    llaves_usadas = cont_agg['LLAVE_CONT'].iloc[pos_cont]
+    return df_aprox, sob_dian[resto_dian], sob_cont[~sob_cont['LLAVE_CONT'].isin(llaves_usadas)]
 
 # =================================================================
 # 4. PREPARACIÓN DE DATOS UNIFICADOS
 # =================================================================
 
-def preparar_datos_unificados(coinc, sob_dian, sob_cont, cols_dian_map):
+COLUMNAS_DINERO = ['VALOR_DIAN', 'VALOR_CONT', 'DIFERENCIA']
+COLUMNAS_CATEGORIA = ['NIT', 'EMPRESA', 'EMPRESA_GRUPO', 'CUENTA', 'TIPO']
+
+def a_centavos(valores):
+    """Pesos -> centavos enteros (int64), redondeando al centavo. Nulos como 0."""
+    return np.round(pd.to_numeric(valores, errors='coerce').fillna(0).to_numpy(dtype=float) * 100).astype(np.int64)
+
+def sumar_pesos(df, col):
+    """Suma de una columna de dinero en pesos, esté o no en centavos (modo compacto)."""
+    total = df[col].sum()
+    return total / 100 if col in df.attrs.get('columnas_centavos', ()) else float(total)
+
+def _compactar(t):
+    """Dinero a centavos: la DIFERENCIA queda exacta."""
+    dian, cont = a_centavos(t['VALOR_DIAN']), a_centavos(t['VALOR_CONT'])
+    t['VALOR_DIAN'], t['VALOR_CONT'], t['DIFERENCIA'] = dian, cont, dian - cont
+    return t
+
+def _categorizar_texto(df):
+    """Columnas de texto repetido (las del reporte y las que repiten más de la mitad) a categorías."""
+    for col in df.columns:
+        serie = df[col]
+        if not (pd.api.types.is_object_dtype(serie) or pd.api.types.is_string_dtype(serie)): continue
+        if col in COLUMNAS_CATEGORIA or serie.nunique() <= len(serie) // 2:
+            df[col] = serie.astype('category')
+    return df
+
+@instrumentar()
+def preparar_datos_unificados(coinc, sob_dian, sob_cont, cols_dian_map, aprox=None, compacto=False):
     """
     Toma los 3 resultados del cruce y devuelve UN solo DataFrame estandarizado
     listo para ser procesado por el generador de reportes.
+    `aprox` (opcional) es el resultado de conciliar_aproximado; sus filas salen
+    como TIPO 'COINCIDENCIA APROXIMADA' con la columna SCORE.
+    Con `compacto=True` no copia las entradas, guarda el dinero en centavos int64
+    (marcado en attrs['columnas_centavos']) y el texto repetido como categorías.
     """
     lista_dfs = []
     
@@ -199,50 +683,43 @@ def preparar_datos_unificados(coinc, sob_dian, sob_cont, cols_dian_map):
     col_emisor_dian = cols_dian_map.get('emisor', 'nombre_emisor')
     col_iva_dian = cols_dian_map.get('iva', 'iva')
 
-    # 1. COINCIDENCIAS
-    if not coinc.empty:
-        t = coinc.copy()
+    # 1. COINCIDENCIAS (exactas y, si las hay, aproximadas)
+    for df_c, tipo in ((coinc, 'COINCIDENCIA'), (aprox, 'COINCIDENCIA APROXIMADA')):
+        if df_c is None or df_c.empty: continue
+        t = df_c.copy(deep=not compacto)
         t['NIT'] = clean_nit_numeric(t['u_infoco01'])
         t['EMPRESA'] = t[col_emisor_dian] if col_emisor_dian in t.columns else t['u_cardname']
         t['EMPRESA_GRUPO'] = standardize_company_name(t['EMPRESA'])
         
         # Valores
-        val_d = pd.to_numeric(t[col_total_dian], errors='coerce').fillna(0)
-        # Restar IVA si existe columna en DIAN para obtener subtotal
-        if col_iva_dian and col_iva_dian in t.columns:
-            val_d -= pd.to_numeric(t[col_iva_dian], errors='coerce').fillna(0)
-            
-        t['VALOR_DIAN'] = val_d
+        t['VALOR_DIAN'] = _valor_neto_dian(t, col_total_dian, col_iva_dian)
         t['VALOR_CONT'] = t['u_saldo_f']
         t['DIFERENCIA'] = t['VALOR_DIAN'] - t['VALOR_CONT']
-        t['TIPO'] = 'COINCIDENCIA'
+        t['TIPO'] = tipo
         t['LLAVE'] = t['LLAVE_DIAN']
         t['CUENTA'] = t['u_acctname']
-        lista_dfs.append(t)
+        lista_dfs.append(_compactar(t) if compacto else t)
 
     # 2. SOBRANTE DIAN
     if not sob_dian.empty:
-        t = sob_dian.copy()
+        t = sob_dian.copy(deep=not compacto)
         col_nit = next((c for c in t.columns if 'nit' in c or 'identificaci' in c), None)
         t['NIT'] = clean_nit_numeric(t[col_nit]) if col_nit else ''
         t['EMPRESA'] = t[col_emisor_dian] if col_emisor_dian in t.columns else 'DESCONOCIDO'
         t['EMPRESA_GRUPO'] = standardize_company_name(t['EMPRESA'])
         
-        val_d = pd.to_numeric(t[col_total_dian], errors='coerce').fillna(0)
-        if col_iva_dian and col_iva_dian in t.columns:
-            val_d -= pd.to_numeric(t[col_iva_dian], errors='coerce').fillna(0)
-            
+        val_d = _valor_neto_dian(t, col_total_dian, col_iva_dian)
         t['VALOR_DIAN'] = val_d
         t['VALOR_CONT'] = 0
         t['DIFERENCIA'] = val_d
         t['TIPO'] = 'SOBRANTE DIAN'
         t['LLAVE'] = t['LLAVE_DIAN']
         t['CUENTA'] = ''
-        lista_dfs.append(t)
+        lista_dfs.append(_compactar(t) if compacto else t)
 
     # 3. SOBRANTE CONTABILIDAD
     if not sob_cont.empty:
-        t = sob_cont.copy()
+        t = sob_cont.copy(deep=not compacto)
         t['NIT'] = clean_nit_numeric(t['u_infoco01'])
         t['EMPRESA'] = t['u_cardname']
         t['EMPRESA_GRUPO'] = standardize_company_name(t['u_cardname'])
@@ -253,103 +730,323 @@ def preparar_datos_unificados(coinc, sob_dian, sob_cont, cols_dian_map):
         t['TIPO'] = 'SOBRANTE CONT'
         t['LLAVE'] = t['LLAVE_CONT'] if 'LLAVE_CONT' in t.columns else t['u_ref']
         t['CUENTA'] = t['u_acctname']
-        lista_dfs.append(t)
+        lista_dfs.append(_compactar(t) if compacto else t)
 
     if not lista_dfs: return pd.DataFrame()
     
     df_final = pd.concat(lista_dfs, ignore_index=True)
+    minimo = 1
+    if compacto:
+        df_final = _categorizar_texto(df_final)
+        df_final.attrs['columnas_centavos'] = list(COLUMNAS_DINERO)
+        minimo = 100
     # Filtrar basura muy pequeña
-    df_final = df_final[(df_final['VALOR_DIAN'].abs() > 1) | (df_final['VALOR_CONT'].abs() > 1)]
+    df_final = df_final[(df_final['VALOR_DIAN'].abs() > minimo) | (df_final['VALOR_CONT'].abs() > minimo)]
     return df_final
 
+# =================================================================
+# 4.1 PIPELINE POR FLUJO (BACKEND PANDAS O POLARS)
+# =================================================================
+
+# ORDEN_BACKEND=polars corre el pipeline como consulta lazy de Polars (motor_polars)
+BACKEND = os.environ.get('ORDEN_BACKEND', 'pandas').lower()
+BACKENDS = ('pandas', 'polars')
+
+FILTROS_FLUJO = {
+    'gastos': (filtrar_dian_gastos, filtrar_solo_gastos),
+    'ingresos': (filtrar_dian_ingresos, filtrar_solo_ingresos),
+}
+
+# Proyección: filtros, cruce y frame unificado solo mueven las columnas que usan.
+# Cada fila lleva su posición en el frame de entrada (FILA_DIAN / FILA_CONT) y las
+# demás columnas se adjuntan al final, solo si se piden.
+COLUMNA_FILA_DIAN = 'FILA_DIAN'
+COLUMNA_FILA_CONT = 'FILA_CONT'
+COLUMNAS_CONT_PIPELINE = ['u_ref', 'CODIGO_CUENTA', 'u_acctname', 'u_saldo_f', 'u_infoco01', 'u_cardname']
+
+def columnas_pipeline_dian(df_dian, flujo='gastos', aproximado=False):
+    """
+    Columnas DIAN que usa el pipeline: llave, grupo, total, iva, contraparte y NIT
+    (y la fecha si corre conciliar_aproximado), resueltas con las mismas heurísticas
+    que filtros, preparar_datos_unificados y conciliar_aproximado.
+    Conservan el orden original, así esas heurísticas eligen lo mismo sobre la proyección.
+    """
+    cols = df_dian.columns
+    mapa = resolver_columnas_dian(df_dian, flujo)
+    usadas = {'LLAVE_DIAN', mapa['total'], mapa['iva'], mapa['emisor'], mapa['nit'],
+              next((c for c in cols if 'grupo' in c), None),
+              next((c for c in cols if 'nit' in c or 'identificaci' in c), None)}
+    if aproximado: usadas.add(next((c for c in cols if 'fecha' in c), None))
+    return [c for c in cols if c in usadas]
+
+def proyectar(df, columnas, col_fila):
+    """Solo `columnas` de df, más su posición en df en `col_fila`."""
+    return df[columnas].assign(**{col_fila: np.arange(len(df))})
+
+def adjuntar_columnas(df_final, df_origen, columnas, col_fila):
+    """Columnas de df_origen en df_final por la posición de `col_fila` (vacías en las filas de la otra fuente)."""
+    columnas = [c for c in columnas if c not in df_final.columns]
+    if not columnas or df_final.empty: return df_final
+    posiciones = df_final[col_fila]
+    presentes = posiciones.notna()
+    extra = df_origen[columnas].iloc[posiciones[presentes].to_numpy(dtype=np.int64)]
+    return df_final.join(extra.set_axis(df_final.index[presentes.to_numpy()], axis=0))
+
+@instrumentar()
+def conciliar_flujo(df_dian, df_cont, flujo='gastos', compacto=False, backend=None, workers=None, columnas_extra=(),
+                    aproximado=None):
+    """
+    Filtros del flujo -> cruce -> frame unificado, con df_dian ya con LLAVE_DIAN.
+    Devuelve (coincidencias, sobrante_dian, sobrante_cont, df_final) en pandas con
+    cualquiera de los dos backends. Sin Polars instalado se usa pandas con un aviso.
+    `workers` pasa a ejecutar_conciliacion_universal (backend pandas).
+    Las entradas se proyectan a las columnas que usa el pipeline; `columnas_extra`
+    (de DIAN o de contabilidad) se adjuntan a df_final al terminar.
+    Con `aproximado` (True o un dict con tolerancia / ventana_dias / max_rondas) los
+    sobrantes pasan por conciliar_aproximado: los sobrantes devueltos son los que
+    quedan y df_final incluye las filas 'COINCIDENCIA APROXIMADA'.
+    """
+    backend = (backend or BACKEND).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend desconocido: {backend} (opciones: {', '.join(BACKENDS)})")
+
+    extra_dian = [c for c in columnas_extra if c in df_dian.columns]
+    extra_cont = [c for c in columnas_extra if c in df_cont.columns and c not in extra_dian]
+    faltantes = [c for c in columnas_extra if c not in extra_dian and c not in extra_cont]
+    if faltantes:
+        logger.warning("Columnas pedidas que no están en DIAN ni en contabilidad: %s", faltantes)
+    dian_p = proyectar(df_dian, columnas_pipeline_dian(df_dian, flujo, bool(aproximado)), COLUMNA_FILA_DIAN)
+    columnas_cont = COLUMNAS_CONT_PIPELINE + (['Fecha'] if aproximado else [])
+    cont_p = proyectar(df_cont, [c for c in df_cont.columns if c in columnas_cont], COLUMNA_FILA_CONT)
+
+    resultado = None
+    if backend == 'polars':
+        import motor_polars
+        if motor_polars.DISPONIBLE:
+            resultado = motor_polars.conciliar_flujo(dian_p, cont_p, flujo, compacto)
+        else:
+            logger.warning("Polars no está instalado; se usa el backend pandas.")
+
+    if resultado is None:
+        filtro_dian, filtro_cont = FILTROS_FLUJO[flujo]
+        dian_f, cont_f = filtro_dian(dian_p), filtro_cont(cont_p).copy()
+        coinc, sob_dian, sob_cont = ejecutar_conciliacion_universal(dian_f, cont_f, workers)
+        resultado = coinc, sob_dian, sob_cont, None
+
+    coinc, sob_dian, sob_cont, df_final = resultado
+    cols_dian_map = resolver_columnas_dian(dian_p, flujo)
+    aprox = None
+    if aproximado:
+        # Segunda pasada sobre los sobrantes (en pandas con cualquier backend)
+        opciones = aproximado if isinstance(aproximado, dict) else {}
+        aprox, sob_dian, sob_cont = conciliar_aproximado(sob_dian, sob_cont, cols_dian_map, **opciones)
+        df_final = None
+    if df_final is None:
+        df_final = preparar_datos_unificados(coinc, sob_dian, sob_cont, cols_dian_map, aprox=aprox, compacto=compacto)
+    if not df_final.empty:
+        attrs = dict(df_final.attrs)  # columnas_centavos
+        df_final = adjuntar_columnas(df_final, df_dian, extra_dian, COLUMNA_FILA_DIAN)
+        df_final = adjuntar_columnas(df_final, df_cont, extra_cont, COLUMNA_FILA_CONT)
+        df_final = df_final.drop(columns=[COLUMNA_FILA_DIAN, COLUMNA_FILA_CONT], errors='ignore')
+        df_final.attrs.update(attrs)
+    return coinc, sob_dian, sob_cont, df_final
+
 # =================================================================
 # 5. GENERADOR EXCEL DINÁMICO
 # =================================================================
 
-def generar_reporte_agrupado(writer, df, sheet_name, config):
-    """Genera hoja Excel con agrupación y colores dinámicos."""
+_CACHE_FORMATOS = weakref.WeakKeyDictionary()
+PASO_PROGRESO = 5000
+
+def _formato(wb, **props):
+    """Devuelve un formato del libro reutilizando el ya creado con las mismas propiedades."""
+    cache = _CACHE_FORMATOS.setdefault(wb, {})
+    llave = tuple(sorted(props.items()))
+    if llave not in cache:
+        cache[llave] = wb.add_format(props)
+    return cache[llave]
+
+def construir_plan_filas(df, g1, g2, cols_texto, cols_suma, centavos=()):
+    """
+    Calcula el "plan" del reporte agrupado sin iterar fila a fila.
+    Devuelve (meta, valores, cols_finales): meta es un array con el tipo de cada fila
+    (DETALLE, SUBTOTAL_N2, SUBTOTAL_N1, GRAN_TOTAL) y valores un array objeto con las celdas.
+    Los totales N2/N1/global salen de una sola agregación agrupada.
+    Las columnas de `centavos` se suman en enteros y se escriben en pesos.
+    """
+    cols_finales = [g1, g2] + cols_texto + cols_suma
+
+    df_sorted = df.sort_values(by=[g1, g2])
+    # groupby descarta grupos con llave nula: el detalle también
+    df_sorted = df_sorted[df_sorted[g1].notna() & df_sorted[g2].notna()]
+    detalle = df_sorted[cols_finales]
+
+    agrupado = df_sorted.groupby([g1, g2], sort=False, observed=True)
+    cod_n2 = agrupado.ngroup().to_numpy()
+    tot_n2 = agrupado[cols_suma].sum()
+    nombres_n1 = tot_n2.index.get_level_values(0)
+    nombres_n2 = tot_n2.index.get_level_values(1)
+    cod_n1_de_n2, _ = pd.factorize(nombres_n1)
+    tot_n1 = tot_n2.groupby(cod_n1_de_n2, sort=False).sum()
+    gran_total = tot_n1.sum()
+
+    n_det, n_n2, n_n1 = len(detalle), len(tot_n2), len(tot_n1)
+    n_total = n_det + n_n2 + n_n1 + 1
+
+    # Posición de cada fila en la hoja: cada detalle va precedido por los subtotales
+    # N2 y N1 ya cerrados (los datos están ordenados, así que los grupos son contiguos)
+    tam_n2 = np.bincount(cod_n2, minlength=n_n2)
+    fin_n2 = np.cumsum(tam_n2)
+    pos_det = np.arange(n_det) + cod_n2 + cod_n1_de_n2[cod_n2] if n_det else np.arange(0)
+    pos_n2 = fin_n2 + np.arange(n_n2) + cod_n1_de_n2
+    ultimo_n2 = np.flatnonzero(np.r_[cod_n1_de_n2[1:] != cod_n1_de_n2[:-1], True]) if n_n2 else np.arange(0)
+    pos_n1 = fin_n2[ultimo_n2] + ultimo_n2 + 1 + np.arange(n_n1)
+
+    meta = np.empty(n_total, dtype=object)
+    meta[pos_det], meta[pos_n2], meta[pos_n1], meta[-1] = 'DETALLE', 'SUBTOTAL_N2', 'SUBTOTAL_N1', 'GRAN_TOTAL'
+
+    valores = np.full((n_total, len(cols_finales)), '', dtype=object)
+    valores[pos_det] = detalle.to_numpy(dtype=object)
+
+    idx_g1 = [i for i, c in enumerate(cols_finales) if c == g1]
+    idx_g2 = [i for i, c in enumerate(cols_finales) if c == g2]
+    idx_suma = [cols_finales.index(c) for c in cols_suma]
+
+    for i in idx_g1:
+        valores[pos_n2, i] = np.asarray(nombres_n1, dtype=object)
+    for i in idx_g2:
+        valores[pos_n2, i] = np.array([f"SUBTOTAL {str(n).upper()}" for n in nombres_n2], dtype=object)
+    for i in idx_g1:
+        valores[pos_n1, i] = np.array([f"TOTAL {str(n).upper()}" for n in pd.unique(nombres_n1)], dtype=object)
+        valores[-1, i] = "GRAN TOTAL GLOBAL"
+    for i, c in zip(idx_suma, cols_suma):
+        if c in centavos:
+            valores[pos_det, i] = detalle[c].to_numpy() / 100
+            valores[pos_n2, i] = tot_n2[c].to_numpy() / 100
+            valores[pos_n1, i] = tot_n1[c].to_numpy() / 100
+            valores[-1, i] = gran_total[c] / 100
+        else:
+            valores[pos_n2, i] = tot_n2[c].to_numpy(dtype=object)
+            valores[pos_n1, i] = tot_n1[c].to_numpy(dtype=object)
+            valores[-1, i] = gran_total[c]
+
+    return meta, valores, cols_finales
+
+@instrumentar()
+def generar_reporte_agrupado(writer, df, sheet_name, config, progreso=None):
+    """
+    Genera hoja Excel con agrupación y colores dinámicos.
+    Si el reporte no cabe en una hoja (config 'max_filas_hoja', por defecto el límite
+    de Excel) se reparte en varias hojas cortando en los cierres de grupo N1, y el
+    gran total va en una hoja índice con los totales de cada parte.
+    Las hojas se escriben fila a fila y en orden: con un writer en modo constant_memory
+    (engine_kwargs={'options': {'constant_memory': True}}) ninguna hoja queda en memoria;
+    el plan de filas (construir_plan_filas) sí se arma completo antes de escribir.
+    `progreso(filas_escritas, total)` se llama cada PASO_PROGRESO filas.
+    """
     if df.empty: return
 
     # Extraer Configuración
     g1, g2 = config.get('col_grupo_1'), config.get('col_grupo_2')
     cols_suma = [c for c in config.get('cols_suma', []) if c in df.columns]
     cols_texto = [c for c in config.get('cols_texto', []) if c in df.columns]
-    cols_finales = [g1, g2] + cols_texto + cols_suma
 
-    # Procesar Datos
-    df_sorted = df.sort_values(by=[g1, g2]).copy()
-    rows_buffer = []
+    centavos = [c for c in df.attrs.get('columnas_centavos', ()) if c in cols_suma]
 
-    for nombre_g1, df_g1 in df_sorted.groupby(g1, sort=False):
-        for nombre_g2, df_g2 in df_g1.groupby(g2, sort=False):
-            # Detalle
-            temp = df_g2[cols_finales].copy()
-            temp['__META__'] = 'DETALLE'
-            rows_buffer.append(temp)
-            
-            # Subtotal N2
-            sub = pd.Series(index=cols_finales).fillna('')
-            sub[g1] = nombre_g1
-            sub[g2] = f"SUBTOTAL {str(nombre_g2).upper()}"
-            sub['__META__'] = 'SUBTOTAL_N2'
-            for c in cols_suma: sub[c] = df_g2[c].sum()
-            rows_buffer.append(sub.to_frame().T)
-
-        # Subtotal N1
-        tot = pd.Series(index=cols_finales).fillna('')
-        tot[g1] = f"TOTAL {str(nombre_g1).upper()}"
-        tot['__META__'] = 'SUBTOTAL_N1'
-        for c in cols_suma: tot[c] = df_g1[c].sum()
-        rows_buffer.append(tot.to_frame().T)
-
-    # Gran Total
-    df_fin = pd.concat(rows_buffer, ignore_index=True)
-    grand = pd.Series(index=cols_finales).fillna('')
-    grand[g1] = "GRAN TOTAL GLOBAL"
-    grand['__META__'] = 'GRAN_TOTAL'
-    for c in cols_suma: grand[c] = df_fin[df_fin['__META__'] == 'DETALLE'][c].sum()
-    df_fin = pd.concat([df_fin, grand.to_frame().T], ignore_index=True)
-
-    # Escritura Excel
-    df_export = df_fin[cols_finales]
-    df_export.to_excel(writer, sheet_name=sheet_name, index=False)
-    
-    wb, ws = writer.book, writer.sheets[sheet_name]
+    meta, valores, cols_finales = construir_plan_filas(df, g1, g2, cols_texto, cols_suma, centavos)
+
+    # Paginación planeada antes de escribir: si no cabe en una hoja, el gran total pasa a la hoja índice
+    cortes_n1, cortes_n2 = np.flatnonzero(meta == 'SUBTOTAL_N1') + 1, np.flatnonzero(meta == 'SUBTOTAL_N2') + 1
+    partes, con_indice = paginacion.planear_reporte(len(meta) - 1, cortes_n1, cortes_n2,
+                                                    config.get('max_filas_hoja', paginacion.MAX_FILAS_HOJA))
+    # La hoja índice se crea primero para que quede delante de sus partes (se escribe al final)
+    ws_indice = writer.book.add_worksheet(paginacion.nombre_indice(sheet_name)) if con_indice else None
+    nombres = paginacion.nombres_hojas(sheet_name, len(partes))
+
+    for nombre, (inicio, fin) in zip(nombres, partes):
+        _escribir_parte(writer.book, nombre, meta[inicio:fin], valores[inicio:fin], cols_finales, cols_suma, inicio, len(meta), progreso)
+
+    if con_indice:
+        _escribir_indice(writer.book, ws_indice, nombres, partes, meta, valores, cols_finales, cols_suma, g1)
+
+def _escribir_parte(wb, sheet_name, meta, valores, cols_finales, cols_suma, desplazamiento=0, total=None, progreso=None):
+    """
+    Una hoja del reporte agrupado con las filas meta/valores (un tramo del plan).
+    Escribe fila a fila y en orden, así funciona con un libro en modo constant_memory.
+    """
+    ws = wb.add_worksheet(sheet_name)
     
     # Estilos
-    fmt_head = wb.add_format({'bold': True, 'fg_color': CABIFY_PURPLE, 'font_color': WHITE, 'border': 1})
-    fmt_n2_txt = wb.add_format({'bold': True, 'bg_color': CABIFY_LIGHT})
-    fmt_n2_num = wb.add_format({'bold': True, 'bg_color': CABIFY_LIGHT, 'num_format': '#,##0.00'})
-    fmt_n1_txt = wb.add_format({'bold': True, 'bg_color': CABIFY_ACCENT, 'font_color': WHITE})
-    fmt_n1_num = wb.add_format({'bold': True, 'bg_color': CABIFY_ACCENT, 'font_color': WHITE, 'num_format': '#,##0.00'})
-    fmt_tot_txt = wb.add_format({'bold': True, 'bg_color': CABIFY_PURPLE, 'font_color': WHITE})
-    fmt_tot_num = wb.add_format({'bold': True, 'bg_color': CABIFY_PURPLE, 'font_color': WHITE, 'num_format': '#,##0.00'})
+    fmt_head = _formato(wb, bold=True, fg_color=CABIFY_PURPLE, font_color=WHITE, border=1)
+    fmt_det_num = _formato(wb, num_format='#,##0.00')
+    fmt_det_fecha = _formato(wb, num_format='YYYY-MM-DD HH:MM:SS')
+    fmt_n2_txt = _formato(wb, bold=True, bg_color=CABIFY_LIGHT)
+    fmt_n2_num = _formato(wb, bold=True, bg_color=CABIFY_LIGHT, num_format='#,##0.00')
+    fmt_n1_txt = _formato(wb, bold=True, bg_color=CABIFY_ACCENT, font_color=WHITE)
+    fmt_n1_num = _formato(wb, bold=True, bg_color=CABIFY_ACCENT, font_color=WHITE, num_format='#,##0.00')
+    fmt_tot_txt = _formato(wb, bold=True, bg_color=CABIFY_PURPLE, font_color=WHITE)
+    fmt_tot_num = _formato(wb, bold=True, bg_color=CABIFY_PURPLE, font_color=WHITE, num_format='#,##0.00')
 
     # Header
-    for i, col in enumerate(df_export.columns): ws.write(0, i, col, fmt_head)
     ws.set_column(0, len(cols_finales)-1, 18)
+    for i, col in enumerate(cols_finales): ws.write(0, i, col, fmt_head)
     
-    idx_num = [df_export.columns.get_loc(c) for c in cols_suma]
+    idx_num = [cols_finales.index(c) for c in cols_suma]
+    idx_txt = [i for i in range(len(cols_finales)) if i not in idx_num]
+    total = total or len(meta)
 
-    for i, row in df_fin.iterrows():
+    for i, (meta_fila, data) in enumerate(zip(meta, valores)):
         r = i + 1
-        meta = row['__META__']
-        data = row[cols_finales]
-        
-        if meta == 'DETALLE':
+        if progreso and (i + desplazamiento) % PASO_PROGRESO == 0: progreso(i + desplazamiento, total)
+        if meta_fila == 'DETALLE':
             ws.set_row(r, None, None, {'level': 2, 'hidden': True})
-            for c_idx in idx_num: ws.write_number(r, c_idx, data.iloc[c_idx], wb.add_format({'num_format': '#,##0.00'}))
-        elif meta == 'SUBTOTAL_N2':
+            for c_idx in idx_txt: _escribir_celda(ws, r, c_idx, data[c_idx], fmt_det_fecha)
+            for c_idx in idx_num: ws.write_number(r, c_idx, data[c_idx], fmt_det_num)
+        elif meta_fila == 'SUBTOTAL_N2':
             ws.set_row(r, None, None, {'level': 1, 'hidden': False, 'collapsed': True})
             _pintar(ws, r, data, idx_num, fmt_n2_txt, fmt_n2_num)
-        elif meta == 'SUBTOTAL_N1':
+        elif meta_fila == 'SUBTOTAL_N1':
             ws.set_row(r, None, None, {'level': 0, 'collapsed': False})
             _pintar(ws, r, data, idx_num, fmt_n1_txt, fmt_n1_num)
-        elif meta == 'GRAN_TOTAL':
+        elif meta_fila == 'GRAN_TOTAL':
             _pintar(ws, r, data, idx_num, fmt_tot_txt, fmt_tot_num)
             
     ws.set_tab_color(CABIFY_PURPLE)
 
+def _escribir_celda(ws, r, c, val, fmt_fecha):
+    """Celda de detalle como la escribía to_excel: nulos vacíos y fechas con formato de fecha."""
+    if pd.isna(val): return
+    if isinstance(val, datetime.date): ws.write_datetime(r, c, val, fmt_fecha)
+    else: ws.write(r, c, val)
+
+def _escribir_indice(wb, ws, nombres, partes, meta, valores, cols_finales, cols_suma, g1):
+    """Hoja índice de un reporte repartido: rango de grupos N1 y totales por parte, y el gran total."""
+    idx_g1 = cols_finales.index(g1)
+    idx_num = [cols_finales.index(c) for c in cols_suma]
+    filas = []
+    for i, (nombre, (inicio, fin)) in enumerate(zip(nombres, partes), start=1):
+        det = meta[inicio:fin] == 'DETALLE'
+        grupos = valores[inicio:fin, idx_g1][det]
+        sumas = [pd.to_numeric(pd.Series(valores[inicio:fin, c][det]), errors='coerce').sum().round(2) for c in idx_num]
+        filas.append([i, nombre, grupos[0] if len(grupos) else '', grupos[-1] if len(grupos) else '', fin - inicio] + sumas)
+    filas.append(['', '', 'GRAN TOTAL GLOBAL', '', ''] + [valores[-1, c] for c in idx_num])
+    cols = ['PARTE', 'HOJA', f'DESDE ({g1})', f'HASTA ({g1})', 'FILAS'] + cols_suma
+
+    fmt_head = _formato(wb, bold=True, fg_color=CABIFY_PURPLE, font_color=WHITE, border=1)
+    fmt_num = _formato(wb, num_format='#,##0.00')
+    fmt_tot_txt = _formato(wb, bold=True, bg_color=CABIFY_PURPLE, font_color=WHITE)
+    fmt_tot_num = _formato(wb, bold=True, bg_color=CABIFY_PURPLE, font_color=WHITE, num_format='#,##0.00')
+    ws.set_column(0, len(cols) - 1, 18)
+    for c, col in enumerate(cols): ws.write(0, c, col, fmt_head)
+    n_fijas = 5
+    for r, fila in enumerate(filas[:-1], start=1):
+        ws.write_number(r, 0, fila[0])
+        ws.write_url(r, 1, f"internal:'{fila[1]}'!A1", string=fila[1])
+        ws.write_row(r, 2, fila[2:n_fijas])
+        for c, val in enumerate(fila[n_fijas:], start=n_fijas): ws.write_number(r, c, float(val), fmt_num)
+    _pintar(ws, len(filas), filas[-1], list(range(n_fijas, len(cols))), fmt_tot_txt, fmt_tot_num)
+    ws.set_tab_color(CABIFY_PURPLE)
+
 def _pintar(ws, r, data, idxs, ft, fn):
     for c, val in enumerate(data):
         ws.write(r, c, val, fn if c in idxs else ft)
@@ -358,5 +1055,5 @@ def formatear_hoja_base(writer, sheet_name, df):
     if df.empty: return
     ws = writer.sheets[sheet_name]
     ws.set_tab_color('gray')
-    fmt = writer.book.add_format({'bold': True, 'bg_color': '#DDDDDD', 'border': 1})
+    fmt = _formato(writer.book, bold=True, bg_color='#DDDDDD', border=1)
     for i, col in enumerate(df.columns): ws.write(0, i, col, fmt)
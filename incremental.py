@@ -0,0 +1,146 @@
+import numpy as np
+import pandas as pd
+
+import cache_disco
+from engine import agrupar_contabilidad, crear_llave_contable
+
+# =================================================================
+# CONCILIACIÓN INCREMENTAL MULTI-PERIODO
+# =================================================================
+# Guarda en disco las filas DIAN, las líneas contables, el agregado por
+# documento (df_cont_agg) y las coincidencias ya calculadas. Al llegar un
+# periodo nuevo solo se recalculan las llaves que ese periodo toca, así una
+# factura de enero contabilizada en febrero se resuelve al cargar febrero.
+#
+# resultados() devuelve exactamente lo mismo que
+#   ejecutar_conciliacion_universal(pd.concat(dians, ignore_index=True),
+#                                   pd.concat(conts, ignore_index=True))
+# con todos los periodos cargados en el mismo orden.
+
+
+class ConciliacionIncremental:
+    """Estado persistente del cruce DIAN vs contabilidad, actualizable por periodos."""
+
+    def __init__(self):
+        self.version = cache_disco.VERSION_NORMALIZACION
+        self.dian = pd.DataFrame()
+        self.cont = pd.DataFrame()
+        self.cont_agg = pd.DataFrame()          # indexado por LLAVE_CONT
+        self.coinc = pd.DataFrame()             # con '_POS_DIAN' para conservar el orden
+        # Diccionario de llaves -> código entero; las marcas por llave evitan isin sobre todo el histórico
+        self.llaves = pd.Index([], dtype=object)
+        self.cod_dian = np.zeros(0, dtype=np.int64)
+        self.cod_cont = np.zeros(0, dtype=np.int64)
+        self.llave_en_dian = np.zeros(0, dtype=bool)
+        self.llave_en_cont = np.zeros(0, dtype=bool)
+        self.cruzado = False                    # False hasta el primer cruce con ambas fuentes
+        self.archivos = set()                   # huellas (cache_disco.huella_archivo) de los archivos ya incorporados
+
+    # ---------------------------------------------------------------
+    # Persistencia
+    # ---------------------------------------------------------------
+
+    @classmethod
+    def cargar(cls, ruta):
+        """Carga un estado guardado; si la lógica de normalización cambió, empieza vacío."""
+        try:
+            datos = pd.read_pickle(ruta)
+        except FileNotFoundError:
+            return cls()
+        if datos.get('version') != cache_disco.VERSION_NORMALIZACION:
+            return cls()
+        estado = cls()
+        estado.__dict__.update(datos)
+        return estado
+
+    def guardar(self, ruta):
+        pd.to_pickle(self.__dict__, ruta)
+
+    # ---------------------------------------------------------------
+    # Actualización
+    # ---------------------------------------------------------------
+
+    def agregar(self, df_dian_nuevo=None, df_cont_nuevo=None):
+        """
+        Incorpora filas nuevas (DIAN ya con LLAVE_DIAN y ambos ya filtrados por flujo)
+        y reevalúa solo las llaves que tocan. Devuelve el número de llaves recalculadas.
+        """
+        codigos_nuevos = []
+        if df_dian_nuevo is not None and not df_dian_nuevo.empty:
+            if 'LLAVE_DIAN' not in df_dian_nuevo.columns:
+                raise ValueError("Las filas DIAN deben traer LLAVE_DIAN (crear_llave_conciliacion).")
+            cod = self._codificar(df_dian_nuevo['LLAVE_DIAN'])
+            self.llave_en_dian[cod] = True
+            self.cod_dian = np.r_[self.cod_dian, cod]
+            self.dian = pd.concat([self.dian, df_dian_nuevo], ignore_index=True) if not self.dian.empty else df_dian_nuevo.reset_index(drop=True)
+            codigos_nuevos.append(cod)
+        if df_cont_nuevo is not None and not df_cont_nuevo.empty:
+            nuevo = df_cont_nuevo.assign(LLAVE_CONT=crear_llave_contable(df_cont_nuevo['u_ref']))
+            cod = self._codificar(nuevo['LLAVE_CONT'])
+            self.llave_en_cont[cod] = True
+            self.cod_cont = np.r_[self.cod_cont, cod]
+            self.cont = pd.concat([self.cont, nuevo], ignore_index=True) if not self.cont.empty else nuevo.reset_index(drop=True)
+            codigos_nuevos.append(cod)
+        # Sin la otra fuente no hay nada que cruzar; las marcas por llave ya quedan al día
+        if not codigos_nuevos or self.dian.empty or self.cont.empty:
+            return 0
+
+        tocada = np.zeros(len(self.llaves), dtype=bool)
+        for cod in codigos_nuevos: tocada[cod] = True
+        if not self.cruzado:
+            # Primer cruce: entran también las llaves acumuladas mientras faltaba una fuente
+            tocada[:] = True
+            self.cruzado = True
+
+        # 1. Agregado contable solo de las llaves tocadas (en el orden original de las líneas)
+        mask_cont = tocada[self.cod_cont]
+        agg_tocado = agrupar_contabilidad(self.cont[mask_cont])
+        agg_tocado_idx = agg_tocado.set_index('LLAVE_CONT')
+        if not self.cont_agg.empty:
+            sigue = ~tocada[self.llaves.get_indexer(self.cont_agg.index)]
+            self.cont_agg = pd.concat([self.cont_agg[sigue], agg_tocado_idx])
+        else:
+            self.cont_agg = agg_tocado_idx
+
+        # 2. Coincidencias de esas llaves
+        mask_dian = tocada[self.cod_dian]
+        dian_tocada = self.dian[mask_dian].assign(_POS_DIAN=np.flatnonzero(mask_dian))
+        nuevas = pd.merge(dian_tocada, agg_tocado, left_on='LLAVE_DIAN', right_on='LLAVE_CONT', how='inner', suffixes=('_DIAN', '_CONT'))
+        if not self.coinc.empty:
+            sigue = ~tocada[self.cod_dian[self.coinc['_POS_DIAN'].to_numpy()]]
+            nuevas = pd.concat([self.coinc[sigue], nuevas], ignore_index=True)
+        self.coinc = nuevas
+        return int(tocada.sum())
+
+    def _codificar(self, llaves):
+        """Códigos enteros de las llaves, ampliando el diccionario con las que no existían."""
+        cod = self.llaves.get_indexer(llaves)
+        faltan = cod < 0
+        if faltan.any():
+            nuevas = pd.unique(llaves[faltan].to_numpy(dtype=object))
+            self.llaves = self.llaves.append(pd.Index(nuevas, dtype=object))
+            self.llave_en_dian = np.r_[self.llave_en_dian, np.zeros(len(nuevas), dtype=bool)]
+            self.llave_en_cont = np.r_[self.llave_en_cont, np.zeros(len(nuevas), dtype=bool)]
+            cod[faltan] = self.llaves.get_indexer(llaves[faltan])
+        return cod
+
+    # ---------------------------------------------------------------
+    # Resultado
+    # ---------------------------------------------------------------
+
+    def resultados(self):
+        """(coincidencias, sobrante DIAN, sobrante contabilidad), igual que el cruce completo."""
+        if self.cont.empty or self.dian.empty:
+            return pd.DataFrame(), self.dian, self.cont.drop(columns=['LLAVE_CONT'], errors='ignore')
+
+        coinc = (
+            self.coinc.sort_values('_POS_DIAN', kind='stable')
+            .drop(columns=['_POS_DIAN'])
+            .reset_index(drop=True)
+        )
+        # Una fila DIAN sobra si su llave no tiene líneas contables, y viceversa
+        return coinc, self.dian[~self.llave_en_cont[self.cod_dian]], self.cont[~self.llave_en_dian[self.cod_cont]]
+
+    def df_cont_agg(self):
+        """Agregado contable por documento en el formato de ejecutar_conciliacion_universal."""
+        return self.cont_agg.sort_index().reset_index()
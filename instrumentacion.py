@@ -0,0 +1,189 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# =================================================================
+# INSTRUMENTACIÓN POR ETAPAS (tiempo, filas, memoria)
+# =================================================================
+# Desactivada por defecto: cada etapa cuesta una comparación. Se activa con
+# ORDEN_INSTRUMENTACION=1 (ORDEN_INSTRUMENTACION=memoria para medir además el
+# pico de memoria con tracemalloc) o, por hilo, llamando a activar().
+# Cada registro se emite como una línea JSON por el logger 'orden.etapas'.
+# tracemalloc solo corre mientras haya alguna etapa midiendo memoria y se
+# detiene al terminar la última. Su pico es global al proceso: si otro hilo
+# (otra sesión) midió memoria durante la etapa, el registro lleva
+# 'memoria_compartida' y su pico incluye lo de ese hilo.
+
+logger = logging.getLogger('orden.etapas')
+
+_modo = os.environ.get('ORDEN_INSTRUMENTACION', '0').lower()
+ACTIVO = _modo not in ('', '0', 'false', 'no')
+MEDIR_MEMORIA = _modo == 'memoria'
+
+# Streamlit corre cada sesión en su propio hilo: activación y registros por hilo
+# (ACTIVO / MEDIR_MEMORIA son solo el valor por defecto).
+_local = threading.local()
+
+# Etapas que miden memoria en todo el proceso (tracemalloc es global)
+_lock_memoria = threading.Lock()
+_memoria = {'activas': {}, 'entradas': 0, 'iniciado_aqui': False}  # activas: hilo -> etapas abiertas
+
+
+def activo():
+    return getattr(_local, 'activo', ACTIVO)
+
+
+def midiendo_memoria():
+    return getattr(_local, 'memoria', MEDIR_MEMORIA)
+
+
+def activar(memoria=False):
+    _local.activo, _local.memoria = True, memoria
+
+
+def desactivar():
+    _local.activo, _local.memoria = False, False
+
+
+def registros():
+    """Registros de etapas del hilo actual (lista de dicts)."""
+    if not hasattr(_local, 'registros'): _local.registros = []
+    return _local.registros
+
+
+def limpiar():
+    registros().clear()
+
+
+def _pila():
+    if not hasattr(_local, 'pila'): _local.pila = []
+    return _local.pila
+
+
+def _filas(obj):
+    """Filas de un DataFrame/Series, o la suma de las de una tupla de ellos."""
+    if isinstance(obj, (tuple, list)):
+        tamanos = [_filas(o) for o in obj]
+        tamanos = [t for t in tamanos if t is not None]
+        return sum(tamanos) if tamanos else None
+    if hasattr(obj, 'shape') and hasattr(obj, 'index'):
+        return len(obj)
+    return None
+
+
+@contextmanager
+def etapa(nombre, filas_entrada=None):
+    """
+    Mide un bloque. El dict entregado permite fijar 'filas_salida' (u otros datos) desde dentro:
+        with etapa('cruce', len(df)) as info: ...; info['filas_salida'] = len(res)
+    """
+    if not activo():
+        yield {}
+        return
+
+    info = {'etapa': nombre, 'filas_entrada': filas_entrada, 'filas_salida': None}
+    pila = _pila()
+    medir_memoria = midiendo_memoria()
+    if medir_memoria:
+        info['_compartida'] = _entrar_memoria()
+        actual, pico = tracemalloc.get_traced_memory()
+        # El pico del padre se conserva antes de reiniciarlo para esta etapa
+        if pila: pila[-1]['_pico'] = max(pila[-1]['_pico'], pico)
+        tracemalloc.reset_peak()
+        info['_inicio_mem'], info['_pico'] = actual, actual
+    info['nivel'] = len(pila)
+    pila.append(info)
+    registros().append(info)  # en orden de inicio: el padre antes que sus etapas internas
+    inicio = time.perf_counter()
+    try:
+        yield info
+    except Exception as e:
+        info['error'] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        info['segundos'] = round(time.perf_counter() - inicio, 4)
+        pila.pop()
+        if medir_memoria:
+            pico = max(info.pop('_pico'), tracemalloc.get_traced_memory()[1])
+            info['memoria_pico_mb'] = round((pico - info.pop('_inicio_mem')) / 2**20, 2)
+            if pila: pila[-1]['_pico'] = max(pila[-1]['_pico'], pico)
+            if _salir_memoria(info.pop('_compartida')): info['memoria_compartida'] = True
+        logger.info(json.dumps(info, ensure_ascii=False, default=str))
+
+
+def _entrar_memoria():
+    """Abre una etapa con memoria (arranca tracemalloc si es la primera). Devuelve su marca de concurrencia."""
+    hilo = threading.get_ident()
+    with _lock_memoria:
+        activas = _memoria['activas']
+        if not activas and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _memoria['iniciado_aqui'] = True
+        otras = any(h != hilo for h in activas)
+        activas[hilo] = activas.get(hilo, 0) + 1
+        _memoria['entradas'] += 1
+        propias = getattr(_local, 'entradas_memoria', 0) + 1
+        _local.entradas_memoria = propias
+        return otras, _memoria['entradas'], propias
+
+
+def _salir_memoria(marca):
+    """Cierra la etapa; detiene tracemalloc con la última. True si otro hilo midió memoria a la vez."""
+    otras_al_entrar, entradas, propias = marca
+    hilo = threading.get_ident()
+    with _lock_memoria:
+        activas = _memoria['activas']
+        # Entradas de otros hilos mientras la etapa estaba abierta
+        otras = otras_al_entrar or (_memoria['entradas'] - entradas) > (_local.entradas_memoria - propias)
+        otras = otras or any(h != hilo for h in activas)
+        activas[hilo] -= 1
+        if not activas[hilo]: del activas[hilo]
+        if not activas and _memoria['iniciado_aqui']:
+            tracemalloc.stop()
+            _memoria['iniciado_aqui'] = False
+    return otras
+
+
+def instrumentar(nombre=None):
+    """Decorador: registra la función como etapa (filas de entrada = primer DataFrame, salida = resultado)."""
+    def decorador(funcion):
+        nombre_etapa = nombre or funcion.__name__
+
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            if not activo(): return funcion(*args, **kwargs)
+            entrada = next((f for f in map(_filas, args) if f is not None), None)
+            with etapa(nombre_etapa, entrada) as info:
+                resultado = funcion(*args, **kwargs)
+                info['filas_salida'] = _filas(resultado)
+            return resultado
+        return envoltura
+    return decorador
+
+
+def a_json_lines(lista=None):
+    """Registros como JSON lines (una etapa por línea) para el pipeline de logs."""
+    lista = registros() if lista is None else lista
+    return '\n'.join(json.dumps(r, ensure_ascii=False, default=str) for r in lista)
+
+
+def mostrar_panel_streamlit(titulo="⏱️ Rendimiento por etapa"):
+    """Panel opcional en la barra lateral con las etapas de la ejecución actual."""
+    import pandas as pd
+    import streamlit as st
+
+    lista = registros()
+    with st.sidebar.expander(titulo, expanded=False):
+        if not lista:
+            st.caption("Sin etapas registradas en esta ejecución.")
+            return
+        tabla = pd.DataFrame(lista)
+        tabla['etapa'] = ['  ' * n + e for n, e in zip(tabla['nivel'], tabla['etapa'])]
+        columnas = [c for c in ['etapa', 'segundos', 'filas_entrada', 'filas_salida', 'memoria_pico_mb', 'memoria_compartida', 'error'] if c in tabla.columns]
+        st.dataframe(tabla[columnas], hide_index=True, use_container_width=True)
+        st.download_button("Descargar JSON lines", a_json_lines(lista), file_name="etapas.jsonl", mime="application/json")
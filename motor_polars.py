@@ -0,0 +1,208 @@
+import numpy as np
+import pandas as pd
+
+try:
+    import polars as pl
+    DISPONIBLE = True
+except ImportError:  # backend opcional: pip install polars pyarrow
+    pl = None
+    DISPONIBLE = False
+
+import engine
+
+# =================================================================
+# BACKEND POLARS (CONSULTA LAZY) PARA EL PIPELINE DE CONCILIACIÓN
+# =================================================================
+# Mismo recorrido que el backend pandas de engine.conciliar_flujo
+# (filtros del flujo -> cruce por llave -> frame unificado) armado como un
+# solo plan lazy: Polars empuja filtros y proyecciones, corre las
+# operaciones de texto y los joins en varios hilos y comparte los subplanes
+# comunes al resolver las cuatro salidas con collect_all. Todo vuelve a
+# pandas solo al final, para el generador de reportes.
+# Los nulos siguen la semántica de pandas 3 (astype(str) los conserva): una
+# llave nula no cruza y no entra al sobrante contable.
+
+
+def _a_polars(df):
+    """pandas -> LazyFrame. Las columnas object con tipos mezclados pasan a texto (como astype(str))."""
+    try:
+        return pl.from_pandas(df).lazy()
+    except (TypeError, ValueError):
+        df = df.copy()
+        for col in df.columns[df.dtypes == object]:
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+        return pl.from_pandas(df).lazy()
+
+
+def _texto(col):
+    return pl.col(col).cast(pl.String)
+
+
+# --- Normalizadores (equivalentes a los de engine) ---
+
+def normalizar_llave(expr):
+    return expr.str.replace_all(r'[^\w]+', '').str.to_uppercase()
+
+
+def clean_nit_numeric(expr):
+    return expr.str.replace_all(r'[^0-9]+', '')
+
+
+def standardize_company_name(expr):
+    return (
+        expr.str.to_uppercase()
+        .str.replace_all(r'[^A-Z0-9\s]+', '')
+        .str.replace_all(r'\s+', ' ')
+        .str.strip_chars()
+        .str.replace_all(r'\b(S A S|SAS|S A|SA|LTDA|LTDA|BIC|B I C)\b', '')
+        .str.strip_chars()
+    )
+
+
+def _numero(col):
+    """Como pd.to_numeric(errors='coerce').fillna(0)."""
+    return pl.col(col).cast(pl.Float64, strict=False).fill_null(0.0)
+
+
+# --- Filtros por flujo (filtrar_dian_* / filtrar_solo_*) ---
+
+def filtrar_dian(lf, flujo):
+    col_grupo = next((c for c in lf.collect_schema().names() if 'grupo' in c), None)
+    if not col_grupo: return lf
+    palabra = 'emitido' if flujo == 'ingresos' else 'recibido'
+    return lf.filter(_texto(col_grupo).str.to_lowercase().str.contains(palabra, literal=True).fill_null(False))
+
+
+def filtrar_contabilidad(lf, flujo):
+    if flujo == 'ingresos':
+        digito, excluir = '4', '(?i)DIFERENCIA EN CAMBIO'
+    else:
+        digito, excluir = '5', '(?i)DIFERENCIA EN CAMBIO|DEPRECIACI'
+    lf = lf.filter(
+        _texto('CODIGO_CUENTA').str.starts_with(digito).fill_null(False)
+        & ~_texto('u_acctname').str.contains(excluir).fill_null(False)
+    )
+    if flujo == 'ingresos':
+        lf = lf.with_columns(pl.col('u_saldo_f') * -1)  # Invertir signo ingresos
+    return lf
+
+
+# --- Cruce (conciliar_por_codigos) ---
+
+def _agregar_contabilidad(cont):
+    """Una fila por LLAVE_CONT, con las mismas reglas que AGG_CONTABILIDAD (first ignora nulos)."""
+    aggs = [pl.col(c).sum() if f == 'sum' else pl.col(c).drop_nulls().first()
+            for c, f in engine.AGG_CONTABILIDAD.items()]
+    return cont.filter(pl.col('LLAVE_CONT').is_not_null()).group_by('LLAVE_CONT').agg(aggs)
+
+
+def cruzar(dian, cont):
+    """LazyFrames (coincidencias, sobrante_dian, sobrante_cont). dian trae _pos; cont, _fila."""
+    agg = _agregar_contabilidad(cont)
+    repetidas = set(dian.collect_schema().names()) & set(agg.collect_schema().names())
+    izq = dian.rename({c: f"{c}_DIAN" for c in repetidas})
+    der = agg.rename({c: f"{c}_CONT" for c in repetidas})
+    llave_izq = 'LLAVE_DIAN_DIAN' if 'LLAVE_DIAN' in repetidas else 'LLAVE_DIAN'
+    llave_der = 'LLAVE_CONT_CONT' if 'LLAVE_CONT' in repetidas else 'LLAVE_CONT'
+    # La llave derecha se duplica porque el join descarta su columna de cruce
+    coinc = (izq.join(der.with_columns(pl.col(llave_der).alias('_LLAVE')), left_on=llave_izq, right_on='_LLAVE', how='inner')
+             .sort('_pos').drop('_pos'))
+    sob_dian = dian.join(agg.select(pl.col('LLAVE_CONT').alias('_LLAVE')), left_on='LLAVE_DIAN', right_on='_LLAVE', how='anti').sort('_pos')
+    sob_cont = (cont.filter(pl.col('LLAVE_CONT').is_not_null())
+                .join(dian.select(pl.col('LLAVE_DIAN').alias('_LLAVE')).unique(), left_on='LLAVE_CONT', right_on='_LLAVE', how='anti')
+                .sort('_fila'))
+    return coinc, sob_dian, sob_cont
+
+
+# --- Frame unificado (preparar_datos_unificados) ---
+
+def _valor_neto_dian(columnas, col_total, col_iva):
+    valor = _numero(col_total)
+    if col_iva and col_iva in columnas:
+        valor = valor - _numero(col_iva)
+    return valor
+
+
+def unificar(coinc, sob_dian, sob_cont, cols_dian_map, compacto=False):
+    col_total = cols_dian_map.get('total', 'total_bruto')
+    col_emisor = cols_dian_map.get('emisor', 'nombre_emisor')
+    col_iva = cols_dian_map.get('iva', 'iva')
+    partes = []
+
+    # 1. COINCIDENCIAS
+    columnas = coinc.collect_schema().names()
+    empresa = pl.col(col_emisor) if col_emisor in columnas else pl.col('u_cardname')
+    partes.append(coinc.with_columns(
+        NIT=clean_nit_numeric(_texto('u_infoco01')), EMPRESA=empresa,
+    ).with_columns(
+        EMPRESA_GRUPO=standardize_company_name(_texto('EMPRESA')),
+        VALOR_DIAN=_valor_neto_dian(columnas, col_total, col_iva), VALOR_CONT=pl.col('u_saldo_f'),
+    ).with_columns(
+        DIFERENCIA=pl.col('VALOR_DIAN') - pl.col('VALOR_CONT'), TIPO=pl.lit('COINCIDENCIA'),
+        LLAVE=pl.col('LLAVE_DIAN'), CUENTA=pl.col('u_acctname'),
+    ))
+
+    # 2. SOBRANTE DIAN
+    columnas = sob_dian.collect_schema().names()
+    col_nit = next((c for c in columnas if 'nit' in c or 'identificaci' in c), None)
+    partes.append(sob_dian.drop('_pos').with_columns(
+        NIT=clean_nit_numeric(_texto(col_nit)) if col_nit else pl.lit(''),
+        EMPRESA=pl.col(col_emisor) if col_emisor in columnas else pl.lit('DESCONOCIDO'),
+    ).with_columns(
+        EMPRESA_GRUPO=standardize_company_name(_texto('EMPRESA')),
+        VALOR_DIAN=_valor_neto_dian(columnas, col_total, col_iva), VALOR_CONT=pl.lit(0.0),
+    ).with_columns(
+        DIFERENCIA=pl.col('VALOR_DIAN'), TIPO=pl.lit('SOBRANTE DIAN'), LLAVE=pl.col('LLAVE_DIAN'), CUENTA=pl.lit(''),
+    ))
+
+    # 3. SOBRANTE CONTABILIDAD
+    partes.append(sob_cont.drop('_fila').with_columns(
+        NIT=clean_nit_numeric(_texto('u_infoco01')), EMPRESA=pl.col('u_cardname'),
+        EMPRESA_GRUPO=standardize_company_name(_texto('u_cardname')),
+        VALOR_DIAN=pl.lit(0.0), VALOR_CONT=pl.col('u_saldo_f'), DIFERENCIA=-pl.col('u_saldo_f'),
+        TIPO=pl.lit('SOBRANTE CONT'), LLAVE=pl.col('LLAVE_CONT'), CUENTA=pl.col('u_acctname'),
+    ))
+
+    df = pl.concat(partes, how='diagonal_relaxed')
+    minimo = 1
+    if compacto:
+        # Centavos int64 como engine.a_centavos; la DIFERENCIA queda exacta
+        centavos = [(pl.col(c).cast(pl.Float64).fill_null(0.0) * 100).round(0).cast(pl.Int64) for c in ('VALOR_DIAN', 'VALOR_CONT')]
+        df = df.with_columns(*centavos).with_columns(DIFERENCIA=pl.col('VALOR_DIAN') - pl.col('VALOR_CONT'))
+        minimo = 100
+    # Filtrar basura muy pequeña
+    return df.filter((pl.col('VALOR_DIAN').abs() > minimo) | (pl.col('VALOR_CONT').abs() > minimo))
+
+
+# =================================================================
+# PUNTO DE ENTRADA
+# =================================================================
+
+def conciliar_flujo(df_dian, df_cont, flujo='gastos', compacto=False):
+    """
+    Versión Polars de engine.conciliar_flujo (mismas entradas y salidas en pandas):
+    (coincidencias, sobrante_dian, sobrante_cont, df_final).
+    """
+    cols_dian_map = engine.resolver_columnas_dian(df_dian, flujo)
+    dian = filtrar_dian(_a_polars(df_dian), flujo).with_row_index('_pos')
+    cont = filtrar_contabilidad(_a_polars(df_cont).with_row_index('_fila'), flujo)
+
+    if 'LLAVE_DIAN' not in df_dian.columns:  # sin llave no hay cruce, como en ejecutar_conciliacion_universal
+        sob_dian, sob_cont = pl.collect_all([dian, cont])
+        return (pd.DataFrame(), sob_dian.drop('_pos').to_pandas(),
+                sob_cont.drop('_fila').to_pandas().set_axis(df_cont.index[sob_cont['_fila'].to_numpy()], axis=0),
+                pd.DataFrame())
+
+    cont = cont.with_columns(LLAVE_CONT=normalizar_llave(_texto('u_ref')))
+    coinc, sob_dian, sob_cont = cruzar(dian, cont)
+    final = unificar(coinc, sob_dian, sob_cont, cols_dian_map, compacto)
+
+    # Un solo collect para las cuatro salidas (subplanes comunes una vez)
+    coinc, sob_dian, sob_cont, final = pl.collect_all([coinc, sob_dian, sob_cont, final])
+    df_sob_dian = sob_dian.drop('_pos').to_pandas().set_axis(pd.Index(sob_dian['_pos'].to_numpy().astype(np.int64)), axis=0)
+    df_sob_cont = sob_cont.drop('_fila').to_pandas().set_axis(df_cont.index[sob_cont['_fila'].to_numpy()], axis=0)
+    df_final = final.to_pandas()
+    if compacto and not df_final.empty:
+        df_final = engine._categorizar_texto(df_final)
+        df_final.attrs['columnas_centavos'] = list(engine.COLUMNAS_DINERO)
+    return coinc.to_pandas(), df_sob_dian, df_sob_cont, df_final
@@ -0,0 +1,185 @@
+import atexit
+import functools
+import glob
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import cache_disco
+
+# =================================================================
+# NORMALIZACIÓN MEMORIZADA (valores únicos + memo persistente)
+# =================================================================
+# Nombres, NITs y llaves se repiten muchísimo: cada columna se factoriza,
+# la función de limpieza corre solo sobre los valores únicos que no estén
+# ya en el memo (crudo -> normalizado) y el resultado se expande con los
+# códigos. El memo es un LRU acotado por normalizador, compartido entre
+# flujos y sesiones, y se guarda junto al caché en disco. Cada memo lleva la
+# huella del código de su normalizador (huella_funcion): si la función cambia,
+# sus entradas guardadas se descartan al cargar. VERSION_MEMO cubre lo que la
+# huella no ve (funciones auxiliares o constantes de módulo que usen
+# clean_nit_numeric, standardize_company_name o normalizar_llave) y el formato
+# del archivo: subirla descarta todos los memos.
+# Columnas casi sin repetidos (llaves de documento) no pasan por el memo: ahí
+# el recorrido por valor único cuesta más que limpiar la columna entera.
+# El memo se escribe al disco al salir del proceso o con guardar_memos().
+
+LIMITE_ENTRADAS = int(os.environ.get('ORDEN_MEMO_ENTRADAS', '200000'))
+PERSISTIR = os.environ.get('ORDEN_MEMO_DISCO', '1') != '0'
+FRACCION_UNICOS_MAX = 0.5  # por encima, la columna se limpia entera sin memo
+MUESTRA_UNICOS = 10_000     # filas iniciales con las que se estima la fracción de únicos
+VERSION_MEMO = 2
+
+_memos = {}            # nombre -> OrderedDict(crudo -> normalizado)
+_huellas = {}          # nombre -> huella del normalizador que llenó el memo
+_disco = None          # contenido del archivo de memos, leído una vez por proceso
+_pendientes = set()    # memos con entradas nuevas sin guardar
+_lock = threading.Lock()
+
+
+def _ruta_memo():
+    return os.path.join(cache_disco.DIRECTORIO, f"normalizacion-v{VERSION_MEMO}.pkl")
+
+
+def huella_funcion(funcion):
+    """Hash del bytecode, constantes (incluidas las regex) y nombres usados por la función."""
+    h = hashlib.sha256(funcion.__qualname__.encode())
+
+    def agregar(codigo):
+        h.update(codigo.co_code)
+        h.update(repr(codigo.co_names).encode())
+        for constante in codigo.co_consts:
+            if hasattr(constante, 'co_code'): agregar(constante)
+            else: h.update(repr(constante).encode())
+
+    agregar(funcion.__code__)
+    return h.hexdigest()
+
+
+def _leer_disco():
+    """Memos del disco (una sola vez por proceso); borra los de otras versiones."""
+    global _disco
+    if _disco is not None: return _disco
+    _disco = {}
+    if not PERSISTIR: return _disco
+    ruta = _ruta_memo()
+    for vieja in glob.glob(os.path.join(cache_disco.DIRECTORIO, 'normalizacion-v*.pkl')):
+        if vieja != ruta:
+            try: os.remove(vieja)
+            except OSError: pass
+    try:
+        with open(ruta, 'rb') as f:
+            _disco = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+        pass
+    return _disco
+
+
+def _memo(nombre, huella):
+    """Memo del normalizador; las entradas del disco solo valen si la huella coincide."""
+    memo = _memos.get(nombre)
+    if memo is None or _huellas.get(nombre) != huella:
+        guardado = _leer_disco().get(nombre) or {}
+        entradas = guardado.get('entradas', ()) if guardado.get('huella') == huella else ()
+        memo = _memos[nombre] = OrderedDict(entradas)
+        _huellas[nombre] = huella
+    return memo
+
+
+def guardar_memos():
+    """Escribe los memos con entradas nuevas (escritura atómica). Corre sola al salir del proceso."""
+    if not PERSISTIR or not _pendientes: return
+    with _lock:
+        # Los memos no usados en este proceso se conservan tal como estaban en el disco
+        datos = dict(_leer_disco())
+        datos.update({nombre: {'huella': _huellas[nombre], 'entradas': list(memo.items())}
+                      for nombre, memo in _memos.items()})
+        _pendientes.clear()
+    tmp = None
+    try:
+        os.makedirs(cache_disco.DIRECTORIO, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=cache_disco.DIRECTORIO, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(datos, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, _ruta_memo())
+    except OSError:
+        if tmp:
+            try: os.remove(tmp)
+            except OSError: pass
+
+
+atexit.register(guardar_memos)
+
+
+def limpiar_memos():
+    with _lock:
+        _memos.clear()
+        _huellas.clear()
+        _pendientes.clear()
+
+
+def normalizar_unicos(nombre, funcion, serie):
+    """
+    Aplica `funcion` (Series -> Series, elemento a elemento) solo a los valores
+    únicos de `serie` que no estén memorizados y expande el resultado.
+    """
+    muestra = serie.iloc[:MUESTRA_UNICOS]
+    if muestra.nunique(dropna=False) > FRACCION_UNICOS_MAX * len(muestra):
+        return pd.Series(funcion(serie), index=serie.index, name=serie.name, dtype=str)
+
+    codigos, unicos = pd.factorize(serie)
+    unicos = np.asarray(unicos, dtype=object)
+
+    huella = _huella_cacheada(funcion)
+    with _lock:
+        memo = _memo(nombre, huella)
+        normalizados = np.empty(len(unicos), dtype=object)
+        faltan = []
+        for i, crudo in enumerate(unicos):
+            if crudo in memo:  # los nulos nunca se memorizan (NaN != NaN)
+                normalizados[i] = memo[crudo]
+                memo.move_to_end(crudo)
+            else:
+                faltan.append(i)
+
+    if faltan:
+        nuevos = funcion(pd.Series(unicos[faltan], dtype=object)).to_numpy(dtype=object)
+        normalizados[faltan] = nuevos
+        with _lock:
+            for i, valor in zip(faltan, nuevos):
+                crudo = unicos[i]
+                if isinstance(crudo, str) and isinstance(valor, str):  # NIT numéricos: 1 == 1.0
+                    memo[crudo] = valor
+            while len(memo) > LIMITE_ENTRADAS:
+                memo.popitem(last=False)
+            _pendientes.add(nombre)
+
+    resultado = normalizados[codigos] if len(unicos) else np.empty(len(codigos), dtype=object)
+    # Los nulos (código -1) se normalizan aparte: factorize junta None y NaN
+    nulos = codigos < 0
+    if nulos.any():
+        resultado[nulos] = funcion(pd.Series(serie.to_numpy(dtype=object)[nulos], dtype=object)).to_numpy(dtype=object)
+    return pd.Series(resultado, index=serie.index, name=serie.name, dtype=str)
+
+
+@functools.lru_cache(maxsize=None)
+def _huella_cacheada(funcion):
+    return huella_funcion(funcion)
+
+
+def memorizada(nombre):
+    """Decorador para funciones de limpieza Series -> Series que operan elemento a elemento."""
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(serie):
+            if serie is None or serie.empty: return funcion(serie)
+            return normalizar_unicos(nombre, funcion, serie)
+        envoltura.sin_memo = funcion
+        return envoltura
+    return decorador
@@ -0,0 +1,74 @@
+import numpy as np
+
+# =================================================================
+# PAGINACIÓN DE REPORTES QUE NO CABEN EN UNA HOJA
+# =================================================================
+# Una hoja de Excel admite 1.048.576 filas. Antes de escribir nada se
+# planea dónde cortar el flujo de filas del reporte (detalles, subtotales
+# N2 y N1): se prefiere cortar al cerrar un grupo N1, si un N1 no cabe solo
+# se corta al cerrar un N2 y, como último recurso, en cualquier fila.
+
+LIMITE_FILAS_EXCEL = 1_048_576
+MAX_FILAS_HOJA = LIMITE_FILAS_EXCEL - 1  # la fila 0 es el encabezado
+MAX_NOMBRE_HOJA = 31
+
+
+def cortes_por_grupos(tam_n2, cod_n1_de_n2):
+    """
+    Posiciones de corte (fila siguiente al cierre) en el flujo detalle + subtotales:
+    (cortes_n1, cortes_n2, filas_sin_gran_total). tam_n2 = filas de detalle de cada
+    grupo N2 en orden; cod_n1_de_n2 = grupo N1 (0, 1, ...) de cada N2.
+    """
+    tam_n2 = np.asarray(tam_n2, dtype=np.int64)
+    cod_n1_de_n2 = np.asarray(cod_n1_de_n2, dtype=np.int64)
+    if not len(tam_n2):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), 0
+    n2 = np.arange(len(tam_n2))
+    cortes_n2 = np.cumsum(tam_n2) + n2 + 1 + cod_n1_de_n2
+    ultimo_n2 = np.flatnonzero(np.r_[cod_n1_de_n2[1:] != cod_n1_de_n2[:-1], True])
+    cortes_n1 = cortes_n2[ultimo_n2] + 1
+    return cortes_n1, cortes_n2, int(cortes_n1[-1])
+
+
+def planear_partes(total_filas, cortes_n1, cortes_n2=(), max_filas=MAX_FILAS_HOJA):
+    """Lista de (inicio, fin) sobre el flujo de filas, cada tramo con a lo sumo max_filas."""
+    cortes_n1, cortes_n2 = np.asarray(cortes_n1), np.asarray(cortes_n2)
+    partes, inicio = [], 0
+    while total_filas - inicio > max_filas:
+        limite = inicio + max_filas
+        fin = limite
+        for cortes in (cortes_n1, cortes_n2):
+            i = np.searchsorted(cortes, limite, side='right') - 1
+            if i >= 0 and cortes[i] > inicio:
+                fin = int(cortes[i])
+                break
+        partes.append((inicio, fin))
+        inicio = fin
+    partes.append((inicio, total_filas))
+    return partes
+
+
+def planear_reporte(filas_sin_gran_total, cortes_n1, cortes_n2=(), max_filas=MAX_FILAS_HOJA):
+    """
+    Decisión única de paginación: (partes, con_indice). Si el flujo con su gran total
+    cabe en una hoja, una sola parte que incluye la fila del gran total; si no, las
+    partes cubren solo el flujo (aunque sea una) y el gran total va a la hoja índice.
+    """
+    if filas_sin_gran_total + 1 <= max_filas:
+        return [(0, filas_sin_gran_total + 1)], False
+    return planear_partes(filas_sin_gran_total, cortes_n1, cortes_n2, max_filas), True
+
+
+def nombres_hojas(base, n_partes):
+    """Nombre de hoja por parte, dentro del límite de 31 caracteres de Excel."""
+    if n_partes == 1: return [base[:MAX_NOMBRE_HOJA]]
+    nombres = []
+    for i in range(1, n_partes + 1):
+        sufijo = f" ({i})"
+        nombres.append(base[:MAX_NOMBRE_HOJA - len(sufijo)] + sufijo)
+    return nombres
+
+
+def nombre_indice(base):
+    sufijo = " - ÍNDICE"
+    return base[:MAX_NOMBRE_HOJA - len(sufijo)] + sufijo
@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache_disco
+import normalizacion
+
+
+@pytest.fixture(autouse=True)
+def sin_cache_en_disco(monkeypatch):
+    """Las pruebas no leen ni escriben los caches persistentes del usuario."""
+    monkeypatch.setattr(cache_disco, 'ACTIVO', False)
+    monkeypatch.setattr(normalizacion, 'PERSISTIR', False)
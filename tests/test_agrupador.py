@@ -0,0 +1,43 @@
+import datetime
+
+import pandas as pd
+import pytest
+
+from benchmarks.generadores import escribir_xlsx
+import agrupador
+
+
+def _libro(tmp_path, n=230):
+    filas = [['Cuenta', 'Monto', 'Nota', 'Mixto', 'Fecha']]
+    for i in range(n):
+        filas.append([f"C{i % 7}" if i % 5 else None,
+                      i if i < 100 else i + 0.5,
+                      'x' if i < 40 else None,
+                      'a' if i < 100 else i,
+                      datetime.datetime(2024, 1, 1) + datetime.timedelta(days=i) if i < 60 else None])
+    return escribir_xlsx(filas, str(tmp_path / 'libro.xlsx'))
+
+
+@pytest.mark.parametrize('memoria_acotada', [False, True])
+def test_resultado_no_depende_del_tamano_de_bloque(tmp_path, monkeypatch, memoria_acotada):
+    monkeypatch.setattr(agrupador, 'TAMANO_BLOQUE', 50)
+    ruta = _libro(tmp_path)
+    with open(ruta, 'rb') as f:
+        base, filas = agrupador.leer_y_limpiar_por_bloques(f, 'Cuenta', tamano_bloque=50, memoria_acotada=memoria_acotada)
+        for tamano in (7, 64, 1000):
+            df, _ = agrupador.leer_y_limpiar_por_bloques(f, 'Cuenta', tamano_bloque=tamano, memoria_acotada=memoria_acotada)
+            pd.testing.assert_frame_equal(df, base)
+            tamanos = [len(b) for b, _, _ in agrupador.leer_excel_por_bloques(f, tamano, memoria_acotada=memoria_acotada)]
+            assert set(tamanos[:-1]) <= {tamano} and sum(tamanos) == filas
+
+    assert filas == 230
+    assert base['Monto'].dtype == 'float64'
+    assert pd.api.types.is_datetime64_any_dtype(base['Fecha'])
+
+
+def test_motores_de_lectura_coinciden(tmp_path, monkeypatch):
+    monkeypatch.setattr(agrupador, 'TAMANO_BLOQUE', 50)
+    with open(_libro(tmp_path), 'rb') as f:
+        calamine, _ = agrupador.leer_y_limpiar_por_bloques(f, tamano_bloque=30, memoria_acotada=False)
+        openpyxl, _ = agrupador.leer_y_limpiar_por_bloques(f, tamano_bloque=30, memoria_acotada=True)
+    pd.testing.assert_frame_equal(calamine, openpyxl)
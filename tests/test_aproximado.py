@@ -0,0 +1,84 @@
+import pandas as pd
+
+import engine
+
+MAPA = {'total': 'total', 'iva': 'iva', 'emisor': 'nombre_emisor', 'nit': 'nit_emisor', 'fecha': 'fecha_emision'}
+
+
+def _dian(*filas):
+    """Filas (llave, nit, total, fecha dd-mm-aaaa) como sobrante DIAN."""
+    return pd.DataFrame([{'LLAVE_DIAN': llave, 'nit_emisor': nit, 'nombre_emisor': 'PROVEEDOR SAS',
+                          'total': str(total), 'iva': '0', 'fecha_emision': fecha}
+                         for llave, nit, total, fecha in filas])
+
+
+def _cont(*filas):
+    """Filas (llave, nit, saldo, fecha aaaa-mm-dd) como sobrante contable."""
+    return pd.DataFrame([{'LLAVE_CONT': llave, 'u_saldo_f': float(saldo), 'u_infoco01': nit,
+                          'u_cardname': 'Proveedor', 'u_acctname': '51350501 Servicios', 'Fecha': pd.Timestamp(fecha)}
+                         for llave, nit, saldo, fecha in filas])
+
+
+def _parejas(aprox):
+    return dict(zip(aprox['LLAVE_DIAN'], aprox['LLAVE_CONT']))
+
+
+def test_valor_cercano_fuera_de_ventana_no_tapa_al_valido():
+    dian = _dian(('FE1', '900', 1000, '15-01-2024'))
+    cont = _cont(('EXACTO_TARDE', '900', 1000, '2024-06-10'), ('CERCA', '900', 1010, '2024-01-16'))
+    aprox, resto_dian, resto_cont = engine.conciliar_aproximado(dian, cont, MAPA, tolerancia=50, ventana_dias=30)
+
+    assert _parejas(aprox) == {'FE1': 'CERCA'}
+    assert resto_dian.empty
+    assert resto_cont['LLAVE_CONT'].tolist() == ['EXACTO_TARDE']
+
+
+def test_empate_en_valor_gana_la_fecha_mas_cercana():
+    dian = _dian(('FE1', '900', 1000, '15-01-2024'))
+    cont = _cont(('LEJOS', '900', 1020, '2024-01-30'), ('CERCA', '900', 980, '2024-01-14'))
+    aprox, _, _ = engine.conciliar_aproximado(dian, cont, MAPA, tolerancia=50, ventana_dias=30)
+
+    assert _parejas(aprox) == {'FE1': 'CERCA'}
+    assert aprox['SCORE'].between(0, 1).all()
+
+
+def test_nit_distinto_no_cruza():
+    dian = _dian(('FE1', '900', 1000, '15-01-2024'))
+    cont = _cont(('OTRO', '800', 1000, '2024-01-15'))
+    aprox, resto_dian, resto_cont = engine.conciliar_aproximado(dian, cont, MAPA, tolerancia=50, ventana_dias=30)
+
+    assert aprox.empty
+    assert len(resto_dian) == 1 and len(resto_cont) == 1
+
+
+def test_cada_documento_contable_se_usa_una_sola_vez():
+    dian = _dian(('FE1', '900', 1000, '15-01-2024'), ('FE2', '900', 1005, '15-01-2024'))
+    cont = _cont(('A', '900', 1004, '2024-01-15'), ('B', '900', 1030, '2024-01-15'))
+    aprox, resto_dian, resto_cont = engine.conciliar_aproximado(dian, cont, MAPA, tolerancia=50, ventana_dias=30)
+
+    # FE2 está más cerca de A; FE1 se queda con B en la ronda siguiente
+    assert _parejas(aprox) == {'FE1': 'B', 'FE2': 'A'}
+    assert aprox['LLAVE_CONT'].is_unique
+    assert resto_dian.empty and resto_cont.empty
+
+
+def test_entradas_vacias():
+    dian = _dian(('FE1', '900', 1000, '15-01-2024'))
+    cont = _cont(('A', '900', 1000, '2024-01-15'))
+    for sob_dian, sob_cont in ((dian.iloc[:0], cont), (dian, cont.iloc[:0])):
+        aprox, resto_dian, resto_cont = engine.conciliar_aproximado(sob_dian, sob_cont, MAPA)
+        assert aprox.empty
+        assert len(resto_dian) == len(sob_dian) and len(resto_cont) == len(sob_cont)
+
+
+def test_preparar_datos_unificados_con_aproximadas():
+    dian = _dian(('FE1', '900', 1000, '15-01-2024'), ('FE2', '700', 50, '15-01-2024'))
+    cont = _cont(('A', '900', 990, '2024-01-20'))
+    aprox, resto_dian, resto_cont = engine.conciliar_aproximado(dian, cont, MAPA, tolerancia=50, ventana_dias=30)
+    df = engine.preparar_datos_unificados(pd.DataFrame(), resto_dian, resto_cont, MAPA, aprox=aprox)
+
+    fila = df[df['TIPO'] == 'COINCIDENCIA APROXIMADA'].iloc[0]
+    assert fila['LLAVE'] == 'FE1'
+    assert fila['DIFERENCIA'] == 10
+    assert 0 < fila['SCORE'] < 1
+    assert df['TIPO'].tolist().count('SOBRANTE DIAN') == 1
@@ -0,0 +1,34 @@
+import datetime
+
+from benchmarks.generadores import escribir_xlsx
+import engine
+
+
+def _mayor(cabecera):
+    return [
+        ['Mi Empresa S.A.S.'], ['Libro mayor por cuenta'], [],
+        cabecera,
+        ['51350501 Servicios públicos'],
+        [None, datetime.datetime(2024, 1, 5), 'FE-1', '900123456', 'Proveedor Uno', 'x', '1.234,50', None],
+        [None, datetime.datetime(2024, 1, 6), 'FE-2', '900123457', 'Proveedor Dos', 'y', None, '100,00'],
+        ['Total 51350501 Servicios públicos'],
+    ]
+
+
+def test_mayor_con_celda_de_cabecera_vacia(tmp_path):
+    cabecera = ['Cuenta', 'Fecha', 'Número de documento', 'Número Identificación', 'Nombre', None, 'Débito', 'Crédito']
+    df = engine.leer_contabilidad_completa(escribir_xlsx(_mayor(cabecera), str(tmp_path / 'mayor.xlsx')))
+
+    assert df is not None
+    assert 'Unnamed: 5' in df.columns
+    assert df['u_ref'].tolist() == ['FE-1', 'FE-2']
+    assert df['u_saldo_f'].tolist() == [1234.5, -100.0]
+    assert df['u_infoco01'].tolist() == ['900123456', '900123457']
+
+
+def test_mayor_con_cabecera_completa(tmp_path):
+    cabecera = ['Cuenta', 'Fecha', 'Número de documento', 'Número Identificación', 'Nombre', 'Memo', 'Débito', 'Crédito']
+    df = engine.leer_contabilidad_completa(escribir_xlsx(_mayor(cabecera), str(tmp_path / 'mayor.xlsx')))
+
+    assert df['u_acctname'].tolist() == ['51350501 Servicios públicos'] * 2
+    assert df['u_saldo_f'].sum() == 1134.5
@@ -0,0 +1,48 @@
+import threading
+
+import pytest
+
+import trabajos
+
+
+def _bloqueado(liberar, progreso):
+    liberar.wait(10)
+    progreso(1, 1)
+    return 'hecho'
+
+
+def _esperar_inicio(trabajo):
+    while trabajo.estado == trabajos.EN_COLA: threading.Event().wait(0.01)
+
+
+def test_cancelar_en_cola_libera_su_lugar(monkeypatch):
+    monkeypatch.setattr(trabajos, 'MAX_EN_COLA', 2)
+    liberar = threading.Event()
+    try:
+        corriendo = [trabajos.enviar(_bloqueado, liberar) for _ in range(trabajos.MAX_SIMULTANEOS)]
+        for trabajo in corriendo: _esperar_inicio(trabajo)
+        en_cola = [trabajos.enviar(_bloqueado, liberar) for _ in range(2)]
+        with pytest.raises(trabajos.ServidorOcupado):
+            trabajos.enviar(_bloqueado, liberar)
+
+        for trabajo in en_cola: trabajo.cancelar()
+        assert [t.estado for t in en_cola] == [trabajos.CANCELADO] * 2
+        assert all(not t.activo and t.terminado for t in en_cola)
+        nuevo = trabajos.enviar(_bloqueado, liberar)
+    finally:
+        liberar.set()
+    nuevo._futuro.result(10)
+    assert nuevo.estado == trabajos.LISTO and nuevo.resultado == 'hecho'
+    assert all(t.estado == trabajos.LISTO for t in corriendo)
+    assert all(t.estado == trabajos.CANCELADO and t.resultado is None for t in en_cola)
+
+
+def test_cancelar_trabajo_corriendo():
+    liberar = threading.Event()
+    trabajo = trabajos.enviar(_bloqueado, liberar)
+    _esperar_inicio(trabajo)
+    trabajo.cancelar()
+    assert trabajo.estado == trabajos.CORRIENDO
+    liberar.set()
+    trabajo._futuro.result(10)
+    assert trabajo.estado == trabajos.CANCELADO
@@ -0,0 +1,118 @@
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# =================================================================
+# COLA DE TRABAJOS EN SEGUNDO PLANO (GENERACIÓN DE REPORTES)
+# =================================================================
+# Un pool acotado y compartido por todas las sesiones del servidor: como
+# mucho MAX_SIMULTANEOS reportes se construyen a la vez y como mucho
+# MAX_EN_COLA esperan; el resto se rechaza con ServidorOcupado para que el
+# servidor siga respondiendo. La función del trabajo recibe `progreso`
+# (hechas, total); al cancelar, la siguiente llamada a progreso lanza
+# TrabajoCancelado y el trabajo termina limpiamente. Un trabajo cancelado
+# mientras espera pasa de inmediato a CANCELADO y deja su lugar en la cola.
+
+MAX_SIMULTANEOS = int(os.environ.get('ORDEN_TRABAJOS_MAX', '2'))
+MAX_EN_COLA = int(os.environ.get('ORDEN_TRABAJOS_COLA', '8'))
+RETENCION_SEGUNDOS = 3600  # trabajos terminados que nadie recogió
+
+EN_COLA, CORRIENDO, LISTO, ERROR, CANCELADO = 'EN COLA', 'CORRIENDO', 'LISTO', 'ERROR', 'CANCELADO'
+
+
+class TrabajoCancelado(Exception):
+    pass
+
+
+class ServidorOcupado(Exception):
+    pass
+
+
+class Trabajo:
+    """Estado de un trabajo; lo actualiza el hilo del pool y lo consulta la interfaz."""
+
+    def __init__(self, id_trabajo, descripcion):
+        self.id = id_trabajo
+        self.descripcion = descripcion
+        self.estado = EN_COLA
+        self.hechas, self.total = 0, None
+        self.resultado = None
+        self.error = None
+        self.creado = time.time()
+        self.terminado = None
+        self._cancelar = threading.Event()
+        self._futuro = None
+
+    def progreso(self, hechas, total=None):
+        """Callback para la función del trabajo; aquí se atiende la cancelación."""
+        if self._cancelar.is_set(): raise TrabajoCancelado()
+        self.hechas = hechas
+        if total is not None: self.total = total
+
+    @property
+    def fraccion(self):
+        return min(self.hechas / self.total, 1.0) if self.total else 0.0
+
+    @property
+    def activo(self):
+        return self.estado in (EN_COLA, CORRIENDO)
+
+    def cancelar(self):
+        with _lock:
+            self._cancelar.set()
+            if self.estado == EN_COLA:
+                self.estado = CANCELADO
+                self.terminado = time.time()
+                if self._futuro is not None: self._futuro.cancel()
+
+
+_pool = ThreadPoolExecutor(max_workers=MAX_SIMULTANEOS, thread_name_prefix='orden-trabajo')
+_trabajos = {}
+_ids = itertools.count(1)
+_lock = threading.Lock()
+
+
+def _ejecutar(trabajo, funcion, args, kwargs):
+    with _lock:
+        if trabajo._cancelar.is_set(): return  # cancelar() ya lo dejó en CANCELADO
+        trabajo.estado = CORRIENDO
+    try:
+        trabajo.resultado = funcion(*args, progreso=trabajo.progreso, **kwargs)
+        trabajo.estado = LISTO
+    except TrabajoCancelado:
+        trabajo.estado = CANCELADO
+    except Exception as e:
+        trabajo.error = f"{type(e).__name__}: {e}"
+        trabajo.estado = ERROR
+    trabajo.terminado = time.time()
+
+
+def enviar(funcion, *args, descripcion='', **kwargs):
+    """Encola funcion(*args, progreso=..., **kwargs) y devuelve su Trabajo."""
+    with _lock:
+        _purgar()
+        en_espera = sum(t.estado == EN_COLA for t in _trabajos.values())
+        if en_espera >= MAX_EN_COLA:
+            raise ServidorOcupado(f"Hay {en_espera} reportes en espera; intenta de nuevo en unos minutos.")
+        trabajo = Trabajo(next(_ids), descripcion)
+        _trabajos[trabajo.id] = trabajo
+    trabajo._futuro = _pool.submit(_ejecutar, trabajo, funcion, args, kwargs)
+    return trabajo
+
+
+def obtener(id_trabajo):
+    return _trabajos.get(id_trabajo)
+
+
+def olvidar(id_trabajo):
+    """Suelta el resultado de un trabajo ya recogido."""
+    with _lock:
+        _trabajos.pop(id_trabajo, None)
+
+
+def _purgar():
+    limite = time.time() - RETENCION_SEGUNDOS
+    for id_trabajo in [i for i, t in _trabajos.items() if t.terminado and t.terminado < limite]:
+        del _trabajos[id_trabajo]